@@ -2,6 +2,8 @@ from typing import Dict, Any, Union
 from pydantic import BaseModel
 from mcp import ClientSession
 import ast
+import asyncio
+from query_cache import normalize_query
 
 # Optional: import log from agent if shared, else define locally
 try:
@@ -20,6 +22,30 @@ class ToolCallResult(BaseModel):
     raw_response: Any
 
 
+class SpeculativeCall:
+    """A tool call started before the plan asks for it.
+
+    ``execute_tool`` uses its result when the plan makes the same call
+    (string arguments compared case- and whitespace-insensitively);
+    otherwise the caller cancels it and the result is dropped.
+    """
+
+    def __init__(self, session: ClientSession, tool_name: str, arguments: Dict[str, Any]):
+        self.tool_name = tool_name
+        self.arguments = arguments
+        self.task = asyncio.create_task(session.call_tool(tool_name, arguments=arguments))
+
+    @staticmethod
+    def _normalize(arguments: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: normalize_query(value) if isinstance(value, str) else value for key, value in arguments.items()}
+
+    def matches(self, tool_name: str, arguments: Dict[str, Any]) -> bool:
+        return tool_name == self.tool_name and self._normalize(arguments) == self._normalize(self.arguments)
+
+    def cancel(self):
+        self.task.cancel()
+
+
 def parse_function_call(response: str) -> tuple[str, Dict[str, Any]]:
     """Parses FUNCTION_CALL string into tool name and arguments."""
     try:
@@ -56,8 +82,9 @@ def parse_function_call(response: str) -> tuple[str, Dict[str, Any]]:
         raise
 
 
-async def execute_tool(session: ClientSession, tools: list[Any], response: str) -> ToolCallResult:
-    """Executes a FUNCTION_CALL via MCP tool session."""
+async def execute_tool(session: ClientSession, tools: list[Any], response: str,
+                       speculative: SpeculativeCall = None) -> ToolCallResult:
+    """Executes a FUNCTION_CALL via MCP tool session, reusing a matching speculative call."""
     try:
         tool_name, arguments = parse_function_call(response)
 
@@ -65,8 +92,12 @@ async def execute_tool(session: ClientSession, tools: list[Any], response: str)
         if not tool:
             raise ValueError(f"Tool '{tool_name}' not found in registered tools")
 
-        log("tool", f"⚙️ Calling '{tool_name}' with: {arguments}")
-        result = await session.call_tool(tool_name, arguments=arguments)
+        if speculative is not None and speculative.matches(tool_name, arguments):
+            log("tool", f"⚡ Using speculative '{tool_name}' call with: {arguments}")
+            result = await speculative.task
+        else:
+            log("tool", f"⚙️ Calling '{tool_name}' with: {arguments}")
+            result = await session.call_tool(tool_name, arguments=arguments)
 
         if hasattr(result, 'content'):
             if isinstance(result.content, list):
@@ -4,14 +4,15 @@ import threading
 import queue
 import time
 import asyncio
+import atexit
 import os
-import json
 from pathlib import Path
 import datetime
 from perception import extract_perception
 from memory import MemoryManager, MemoryItem
 from decision import generate_plan
-from action import execute_tool
+from action import execute_tool, SpeculativeCall
+from shards import open_chunks
 import re
 import pyautogui
 
@@ -24,6 +25,10 @@ except ImportError:
 
 # Maximum steps in the agent's reasoning loop
 MAX_STEPS = 3
+# Start search_documents on the raw user query while the first step is still being planned
+SPECULATIVE_SEARCH = os.getenv("AGENT_SPECULATIVE_SEARCH", "1") == "1"
+# Seconds the MCP server may take to answer a health check or to shut down
+MCP_PING_TIMEOUT = 5
 
 class AgentTab:
     def __init__(self, parent):
@@ -32,6 +37,14 @@ class AgentTab:
         self.agent = None
         self.output_queue = queue.Queue()
         self.running = False
+        # One MCP server process and session, kept across queries on a long-lived event loop
+        self.loop = None
+        self.session = None
+        self.tools = []
+        self.tool_descriptions = ""
+        self._session_task = None
+        self._session_stop = None
+        self._session_lock = None
         self.setup_ui()
         
     def setup_ui(self):
@@ -213,10 +226,8 @@ class AgentTab:
     def run_agent_thread(self, text):
         """Run the agent loop in a background thread"""
         try:
-            # Create and run event loop
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            loop.run_until_complete(self.agent_loop(text))
+            # Runs on the tab's event loop, which owns the MCP session
+            asyncio.run_coroutine_threadsafe(self.agent_loop(text), self.event_loop()).result()
         except Exception as e:
             self.output_queue.put(("error", f"Error in agent thread: {str(e)}\n"))
         finally:
@@ -332,6 +343,86 @@ class AgentTab:
         # Add to output queue (thread-safe)
         self.output_queue.put((tag, log_msg))
 
+    def event_loop(self):
+        """The event loop that agent runs and the MCP session live on, started on first use"""
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+            threading.Thread(target=self.loop.run_forever, daemon=True).start()
+            atexit.register(self.shutdown)
+        return self.loop
+
+    async def _serve_session(self, ready):
+        """Hold the MCP server process and session open until asked to stop"""
+        server_params = StdioServerParameters(
+            command="python",
+            args=["example3.py"],
+            cwd=os.getcwd()
+        )
+        try:
+            # The session's contexts must be entered and exited by the same task
+            async with stdio_client(server_params) as (read, write):
+                async with ClientSession(read, write) as session:
+                    await session.initialize()
+                    tools = (await session.list_tools()).tools
+                    self.tools = tools
+                    self.tool_descriptions = "\n".join(
+                        f"- {tool.name}: {getattr(tool, 'description', 'No description')}"
+                        for tool in tools
+                    )
+                    self.session = session
+                    ready.set_result(session)
+                    await self._session_stop.wait()
+        except Exception as e:
+            if not ready.done():
+                ready.set_exception(e)
+            else:
+                self.log_ui("error", f"MCP session closed: {str(e)}")
+        finally:
+            self.session = None
+
+    async def get_session(self):
+        """Return the running MCP session, starting the server on first use or after it stopped answering"""
+        if self._session_lock is None:
+            self._session_lock = asyncio.Lock()
+        async with self._session_lock:
+            if self.session is not None:
+                try:
+                    await asyncio.wait_for(self.session.send_ping(), MCP_PING_TIMEOUT)
+                    return self.session
+                except Exception as e:
+                    self.log_ui("error", f"MCP server not responding, restarting it: {str(e) or type(e).__name__}")
+                    await self.close_session()
+            self.log_ui("agent", "Starting MCP server...")
+            self._session_stop = asyncio.Event()
+            ready = asyncio.get_running_loop().create_future()
+            self._session_task = asyncio.create_task(self._serve_session(ready))
+            session = await ready
+            self.log_ui("agent", f"MCP session initialized, {len(self.tools)} tools loaded: "
+                                 f"{', '.join(tool.name for tool in self.tools)}")
+            return session
+
+    async def close_session(self):
+        """Stop the MCP server process"""
+        if self._session_task is None:
+            return
+        self._session_stop.set()
+        try:
+            await asyncio.wait_for(self._session_task, MCP_PING_TIMEOUT)
+        except Exception:
+            self._session_task.cancel()
+        self._session_task = None
+        self.session = None
+
+    def shutdown(self):
+        """Close the MCP session and stop the event loop; called at exit"""
+        if self.loop is None or not self.loop.is_running():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.close_session(), self.loop).result(timeout=2 * MCP_PING_TIMEOUT)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
     async def agent_loop(self, user_input: str):
         """Core agent loop that matches the functionality of agent.py"""
         try:
@@ -341,122 +432,106 @@ class AgentTab:
             if not HAS_MCP:
                 self.log_ui("error", "MCP library not available. Please install it with: pip install mcp-client")
                 return
-                
-            server_params = StdioServerParameters(
-                command="python",
-                args=["example3.py"],
-                cwd=os.getcwd()
-            )
 
             try:
-                async with stdio_client(server_params) as (read, write):
-                    self.log_ui("agent", "Connection established, creating session...")
+                session = await self.get_session()
+            except Exception as e:
+                self.log_ui("error", f"Could not start MCP server: {str(e)}")
+                session = None
+
+            if session is not None:
+                tools = self.tools
+                tool_descriptions = self.tool_descriptions
+
+                memory = MemoryManager()
+                session_id = f"session-{int(time.time())}"
+                query = user_input  # Store original intent
+                step = 0
+
+                while step < MAX_STEPS and self.running:
+                    self.log_ui("loop", f"Step {step + 1} started")
+                    self.log_ui("agent", f"User input: {user_input}")
+
+                    # Most document questions end in this search; it runs while the step is planned
+                    speculative = None
+                    if step == 0 and SPECULATIVE_SEARCH and any(t.name == "search_documents" for t in tools):
+                        speculative = SpeculativeCall(session, "search_documents", {"query": user_input})
+
+                    # LLM calls are async; the blocking embedding call runs on a thread so the session keeps being served
+                    perception, retrieved = await asyncio.gather(
+                        extract_perception(user_input),
+                        asyncio.to_thread(memory.retrieve, query=user_input, top_k=3, session_filter=session_id),
+                    )
+                    self.log_ui("perception", f"Intent: {perception.intent}, Tool hint: {perception.tool_hint}")
+                    self.log_ui("memory", f"Retrieved {len(retrieved)} relevant memories")
+
+                    plan = await generate_plan(perception, retrieved, tool_descriptions=tool_descriptions)
+                    self.log_ui("plan", f"Plan generated: {plan}")
+
+                    if plan.startswith("FINAL_ANSWER:"):
+                        if speculative is not None:
+                            speculative.cancel()
+                        # Extract source file information if it exists
+                        self.add_open_file_button(plan)
+                        # source_file = None
+                        # chunk_id = None
+                        # if "Source:" in plan:
+                        #     try:
+                        #         # Extract the source file from the format "Source: filename, Chunk ID: chunk_id"
+                        #         source_info = plan.split("Source:")[1].strip()
+                        #         if "," in source_info:
+                        #             source_parts = source_info.split(",")
+                        #             source_file = source_parts[0].strip()
+                        #             self.log_ui("agent", f"Source file: {source_file}")
+                        #             # Extract chunk ID if it exists
+                        #             for part in source_parts[1:]:
+                        #                 if "Chunk ID:" in part or "ChunkID:" in part or "Chunk:" in part:
+                        #                     chunk_id = part.split(":", 1)[1].strip()
+                        #                     break
+                        #         else:
+                        #             source_file = source_info.strip()
+
+                        #         # Remove any trailing characters
+                        #         if " " in source_file:
+                        #             source_file = source_file.split(" ")[0].strip()
+
+                        #         # The source file might be in the documents folder
+                        #         if not os.path.exists(source_file) and os.path.exists(os.path.join("documents", source_file)):
+                        #             source_file = os.path.join("documents", source_file)
+                        #     except Exception as e:
+                        #         self.log_ui("error", f"Error parsing source file: {str(e)}")
+
+                        # Log the final result - keep the FINAL_RESULT format as requested
+                        self.log_ui("agent", f"✅ FINAL RESULT: {plan}")
+
+                        # If we found a source file, add a button to open it
+                        break
+
+
                     try:
-                        async with ClientSession(read, write) as session:
-                            self.log_ui("agent", "Session created, initializing...")
-    
-                            try:
-                                await session.initialize()
-                                self.log_ui("agent", "MCP session initialized")
-                                # Your reasoning, planning, perception etc. would go here
-                                tools = await session.list_tools()
-                                self.log_ui("Available tools:", [t.name for t in tools.tools])
-
-                                # Get available tools
-                                tools_result = await session.list_tools()
-                                tools = tools_result.tools
-                                tool_descriptions = "\n".join(
-                                    f"- {tool.name}: {getattr(tool, 'description', 'No description')}" 
-                                    for tool in tools
-                                )
-
-                                self.log_ui("agent", f"{len(tools)} tools loaded")
-
-                                memory = MemoryManager()
-                                session_id = f"session-{int(time.time())}"
-                                query = user_input  # Store original intent
-                                step = 0
-
-                                while step < MAX_STEPS and self.running:
-                                    self.log_ui("loop", f"Step {step + 1} started")
-                                    self.log_ui("agent", f"User input: {user_input}")
-                                    perception = extract_perception(user_input)
-                                    self.log_ui("perception", f"Intent: {perception.intent}, Tool hint: {perception.tool_hint}")
-
-                                    retrieved = memory.retrieve(query=user_input, top_k=3, session_filter=session_id)
-                                    self.log_ui("memory", f"Retrieved {len(retrieved)} relevant memories")
-
-                                    plan = generate_plan(perception, retrieved, tool_descriptions=tool_descriptions)
-                                    self.log_ui("plan", f"Plan generated: {plan}")
-
-                                    if plan.startswith("FINAL_ANSWER:"):
-                                        # Extract source file information if it exists
-                                        self.add_open_file_button(plan)
-                                        # source_file = None
-                                        # chunk_id = None
-                                        # if "Source:" in plan:
-                                        #     try:
-                                        #         # Extract the source file from the format "Source: filename, Chunk ID: chunk_id"
-                                        #         source_info = plan.split("Source:")[1].strip()
-                                        #         if "," in source_info:
-                                        #             source_parts = source_info.split(",")
-                                        #             source_file = source_parts[0].strip()
-                                        #             self.log_ui("agent", f"Source file: {source_file}")
-                                        #             # Extract chunk ID if it exists
-                                        #             for part in source_parts[1:]:
-                                        #                 if "Chunk ID:" in part or "ChunkID:" in part or "Chunk:" in part:
-                                        #                     chunk_id = part.split(":", 1)[1].strip()
-                                        #                     break
-                                        #         else:
-                                        #             source_file = source_info.strip()
-                                                
-                                        #         # Remove any trailing characters
-                                        #         if " " in source_file:
-                                        #             source_file = source_file.split(" ")[0].strip()
-                                                
-                                        #         # The source file might be in the documents folder
-                                        #         if not os.path.exists(source_file) and os.path.exists(os.path.join("documents", source_file)):
-                                        #             source_file = os.path.join("documents", source_file)
-                                        #     except Exception as e:
-                                        #         self.log_ui("error", f"Error parsing source file: {str(e)}")
-                                        
-                                        # Log the final result - keep the FINAL_RESULT format as requested
-                                        self.log_ui("agent", f"✅ FINAL RESULT: {plan}")
-                                        
-                                        # If we found a source file, add a button to open it
-                                        break
-                                        
-
-                                    try:
-                                        result = await execute_tool(session, tools, plan)
-                                        self.log_ui("tool", f"{result.tool_name} returned: {result.result}")
-
-                                        memory.add(MemoryItem(
-                                            text=f"Tool call: {result.tool_name} with {result.arguments}, got: {result.result}",
-                                            type="tool_output",
-                                            tool_name=result.tool_name,
-                                            user_query=user_input,
-                                            tags=[result.tool_name],
-                                            session_id=session_id
-                                        ))
-
-                                        user_input = f"Original task: {query}\nPrevious output: {result.result}\nWhat should I do next?"
-
-                                    except Exception as e:
-                                        self.log_ui("error", f"Tool execution failed: {e}")
-                                        break
-
-                                    step += 1
-                                    
-                                
-                            except Exception as e:
-                                self.log_ui("error", f"Session initialization error: {str(e)}")
-                                
+                        result = await execute_tool(session, tools, plan, speculative=speculative)
+                        self.log_ui("tool", f"{result.tool_name} returned: {result.result}")
+
+                        await asyncio.to_thread(memory.add, MemoryItem(
+                            text=f"Tool call: {result.tool_name} with {result.arguments}, got: {result.result}",
+                            type="tool_output",
+                            tool_name=result.tool_name,
+                            user_query=user_input,
+                            tags=[result.tool_name],
+                            session_id=session_id
+                        ))
+
+                        user_input = f"Original task: {query}\nPrevious output: {result.result}\nWhat should I do next?"
+
                     except Exception as e:
-                        self.log_ui("error", f"Session creation error: {str(e)}")
-                        
-            except Exception as e:
-                self.log_ui("error", f"Connection error: {str(e)}")
+                        self.log_ui("error", f"Tool execution failed: {e}")
+                        break
+                    finally:
+                        # Not asked for by the plan (or already consumed): drop it
+                        if speculative is not None:
+                            speculative.cancel()
+
+                    step += 1
                 
         except Exception as e:
             self.log_ui("error", f"Overall error: {str(e)}")
@@ -476,29 +551,21 @@ class AgentTab:
         self.running = False
 
     def load_metadata(self):
-        """Load metadata from the FAISS index to find chunks by ID"""
+        """Open the chunk store(s) next to the FAISS index to find chunks by ID"""
         try:
-            metadata_path = os.path.join("faiss_index", "metadata.json")
-            if not os.path.exists(metadata_path):
-                return None
-                
-            with open(metadata_path, 'r', encoding='utf-8') as f:
-                metadata = json.load(f)
-            return metadata
+            if getattr(self, "chunk_store", None) is None:
+                self.chunk_store = open_chunks("faiss_index")
+            return self.chunk_store
         except Exception as e:
             self.log_ui("error", f"Error loading metadata: {str(e)}")
             return None
     
     def find_chunk_by_id(self, chunk_id):
         """Find a specific chunk by its ID in the metadata"""
-        metadata = self.load_metadata()
-        if not metadata:
+        store = self.load_metadata()
+        if not store or not chunk_id:
             return None
-            
-        for item in metadata:
-            if item.get("chunk_id") == chunk_id:
-                return item
-        return None
+        return store.by_chunk_id(chunk_id)
     
     
     def add_open_file_button(self, plan):
@@ -522,12 +589,8 @@ class AgentTab:
                 else:
                     self.log_ui("warning", "Chunk ID not found.")
                     
-                with open("faiss_index/metadata.json", 'r', encoding='utf-8') as f:
-                    metadata = json.load(f)
-            
-                for entry in metadata:
-                    if entry.get("chunk_id") == chunk_id:
-                        data=entry.get("chunk")
+                entry = self.find_chunk_by_id(chunk_id)
+                data = entry.get("chunk") if entry else ""
 
                 self.log_ui("agent", f"Extracted chunk data: {data}")
                 # Open the file
@@ -0,0 +1,102 @@
+import os
+import sys
+import time
+import threading
+import subprocess
+from pathlib import Path
+
+# Configuration
+INDEXER_ENABLED = os.getenv("INDEXER_ENABLED", "1") == "1"
+INDEXER_INTERVAL = float(os.getenv("INDEXER_INTERVAL", "300"))  # seconds between passes, 0 runs once
+INDEXER_NICE = int(os.getenv("INDEXER_NICE", "10"))
+INDEXER_SCRIPT = Path(__file__).parent.resolve() / "process.py"
+
+
+def _low_priority():
+    # Runs in the child before exec; conversion workers it starts inherit the niceness
+    os.nice(INDEXER_NICE)
+
+
+class BackgroundIndexer:
+    """Runs incremental ingestion (``process.py``) as a separate low-priority process.
+
+    A pass runs when the indexer starts and then every ``interval`` seconds,
+    or right away after ``wake()``. Each pass only re-indexes changed files
+    and publishes new index generations, which ``SearchIndex`` picks up on
+    its own, so the process serving searches never does indexing work and
+    never waits for it. Passes never overlap, and a pass is skipped while
+    another writer, such as the monitor tab, holds the index's writer lock
+    (see ``ingest.WriterLock``). With ``enabled`` off (``INDEXER_ENABLED=0``)
+    ``start()`` does nothing.
+    """
+
+    def __init__(self, log=None, interval=INDEXER_INTERVAL, script=INDEXER_SCRIPT, enabled=INDEXER_ENABLED):
+        self.enabled = enabled
+        self.log = log
+        self.interval = interval
+        self.script = Path(script)
+        self.process = None
+        self.passes = 0
+        self.last_exit = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        if not self.enabled:
+            return self
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, daemon=True, name="indexer")
+            self._thread.start()
+        return self
+
+    def wake(self):
+        """Start a pass now unless one is already running"""
+        self._wake.set()
+
+    def stop(self, timeout=10):
+        """Stop scheduling passes and end the one in progress, which commits a checkpoint on SIGTERM"""
+        self._stop.set()
+        self._wake.set()
+        process = self.process
+        if process is not None and process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _spawn(self):
+        kwargs = {}
+        if os.name == "nt":
+            kwargs["creationflags"] = subprocess.BELOW_NORMAL_PRIORITY_CLASS
+        else:
+            kwargs["preexec_fn"] = _low_priority
+        # stdout is the MCP stdio channel of the server process; progress goes to stderr
+        return subprocess.Popen([sys.executable, str(self.script)], cwd=str(self.script.parent),
+                                stdin=subprocess.DEVNULL, stdout=sys.stderr, **kwargs)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            start = time.monotonic()
+            try:
+                self.process = self._spawn()
+                self.last_exit = self.process.wait()
+                self.passes += 1
+                if self.log:
+                    level = "INFO" if self.last_exit == 0 else "ERROR"
+                    self.log(level, f"Background indexing pass finished in {time.monotonic() - start:.1f}s "
+                                    f"(exit code {self.last_exit})")
+            except Exception as e:
+                if self.log:
+                    self.log("ERROR", f"Background indexing failed to start: {e}")
+            finally:
+                self.process = None
+            self._wake.wait(self.interval if self.interval > 0 else None)
@@ -0,0 +1,429 @@
+"""Ingestion benchmark: synthetic corpus + stand-in embedding server + process_documents.
+
+    python benchmark_ingest.py --files 200 --mix txt=4,md=3,docx=1,pdf=1,csv=1 --latency 20
+
+Runs without Ollama or network access and prints files/s, chunks/s, embed
+request latency percentiles, peak RSS and index size.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import hashlib
+import zipfile
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+# Try to import optional dependencies
+try:
+    import resource
+    HAS_RESOURCE = True
+except ImportError:
+    HAS_RESOURCE = False
+
+# Configuration
+DEFAULT_MIX = "txt=4,md=3,docx=1,pdf=1,csv=1"
+VOCABULARY_SIZE = 5000
+
+
+# ---------------------------------------------------------------------------
+# Synthetic corpus
+# ---------------------------------------------------------------------------
+
+def _vocabulary(rng):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choice(letters) for _ in range(rng.randint(2, 10))) for _ in range(VOCABULARY_SIZE)]
+
+
+def _paragraphs(rng, vocab, words):
+    """Yield paragraphs of 20-120 words until about `words` words are produced"""
+    while words > 0:
+        n = min(words, rng.randint(20, 120))
+        words -= n
+        sentence = " ".join(rng.choice(vocab) for _ in range(n))
+        yield sentence[0].upper() + sentence[1:] + "."
+
+
+def _write_txt(path, rng, vocab, words):
+    path.write_text("\n\n".join(_paragraphs(rng, vocab, words)), encoding="utf-8")
+
+
+def _write_md(path, rng, vocab, words):
+    parts = [f"# {' '.join(rng.choice(vocab) for _ in range(4)).title()}"]
+    for i, paragraph in enumerate(_paragraphs(rng, vocab, words)):
+        if i and i % 4 == 0:
+            parts.append(f"## {' '.join(rng.choice(vocab) for _ in range(3)).title()}")
+        parts.append(paragraph)
+    path.write_text("\n\n".join(parts), encoding="utf-8")
+
+
+def _write_csv(path, rng, vocab, words):
+    rows = ["id,name,category,amount,notes"]
+    for i in range(max(1, words // 8)):
+        notes = " ".join(rng.choice(vocab) for _ in range(5))
+        rows.append(f"{i},{rng.choice(vocab)},{rng.choice(vocab)},{rng.randint(1, 99999) / 100},{notes}")
+    path.write_text("\n".join(rows), encoding="utf-8")
+
+
+def _xml_escape(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _write_docx(path, rng, vocab, words):
+    # Smallest WordprocessingML package MarkItDown/mammoth accept
+    body = "".join(
+        f"<w:p><w:r><w:t>{_xml_escape(p)}</w:t></w:r></w:p>" for p in _paragraphs(rng, vocab, words)
+    )
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("[Content_Types].xml", (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/word/document.xml" ContentType='
+            '"application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+            '</Types>'))
+        z.writestr("_rels/.rels", (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+            'relationships/officeDocument" Target="word/document.xml"/>'
+            '</Relationships>'))
+        z.writestr("word/document.xml", (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+            f'<w:body>{body}</w:body></w:document>'))
+
+
+def _write_pdf(path, rng, vocab, words, line_words=12, page_lines=50):
+    # Hand-built PDF with Helvetica text pages, enough for pdfminer to extract
+    lines = []
+    for paragraph in _paragraphs(rng, vocab, words):
+        tokens = paragraph.split()
+        lines += [" ".join(tokens[i:i + line_words]) for i in range(0, len(tokens), line_words)]
+        lines.append("")
+    pages = [lines[i:i + page_lines] for i in range(0, len(lines), page_lines)] or [[""]]
+
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in pages:
+        text = "".join(f"({line.replace(chr(92), '').replace('(', '').replace(')', '')}) Tj T* " for line in page)
+        stream = f"BT /F1 10 Tf 14 TL 50 780 Td {text}ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    out, offsets = bytearray(b"%PDF-1.4\n"), []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    path.write_bytes(bytes(out))
+
+
+WRITERS = {"txt": _write_txt, "md": _write_md, "csv": _write_csv, "docx": _write_docx, "pdf": _write_pdf}
+
+
+def parse_mix(mix):
+    """'txt=4,pdf=1' -> {'txt': 4, 'pdf': 1}"""
+    weights = {}
+    for part in mix.split(","):
+        ext, _, weight = part.strip().partition("=")
+        if ext not in WRITERS:
+            raise ValueError(f"Unknown format '{ext}', expected one of {', '.join(WRITERS)}")
+        weights[ext] = float(weight or 1)
+    return weights
+
+
+def make_corpus(root, files=100, mix=DEFAULT_MIX, words=2000, seed=0):
+    """Write a synthetic corpus under root/docs and the matching root/visited_files.json"""
+    rng = random.Random(seed)
+    vocab = _vocabulary(rng)
+    weights = parse_mix(mix) if isinstance(mix, str) else mix
+    docs = Path(root) / "docs"
+    docs.mkdir(parents=True, exist_ok=True)
+
+    visited = []
+    formats = rng.choices(list(weights), weights=list(weights.values()), k=files)
+    for i, ext in enumerate(formats):
+        path = docs / f"doc_{i:05d}.{ext}"
+        WRITERS[ext](path, rng, vocab, max(50, int(rng.gauss(words, words / 4))))
+        st = path.stat()
+        visited.append({
+            "file_name": path.name,
+            "file_path": str(path.resolve()),
+            "extension": f".{ext}",
+            "size_kb": round(st.st_size / 1024, 2),
+            "last_modified": time.ctime(st.st_mtime),
+        })
+    (Path(root) / "visited_files.json").write_text(json.dumps(visited, indent=4), encoding="utf-8")
+    return visited
+
+
+# ---------------------------------------------------------------------------
+# Stand-in embedding server
+# ---------------------------------------------------------------------------
+
+def fake_vector(text, dim):
+    """Deterministic pseudo-embedding of a text"""
+    seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+    return np.random.default_rng(seed).standard_normal(dim, dtype=np.float32)
+
+
+class FakeEmbeddingServer:
+    """Ollama-compatible /api/embed and /api/embeddings endpoints with tunable latency.
+
+    Each request sleeps ``latency`` seconds plus ``per_text`` seconds per input,
+    scaled by a uniform +/- ``jitter`` fraction, before answering.
+    """
+
+    def __init__(self, dim=768, latency=0.02, per_text=0.0, jitter=0.2, host="127.0.0.1", port=0,
+                 legacy_only=False):
+        self.dim = dim
+        self.latency = latency
+        self.per_text = per_text
+        self.jitter = jitter
+        self.legacy_only = legacy_only
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/api/embed"
+
+    def _delay(self, n):
+        base = self.latency + self.per_text * n
+        time.sleep(max(0.0, base * (1 + random.uniform(-self.jitter, self.jitter))))
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if self.path == "/api/embed" and not server.legacy_only:
+                    texts = body.get("input", [])
+                    texts = [texts] if isinstance(texts, str) else texts
+                    server._delay(len(texts))
+                    reply = {"model": body.get("model"),
+                             "embeddings": [fake_vector(t, server.dim).tolist() for t in texts]}
+                elif self.path == "/api/embeddings":
+                    server._delay(1)
+                    reply = {"embedding": fake_vector(body.get("prompt", ""), server.dim).tolist()}
+                else:
+                    self.send_error(404)
+                    return
+                with server.lock:
+                    server.requests += 1
+                data = json.dumps(reply).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# ---------------------------------------------------------------------------
+# Driver
+# ---------------------------------------------------------------------------
+
+class TimedEmbedder:
+    """Records the wall time of every embedding request made through an EmbeddingClient"""
+
+    def __init__(self, embedder):
+        self.embedder = embedder
+        self.latencies = []
+        self.lock = threading.Lock()
+
+    @property
+    def batch_size(self):
+        return self.embedder.batch_size
+
+    @property
+    def model(self):
+        return self.embedder.model
+
+    def embed(self, texts, progress=None):
+        start = time.perf_counter()
+        vectors = self.embedder.embed(texts, progress=progress)
+        with self.lock:
+            self.latencies.append(time.perf_counter() - start)
+        return vectors
+
+    def embed_one(self, text):
+        return self.embed([text])[0]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its largest child, in MB"""
+    if not HAS_RESOURCE:
+        return None, None
+    # ru_maxrss is in bytes on macOS and KiB elsewhere
+    scale = 1 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1e6
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / 1e6
+    return own, children
+
+
+def index_size(index_dir):
+    """Bytes of the committed index generation plus chunk store, and of the whole directory"""
+    from vector_store import committed_paths
+    from chunk_store import CHUNK_STORE_FILE
+    from shards import read_manifest, SHARD_DIR
+    index_dir = Path(index_dir)
+    manifest = read_manifest(index_dir)
+    dirs = [index_dir / SHARD_DIR / name for name in manifest["shards"]] if manifest else [index_dir]
+    paths = [p for d in dirs for p in list(committed_paths(d).values()) + [d / CHUNK_STORE_FILE]]
+    committed = sum(p.stat().st_size for p in paths if p.exists())
+    total = sum(p.stat().st_size for p in index_dir.rglob("*") if p.is_file())
+    return committed, total
+
+
+def run_benchmark(root, server_url, batch_size=32, convert_workers=None, embed_workers=None,
+                  use_cache=True, force=False, log=None):
+    """Run process_documents on root once and return the measured figures"""
+    import ingest
+    from embeddings import EmbeddingClient
+
+    embedder = TimedEmbedder(EmbeddingClient(url=server_url, batch_size=batch_size))
+    kwargs = {}
+    if convert_workers is not None:
+        kwargs["convert_workers"] = convert_workers
+    if embed_workers is not None:
+        kwargs["embed_workers"] = embed_workers
+
+    start = time.perf_counter()
+    stats = ingest.process_documents(log=log or (lambda level, message: None), root=Path(root),
+                                     embedder=embedder, use_cache=use_cache, force=force, **kwargs)
+    ingest.wait_for_compaction(stats)
+    wall = time.perf_counter() - start
+
+    latencies = np.array(embedder.latencies) * 1000 if embedder.latencies else np.zeros(1)
+    own_rss, child_rss = peak_rss_mb()
+    committed, total = index_size(Path(root) / "faiss_index")
+    return {
+        "files": stats.files_done,
+        "failed": stats.files_failed,
+        "chunks": stats.chunks,
+        "seconds": round(wall, 3),
+        "files_per_s": round(stats.files_done / wall, 2),
+        "chunks_per_s": round(stats.chunks / wall, 1),
+        "mb_per_s": round(stats.bytes_in / wall / 1e6, 2),
+        "embed_requests": len(embedder.latencies),
+        "embed_p50_ms": round(float(np.percentile(latencies, 50)), 1),
+        "embed_p99_ms": round(float(np.percentile(latencies, 99)), 1),
+        "peak_rss_mb": round(own_rss, 1) if own_rss is not None else None,
+        "peak_child_rss_mb": round(child_rss, 1) if child_rss is not None else None,
+        "index_bytes": committed,
+        "index_dir_bytes": total,
+    }
+
+
+def format_report(name, result):
+    rss = "n/a" if result["peak_rss_mb"] is None else \
+        f"{result['peak_rss_mb']:.1f} MB (largest worker {result['peak_child_rss_mb']:.1f} MB)"
+    return "\n".join([
+        f"== {name} ==",
+        f"files        {result['files']} ({result['failed']} failed), {result['chunks']} chunks "
+        f"in {result['seconds']:.2f}s",
+        f"throughput   {result['files_per_s']:.2f} files/s, {result['chunks_per_s']:.1f} chunks/s, "
+        f"{result['mb_per_s']:.2f} MB/s",
+        f"embed        {result['embed_requests']} request(s), p50 {result['embed_p50_ms']:.1f} ms, "
+        f"p99 {result['embed_p99_ms']:.1f} ms",
+        f"peak RSS     {rss}",
+        f"index size   {result['index_bytes'] / 1e6:.2f} MB committed, "
+        f"{result['index_dir_bytes'] / 1e6:.2f} MB with caches",
+    ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark document ingestion against a stand-in embedding server")
+    parser.add_argument("--files", type=int, default=100, help="number of documents to generate")
+    parser.add_argument("--words", type=int, default=2000, help="mean words per document")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="format weights, e.g. txt=4,pdf=1")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dim", type=int, default=768, help="embedding dimension")
+    parser.add_argument("--latency", type=float, default=20, help="server latency per request in ms")
+    parser.add_argument("--per-text", type=float, default=0.5, help="extra server latency per text in ms")
+    parser.add_argument("--jitter", type=float, default=0.2, help="relative latency jitter")
+    parser.add_argument("--legacy-only", action="store_true", help="serve only /api/embeddings (one text per request)")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--convert-workers", type=int, default=None)
+    parser.add_argument("--embed-workers", type=int, default=None)
+    parser.add_argument("--no-cache", action="store_true", help="disable embedding and conversion caches")
+    parser.add_argument("--reindex", action="store_true", help="also time a forced re-index of the same corpus")
+    parser.add_argument("--workdir", default=None, help="directory for corpus and index (default: temporary)")
+    parser.add_argument("--keep", action="store_true", help="keep the working directory")
+    parser.add_argument("--json", default=None, help="write results to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="show ingestion log lines")
+    args = parser.parse_args(argv)
+
+    workdir = Path(args.workdir) if args.workdir else Path(tempfile.mkdtemp(prefix="ingest-bench-"))
+    log = None
+    if args.verbose:
+        import ingest
+        log = ingest.default_log
+
+    try:
+        start = time.perf_counter()
+        make_corpus(workdir, files=args.files, mix=args.mix, words=args.words, seed=args.seed)
+        print(f"Generated {args.files} file(s) in {workdir} ({time.perf_counter() - start:.1f}s)")
+
+        results = {}
+        with FakeEmbeddingServer(dim=args.dim, latency=args.latency / 1000, per_text=args.per_text / 1000,
+                                 jitter=args.jitter, legacy_only=args.legacy_only) as server:
+            runs = [("cold", False)] + ([("reindex", True)] if args.reindex else [])
+            for name, force in runs:
+                results[name] = run_benchmark(
+                    workdir, server.url, batch_size=args.batch_size, convert_workers=args.convert_workers,
+                    embed_workers=args.embed_workers, use_cache=not args.no_cache, force=force, log=log)
+                print(format_report(name, results[name]))
+
+        if args.json:
+            Path(args.json).write_text(json.dumps({"args": vars(args), "results": results}, indent=2),
+                                       encoding="utf-8")
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+        elif args.keep:
+            print(f"Kept {workdir}")
+
+
+if __name__ == "__main__":
+    main()
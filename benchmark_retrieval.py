@@ -0,0 +1,276 @@
+"""Retrieval benchmark: labelled queries sampled from the indexed chunks, per index type and chunking.
+
+    python benchmark_retrieval.py --queries 200 --k 10
+    python benchmark_retrieval.py --chunkings 256:40,128:20,512:64 --configs flat:float,hnsw:float,ivf_flat:sq8
+
+Documents are read back from the chunk store (or an old ``metadata.json``)
+and never modified. Each query is a run of words taken from a randomly
+picked stored chunk, some of them dropped, and is labelled with the byte
+span it came from; the relevant chunks of a chunking are those overlapping
+that span the most. Every chunking is embedded and searched exactly with a
+flat index for ground truth, then each index configuration reports
+recall@k and MRR against the labels, recall against the exact search,
+search latency percentiles and index memory.
+
+Embeddings come from a deterministic hashed bag-of-words stand-in, so the
+numbers are reproducible offline; ``--embed-url`` uses a real embedding
+server instead.
+"""
+import re
+import json
+import time
+import hashlib
+import argparse
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+import index_factory
+from ingest import chunk_spans, CHUNK_SIZE, CHUNK_OVERLAP
+from chunk_store import ChunkStore, join_chunks
+from lexical_index import tokenize
+from embeddings import normalize_rows
+from vector_store import committed_paths
+from shards import open_chunks, is_sharded
+
+# Configuration
+DEFAULT_CONFIGS = "flat:float,flat:sq8,ivf_flat:float,hnsw:float"
+DEFAULT_CHUNKINGS = f"{CHUNK_SIZE}:{CHUNK_OVERLAP},128:20,512:64"
+QUERY_WORDS = 8
+_WORD_RE = re.compile(rb"\S+")
+
+
+class HashingEmbedder:
+    """Deterministic stand-in embedder: signed feature hashing of the ``tokenize`` tokens, L2-normalised.
+
+    Texts sharing words get similar vectors, which is all the benchmark
+    needs to rank chunks without a model server.
+    """
+
+    def __init__(self, dim=256):
+        self.dim = dim
+        self.model = f"hashing-{dim}"
+        self.batch_size = 256
+
+    def _slot(self, token):
+        value = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+        return value % self.dim, 1.0 if value >> 63 else -1.0
+
+    def embed(self, texts, progress=None):
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts = {}
+            for token in tokenize(text):
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                slot, sign = self._slot(token)
+                matrix[row, slot] += sign * (1.0 + np.log(count))
+            if progress:
+                progress(1)
+        return normalize_rows(matrix)
+
+
+def load_documents(index_dir):
+    """[(file_path, text bytes, stored chunk spans)] of the indexed documents, read without writing anything"""
+    index_dir = Path(index_dir)
+    if is_sharded(index_dir) or ChunkStore.exists(index_dir):
+        chunks = open_chunks(index_dir)
+        try:
+            return list(chunks.documents())
+        finally:
+            chunks.close()
+    path = committed_paths(index_dir)["metadata"]
+    if not path.exists():
+        return []
+    # Layouts from before the chunk store kept every chunk's text in metadata.json
+    by_file = {}
+    for entry in json.loads(path.read_text(encoding="utf-8")):
+        by_file.setdefault(entry.get("file_path", entry["doc"]), []).append(entry["chunk"])
+    return [(file_path, *join_chunks(chunks)) for file_path, chunks in by_file.items()]
+
+
+def make_queries(documents, count, words=QUERY_WORDS, drop=0.25, seed=0):
+    """Sample (query text, file_path, start, end) labels: words of a random stored chunk, some of them dropped"""
+    rng = np.random.default_rng(seed)
+    chunks = [(doc, span) for doc, (_, _, spans) in enumerate(documents) for span in spans]
+    queries = []
+    for pick in rng.permutation(len(chunks))[:count]:
+        doc, (start, end) = chunks[pick]
+        file_path, body = documents[doc][:2]
+        spans = [m.span() for m in _WORD_RE.finditer(body, start, end)]
+        if not spans:
+            continue
+        first = int(rng.integers(0, max(1, len(spans) - words + 1)))
+        window = spans[first:first + words]
+        kept = [span for span in window if rng.random() >= drop] or window[:1]
+        text = " ".join(body[a:b].decode("utf-8", errors="ignore") for a, b in kept)
+        queries.append((text, file_path, window[0][0], window[-1][1]))
+    return queries
+
+
+def rechunk(documents, size, overlap):
+    """Chunk every document again; returns the chunk texts and their (file_path, start, end) spans"""
+    texts, spans = [], []
+    for file_path, body, _ in documents:
+        for start, end in chunk_spans(body, size, overlap):
+            texts.append(body[start:end].decode("utf-8", errors="ignore"))
+            spans.append((file_path, start, end))
+    return texts, spans
+
+
+def relevant_chunks(spans, queries):
+    """Per query, the IDs of the chunks of its document that overlap its span the most"""
+    by_file = {}
+    for vid, (file_path, start, end) in enumerate(spans):
+        by_file.setdefault(file_path, []).append((vid, start, end))
+    labels = []
+    for _, file_path, start, end in queries:
+        overlaps = {vid: min(end, b) - max(start, a) for vid, a, b in by_file.get(file_path, [])}
+        best = max(overlaps.values(), default=0)
+        labels.append({vid for vid, overlap in overlaps.items() if overlap == best and overlap > 0})
+    return labels
+
+
+def build(kind, encoding, vectors):
+    """An index of the given type over vectors (IDs are row numbers), trained on a sample if it needs it"""
+    n, dim = vectors.shape
+    sample = None
+    if index_factory.train_size(kind, encoding, n):
+        rng = np.random.default_rng(0)
+        sample = vectors[np.sort(rng.choice(n, index_factory.train_size(kind, encoding, n), replace=False))]
+    index = index_factory.new_index(kind, encoding, dim, n, sample)
+    index.add_with_ids(vectors, np.arange(n, dtype=np.int64))
+    return index
+
+
+def search(index, vectors, query, k, nprobe=None, ef_search=None):
+    """Top-k IDs of one query, re-ranked against the full-precision vectors like ``VectorStore.search``"""
+    lossy = index_factory.is_lossy(index)
+    fetch = min(index.ntotal, k * max(1, index_factory.INDEX_RERANK) if lossy else k)
+    params = index_factory.search_parameters(index, fetch, nprobe=nprobe, ef_search=ef_search)
+    _, ids = index.search(query.reshape(1, -1), fetch, params=params)
+    ids = ids[0][ids[0] >= 0]
+    if lossy and len(ids):
+        ids = ids[np.argsort(-(vectors[ids] @ query))]
+    return ids[:k]
+
+
+def score(found, labels, truth):
+    """recall@k and MRR against the labels, recall against the exact neighbours"""
+    hits, reciprocal, exact = 0, 0.0, 0.0
+    for ids, relevant, expected in zip(found, labels, truth):
+        ranks = [rank for rank, vid in enumerate(ids, start=1) if vid in relevant]
+        hits += bool(ranks)
+        reciprocal += 1.0 / ranks[0] if ranks else 0.0
+        exact += len(set(ids) & set(expected)) / max(len(expected), 1)
+    n = max(len(found), 1)
+    return hits / n, reciprocal / n, exact / n
+
+
+def evaluate(kind, encoding, vectors, queries, labels, truth, k, nprobe=None, ef_search=None):
+    start = time.perf_counter()
+    index = build(kind, encoding, vectors)
+    build_seconds = time.perf_counter() - start
+    size = len(faiss.serialize_index(index))
+    found, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        found.append(search(index, vectors, query, k, nprobe=nprobe, ef_search=ef_search).tolist())
+        latencies.append(time.perf_counter() - start)
+    recall_k, mrr, exact = score(found, labels, truth)
+    return {
+        "config": f"{index_factory.index_kind(index)}:{index_factory.index_encoding(index)}",
+        "recall": recall_k,
+        "mrr": mrr,
+        "exact_recall": exact,
+        "p50_ms": float(np.percentile(latencies, 50)) * 1000,
+        "p99_ms": float(np.percentile(latencies, 99)) * 1000,
+        "index_mb": size / 1e6,
+        "bytes_per_vector": size / max(len(vectors), 1),
+        "build_seconds": build_seconds,
+    }
+
+
+def run(documents, queries, embedder, chunkings, configs, k, nprobe=None, ef_search=None, log=print):
+    """Evaluate every chunking x configuration; returns one result dict per pair"""
+    query_vectors = np.ascontiguousarray(embedder.embed([text for text, *_ in queries]), dtype=np.float32)
+    results = []
+    for size, overlap in chunkings:
+        texts, spans = rechunk(documents, size, overlap)
+        vectors = np.ascontiguousarray(embedder.embed(texts), dtype=np.float32)
+        labels = relevant_chunks(spans, queries)
+        depth = min(k, len(texts))
+        exact = build("flat", "float", vectors)
+        _, truth = exact.search(query_vectors, depth)
+        log(f"chunking {size}:{overlap}: {len(texts)} chunk(s)")
+        for kind, encoding in configs:
+            try:
+                row = evaluate(kind, encoding, vectors, query_vectors, labels, truth, depth,
+                               nprobe=nprobe, ef_search=ef_search)
+            except Exception as e:
+                log(f"  {kind}:{encoding} failed: {e}")
+                continue
+            results.append(dict(row, chunking=f"{size}:{overlap}", chunks=len(texts), k=depth))
+    return results
+
+
+def format_table(results):
+    lines = [f"{'chunking':<10}{'config':<16}{'chunks':>8}{'recall@k':>10}{'MRR':>7}{'exact':>7}"
+             f"{'p50 ms':>8}{'p99 ms':>8}{'index MB':>10}{'bytes/vec':>10}"]
+    for row in results:
+        lines.append(f"{row['chunking']:<10}{row['config']:<16}{row['chunks']:>8}{row['recall']:>10.3f}"
+                     f"{row['mrr']:>7.3f}{row['exact_recall']:>7.3f}{row['p50_ms']:>8.3f}{row['p99_ms']:>8.3f}"
+                     f"{row['index_mb']:>10.2f}{row['bytes_per_vector']:>10.0f}")
+    return "\n".join(lines)
+
+
+def _pairs(text, convert):
+    pairs = []
+    for item in text.split(","):
+        first, _, second = item.strip().partition(":")
+        pairs.append(convert(first, second))
+    return pairs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure retrieval quality and latency per index type and chunking")
+    parser.add_argument("--index-dir", default=str(Path(__file__).parent.resolve() / "faiss_index"))
+    parser.add_argument("--configs", default=DEFAULT_CONFIGS, help="comma-separated type:encoding pairs")
+    parser.add_argument("--chunkings", default=DEFAULT_CHUNKINGS, help="comma-separated size:overlap pairs (words)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--query-words", type=int, default=QUERY_WORDS)
+    parser.add_argument("--drop", type=float, default=0.25, help="fraction of query words dropped")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dim", type=int, default=256, help="dimension of the stand-in embeddings")
+    parser.add_argument("--embed-url", default=None, help="embed with this server instead of the stand-in")
+    parser.add_argument("--nprobe", type=int, default=None)
+    parser.add_argument("--ef-search", type=int, default=None)
+    parser.add_argument("--json", default=None, help="write results to this JSON file")
+    args = parser.parse_args(argv)
+
+    documents = load_documents(args.index_dir)
+    if not documents:
+        raise SystemExit(f"No indexed documents in {args.index_dir}")
+    queries = make_queries(documents, args.queries, words=args.query_words, drop=args.drop, seed=args.seed)
+    if args.embed_url:
+        from embeddings import EmbeddingClient
+        embedder = EmbeddingClient(url=args.embed_url)
+    else:
+        embedder = HashingEmbedder(args.dim)
+    print(f"{len(documents)} document(s), {len(queries)} labelled queries, embeddings: {embedder.model}")
+
+    results = run(
+        documents, queries, embedder,
+        _pairs(args.chunkings, lambda size, overlap: (int(size), int(overlap or 0))),
+        _pairs(args.configs, lambda kind, encoding: (kind, encoding or "float")),
+        args.k, nprobe=args.nprobe, ef_search=args.ef_search,
+    )
+    print(format_table(results))
+    if args.json:
+        Path(args.json).write_text(json.dumps({"args": vars(args), "results": results}, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Cold-start benchmark of the MCP tool server: time from spawn to the ``initialize`` response.
+
+    python benchmark_startup.py --runs 5 --budget-ms 1500
+    python benchmark_startup.py --profile --top 25
+
+Spawns ``example3.py`` over stdio the way the agent tab does, sends an MCP
+``initialize`` request and times the reply. Exits with status 1 when the
+median is over ``--budget-ms``, so imports creeping back into the server's
+startup path fail the check. ``--profile`` runs the server once under
+``python -X importtime`` and lists the modules that took longest to
+import. The background indexer is switched off while measuring.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+
+# Configuration
+STARTUP_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "1500"))
+SERVER_SCRIPT = Path(__file__).parent.resolve() / "example3.py"
+INITIALIZE = {
+    "jsonrpc": "2.0",
+    "id": 1,
+    "method": "initialize",
+    "params": {
+        "protocolVersion": "2024-11-05",
+        "capabilities": {},
+        "clientInfo": {"name": "benchmark_startup", "version": "1.0"},
+    },
+}
+
+
+def time_to_initialize(server=SERVER_SCRIPT, importtime=False, timeout=60):
+    """Seconds from spawning the server to its initialize response, plus its stderr when importtime is set"""
+    server = Path(server)
+    args = [sys.executable] + (["-X", "importtime"] if importtime else []) + [str(server)]
+    env = dict(os.environ, INDEXER_ENABLED="0")
+    # A file rather than a pipe: -X importtime writes more than a pipe buffer holds before the reply
+    with tempfile.TemporaryFile() as stderr:
+        start = time.perf_counter()
+        process = subprocess.Popen(args, cwd=str(server.parent), env=env, stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE, stderr=stderr)
+        timer = threading.Timer(timeout, process.kill)
+        timer.start()
+        elapsed = None
+        try:
+            process.stdin.write(json.dumps(INITIALIZE).encode("utf-8") + b"\n")
+            process.stdin.flush()
+            for line in process.stdout:
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    continue  # anything but JSON-RPC on stdout is a bug the client has to skip
+                if message.get("id") == INITIALIZE["id"]:
+                    elapsed = time.perf_counter() - start
+                    break
+        finally:
+            timer.cancel()
+            process.stdin.close()
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        if elapsed is None:
+            raise RuntimeError(f"{server.name} exited or timed out before answering initialize")
+        stderr.seek(0)
+        return elapsed, stderr.read().decode("utf-8", errors="replace") if importtime else None
+
+
+def parse_importtime(text):
+    """(cumulative µs, self µs, module) for every line ``-X importtime`` wrote, slowest first"""
+    rows = []
+    for line in text.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        own, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        rows.append((int(cumulative), int(own), name))
+    return sorted(rows, reverse=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the MCP server's time to its first initialize response")
+    parser.add_argument("--server", default=str(SERVER_SCRIPT))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=STARTUP_BUDGET_MS, help="fail above this median")
+    parser.add_argument("--profile", action="store_true", help="report import time per module instead")
+    parser.add_argument("--top", type=int, default=25, help="modules to list with --profile")
+    parser.add_argument("--json", default=None, help="write results to this JSON file")
+    args = parser.parse_args(argv)
+
+    if args.profile:
+        elapsed, stderr = time_to_initialize(args.server, importtime=True)
+        rows = parse_importtime(stderr)
+        print(f"initialize after {elapsed * 1000:.0f} ms under -X importtime; {len(rows)} modules imported")
+        print(f"{'cumulative ms':>14}{'self ms':>10}  module")
+        for cumulative, own, name in rows[:args.top]:
+            print(f"{cumulative / 1000:>14.1f}{own / 1000:>10.1f}  {name}")
+        if args.json:
+            Path(args.json).write_text(json.dumps({
+                "elapsed_ms": elapsed * 1000,
+                "modules": [{"module": name.strip(), "cumulative_ms": c / 1000, "self_ms": o / 1000}
+                            for c, o, name in rows],
+            }, indent=2), encoding="utf-8")
+        return 0
+
+    times = sorted(time_to_initialize(args.server)[0] * 1000 for _ in range(args.runs))
+    median = times[len(times) // 2]
+    print(f"time to initialize over {len(times)} run(s): median {median:.0f} ms, "
+          f"min {times[0]:.0f} ms, max {times[-1]:.0f} ms (budget {args.budget_ms:.0f} ms)")
+    if args.json:
+        Path(args.json).write_text(json.dumps({"runs_ms": times, "median_ms": median, "budget_ms": args.budget_ms},
+                                              indent=2), encoding="utf-8")
+    if median > args.budget_ms:
+        print(f"FAIL: median startup {median:.0f} ms is over the {args.budget_ms:.0f} ms budget")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
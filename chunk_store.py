@@ -0,0 +1,270 @@
+import sqlite3
+import threading
+from pathlib import Path
+
+import numpy as np
+
+CHUNK_STORE_FILE = "chunks.sqlite"
+_COLUMNS = "id, chunk_id, doc, file_path, chunk, text_id, start_offset, end_offset"
+_ADDED_COLUMNS = {"text_id": "INTEGER", "start_offset": "INTEGER", "end_offset": "INTEGER", "vector": "BLOB"}
+
+
+def join_chunks(chunks):
+    """One newline-joined UTF-8 text for inline chunk texts, plus the (start, end) byte span of each"""
+    parts = [chunk.encode("utf-8") for chunk in chunks]
+    starts = np.cumsum([0] + [len(part) + 1 for part in parts[:-1]])
+    return b"\n".join(parts), [(int(a), int(a) + len(part)) for a, part in zip(starts, parts)]
+
+
+class ChunkStore:
+    """On-disk chunk metadata keyed by FAISS vector ID.
+
+    Rows are appended while documents are ingested and never rewritten as a
+    whole. Lookups go through SQLite's B-tree indexes: by vector ID (the
+    primary key), by ``chunk_id`` and by source document, so their cost does
+    not grow with the size of the corpus. Rows of replaced or deleted
+    documents are flagged dead and physically removed during compaction.
+
+    The converted text of each document is stored once in the ``texts``
+    table; chunk rows only hold ``(start, end)`` byte offsets into it, so
+    overlapping chunks don't duplicate any text on disk. Rows written before
+    offsets existed keep their text inline in the ``chunk`` column.
+
+    Each row also keeps the full-precision float32 embedding, which index
+    training and rebuilds read instead of reconstructing lossy index codes.
+
+    Writes become visible to other processes on ``commit()``, which the
+    vector store calls just before switching to a new index generation.
+    """
+
+    def __init__(self, path, readonly=False):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        if readonly:
+            self.conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self.conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                " id INTEGER PRIMARY KEY, chunk_id TEXT NOT NULL, doc TEXT NOT NULL,"
+                " file_path TEXT NOT NULL, chunk TEXT NOT NULL DEFAULT '', live INTEGER NOT NULL DEFAULT 1,"
+                " text_id INTEGER, start_offset INTEGER, end_offset INTEGER, vector BLOB)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS texts (id INTEGER PRIMARY KEY, file_path TEXT NOT NULL, body BLOB NOT NULL)"
+            )
+            existing = {row[1] for row in self.conn.execute("PRAGMA table_info(chunks)")}
+            for column, kind in _ADDED_COLUMNS.items():
+                if column not in existing:
+                    self.conn.execute(f"ALTER TABLE chunks ADD COLUMN {column} {kind}")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS chunks_chunk_id ON chunks (chunk_id)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS chunks_file_path ON chunks (file_path, id)")
+            self.conn.commit()
+
+    @classmethod
+    def open(cls, index_dir, readonly=False):
+        """Open the chunk store that lives next to the index in index_dir"""
+        return cls(Path(index_dir) / CHUNK_STORE_FILE, readonly=readonly)
+
+    @staticmethod
+    def exists(index_dir):
+        return (Path(index_dir) / CHUNK_STORE_FILE).exists()
+
+    def append(self, entries):
+        """Add chunk entries with inline text; IDs left over from an uncommitted run are overwritten"""
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO chunks (id, chunk_id, doc, file_path, chunk, live) VALUES (?, ?, ?, ?, ?, 1)",
+                [(e["id"], e["chunk_id"], e["doc"], e["file_path"], e["chunk"]) for e in entries]
+            )
+
+    def append_document(self, text_id, file_path, doc, body, spans, chunk_ids, vectors):
+        """Store a document's converted text once plus one offset row per chunk.
+
+        ``body`` is the UTF-8 text, ``spans`` the (start, end) byte offsets of
+        its chunks, ``vectors`` their embeddings, and chunk rows get the vector
+        IDs ``text_id``, ``text_id + 1``...
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO texts (id, file_path, body) VALUES (?, ?, ?)",
+                (text_id, str(file_path), body)
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO chunks"
+                " (id, chunk_id, doc, file_path, chunk, live, text_id, start_offset, end_offset, vector)"
+                " VALUES (?, ?, ?, ?, '', 1, ?, ?, ?, ?)",
+                [(text_id + i, chunk_id, doc, str(file_path), text_id, start, end, vectors[i].tobytes())
+                 for i, (chunk_id, (start, end)) in enumerate(zip(chunk_ids, spans))]
+            )
+
+    def put_vectors(self, ids, vectors):
+        """Fill in the embeddings of existing rows"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self.lock:
+            self.conn.executemany(
+                "UPDATE chunks SET vector = ? WHERE id = ?",
+                [(vector.tobytes(), int(vid)) for vid, vector in zip(ids, vectors)]
+            )
+
+    def find_vectors(self, ids):
+        """Return {id: vector} for the ids that still have a row"""
+        ids = [int(i) for i in ids]
+        found = {}
+        with self.lock:
+            for start in range(0, len(ids), 500):
+                part = ids[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT id, vector FROM chunks WHERE vector IS NOT NULL AND id IN ({','.join('?' * len(part))})",
+                    part
+                ).fetchall()
+                for vid, blob in rows:
+                    found[vid] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def get_vectors(self, ids):
+        """Full-precision embeddings of ids as an (n, dim) float32 matrix, in the order given"""
+        ids = [int(i) for i in ids]
+        found = {}
+        with self.lock:
+            for start in range(0, len(ids), 500):
+                part = ids[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT id, vector FROM chunks WHERE id IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                found.update(rows)
+        missing = [vid for vid in ids if found.get(vid) is None]
+        if missing:
+            raise KeyError(f"No stored vector for {len(missing)} chunk(s), e.g. ID {missing[0]}")
+        if not ids:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.stack([np.frombuffer(found[vid], dtype=np.float32) for vid in ids])
+
+    def mark_dead(self, start, end):
+        """Flag the rows of a replaced or deleted document's ID range"""
+        with self.lock:
+            self.conn.execute("UPDATE chunks SET live = 0 WHERE id >= ? AND id < ?", (start, end))
+
+    def delete(self, ids):
+        """Physically drop rows, used once their vectors are compacted away"""
+        ids = list(ids)
+        with self.lock:
+            for start in range(0, len(ids), 500):
+                part = ids[start:start + 500]
+                self.conn.execute(f"DELETE FROM chunks WHERE id IN ({','.join('?' * len(part))})", part)
+            self.conn.execute(
+                "DELETE FROM texts WHERE id NOT IN (SELECT text_id FROM chunks WHERE text_id IS NOT NULL)"
+            )
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+
+    def _read_span(self, text_id, start, end):
+        # Incremental blob I/O reads only the chunk's bytes, not the whole document
+        if hasattr(self.conn, "blobopen"):
+            with self.conn.blobopen("texts", "body", text_id, readonly=True) as blob:
+                blob.seek(start)
+                return blob.read(end - start).decode("utf-8")
+        row = self.conn.execute(
+            "SELECT substr(body, ?, ?) FROM texts WHERE id = ?", (start + 1, end - start, text_id)
+        ).fetchone()
+        return bytes(row[0]).decode("utf-8")
+
+    def _row_to_entry(self, row):
+        chunk = row[4] if row[5] is None else self._read_span(row[5], row[6], row[7])
+        return {"id": row[0], "chunk_id": row[1], "doc": row[2], "file_path": row[3], "chunk": chunk}
+
+    def passage(self, ids):
+        """Text covered by several chunk rows of one document, with their overlaps included once"""
+        ids = sorted(int(i) for i in ids)
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT text_id, start_offset, end_offset, chunk FROM chunks WHERE id IN ({','.join('?' * len(ids))})"
+                " ORDER BY id", ids
+            ).fetchall()
+            text_ids = {row[0] for row in rows}
+            if len(text_ids) == 1 and None not in text_ids:
+                return self._read_span(rows[0][0], min(row[1] for row in rows), max(row[2] for row in rows))
+        # Rows with inline text carry no offsets to merge on
+        return "\n".join(row[3] for row in rows)
+
+    def get(self, vid):
+        """Entry for one vector ID, or None"""
+        with self.lock:
+            row = self.conn.execute(
+                f"SELECT {_COLUMNS} FROM chunks WHERE id = ? AND live = 1", (int(vid),)
+            ).fetchone()
+            return self._row_to_entry(row) if row else None
+
+    def get_many(self, ids, live_only=True):
+        """Return {id: entry} for the rows among ids.
+
+        Readers that track tombstones themselves pass ``live_only=False``, so a
+        generation that is still in use keeps resolving rows that a newer
+        generation has already replaced.
+        """
+        ids = [int(i) for i in ids]
+        found = {}
+        live = "live = 1 AND " if live_only else ""
+        with self.lock:
+            for start in range(0, len(ids), 500):
+                part = ids[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT {_COLUMNS} FROM chunks WHERE {live}id IN ({','.join('?' * len(part))})",
+                    part
+                ).fetchall()
+                for row in rows:
+                    found[row[0]] = self._row_to_entry(row)
+        return found
+
+    def by_chunk_id(self, chunk_id):
+        """Most recent live entry with the given chunk_id, or None"""
+        with self.lock:
+            row = self.conn.execute(
+                f"SELECT {_COLUMNS} FROM chunks WHERE chunk_id = ? AND live = 1 ORDER BY id DESC LIMIT 1",
+                (chunk_id,)
+            ).fetchone()
+            return self._row_to_entry(row) if row else None
+
+    def by_document(self, file_path):
+        """Live entries of one source document in chunk order"""
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT {_COLUMNS} FROM chunks WHERE file_path = ? AND live = 1 ORDER BY id",
+                (str(file_path),)
+            ).fetchall()
+            return [self._row_to_entry(row) for row in rows]
+
+    def documents(self):
+        """Yield (file_path, text bytes, chunk spans) for every document with live chunks.
+
+        Rows with inline text are joined with newlines into one text per
+        document, with the spans computed to match.
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT text_id, file_path, start_offset, end_offset, chunk FROM chunks WHERE live = 1"
+                " ORDER BY file_path, id"
+            ).fetchall()
+        groups = {}
+        for row in rows:
+            groups.setdefault((row[0], row[1]), []).append(row)
+        for (text_id, file_path), group in groups.items():
+            if text_id is not None:
+                with self.lock:
+                    body = bytes(self.conn.execute("SELECT body FROM texts WHERE id = ?", (text_id,)).fetchone()[0])
+                yield file_path, body, [(row[2], row[3]) for row in group]
+                continue
+            yield (file_path, *join_chunks([row[4] for row in group]))
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM chunks WHERE live = 1").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
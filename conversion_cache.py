@@ -0,0 +1,84 @@
+import os
+import time
+import zlib
+import sqlite3
+import threading
+
+from embedding_cache import trim_lru
+
+# Configuration
+CONVERT_CACHE_MAX_BYTES = int(os.getenv("CONVERT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+CONVERT_CACHE_LEVEL = 6
+
+
+def converter_version():
+    """Version of the installed MarkItDown, part of every cache key"""
+    try:
+        from importlib.metadata import version
+        return version("markitdown")
+    except Exception:
+        return "unknown"
+
+
+class ConversionCache:
+    """Persistent content hash -> converted text store, zlib-compressed.
+
+    Keys combine the converter version with the file's content digest, so a
+    file is only converted again when its bytes or MarkItDown change. Least
+    recently used entries are evicted once the compressed total passes
+    ``max_bytes``.
+    """
+
+    def __init__(self, path, max_bytes=CONVERT_CACHE_MAX_BYTES):
+        self.path = str(path)
+        self.max_bytes = max_bytes
+        self.prefix = converter_version()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS converted ("
+            " key TEXT PRIMARY KEY, data BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS converted_last_used ON converted (last_used)")
+        self.conn.commit()
+        self.total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM converted").fetchone()[0]
+
+    def _key(self, digest):
+        return f"{self.prefix}:{digest}"
+
+    def get(self, digest):
+        """Return the converted UTF-8 text for a content digest, or None"""
+        key = self._key(digest)
+        with self.lock:
+            row = self.conn.execute("SELECT data FROM converted WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE converted SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+            self.hits += 1
+        return zlib.decompress(row[0])
+
+    def put(self, digest, data):
+        """Store converted UTF-8 text and evict the least recently used entries past the size bound"""
+        blob = zlib.compress(data, CONVERT_CACHE_LEVEL)
+        if len(blob) > self.max_bytes:
+            return
+        key = self._key(digest)
+        with self.lock:
+            old = self.conn.execute("SELECT size FROM converted WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO converted (key, data, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, blob, len(blob), time.time())
+            )
+            self.total += len(blob) - (old[0] if old else 0)
+            self.total = trim_lru(self.conn, "converted", self.total, self.max_bytes, size_column="size")
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
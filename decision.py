@@ -1,9 +1,7 @@
 from perception import PerceptionResult
 from memory import MemoryItem
 from typing import List, Optional
-from dotenv import load_dotenv
-from google import genai
-import os
+from llm_client import get_client
 
 # Optional: import log from agent if shared, else define locally
 try:
@@ -14,10 +12,7 @@ except ImportError:
         now = datetime.datetime.now().strftime("%H:%M:%S")
         print(f"[{now}] [{stage}] {msg}")
 
-load_dotenv()
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
-
-def generate_plan(
+async def generate_plan(
     perception: PerceptionResult,
     memory_items: List[MemoryItem],
     tool_descriptions: Optional[str] = None
@@ -68,6 +63,7 @@ Input Summary:
 IMPORTANT:
 - 🚫 Do NOT invent tools. Use only the tools listed below.
 - 📄 If the question may relate to factual knowledge, use the 'search_documents' tool to look for the answer.
+- 📚 If the question has several parts, search for all of them in ONE step with 'search_documents_batch', e.g. FUNCTION_CALL: search_documents_batch|queries=["Sachin Tendulkar centuries","Sachin Tendulkar Bharat Ratna"]
 - 🧮 If the question is mathematical or needs calculation, use the appropriate math tool.
 - 🤖 If the previous tool output already contains factual information, DO NOT search again. Instead, summarize the relevant facts and respond with: FINAL_ANSWER: [your answer]
 - Only repeat `search_documents` if the last result was irrelevant or empty.
@@ -78,11 +74,7 @@ IMPORTANT:
 - ✅ You have only 3 attempts. Final attempt must be FINAL_ANSWER and it should also contain the  path of the full file and chunk id  example: [chunk_id: Writing a Statement of Purpose_11],[path: D:\\college\\english\\PARAGRAPH DEVELOPMENT.pptx]
 """
     try:
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=prompt
-        )
-        raw = response.text.strip()
+        raw = (await get_client(log=log).generate(prompt)).strip()
         log("plan", f"LLM output: {raw}")
 
         for line in raw.splitlines():
@@ -0,0 +1,93 @@
+import os
+
+import numpy as np
+
+# Configuration
+SEARCH_DIVERSIFY = os.getenv("SEARCH_DIVERSIFY", "1") == "1"
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+MMR_FETCH = int(os.getenv("MMR_FETCH", "4"))
+
+
+def mmr(relevance, vectors, k, lambda_=MMR_LAMBDA):
+    """Indices of k rows picked by maximal marginal relevance, in pick order.
+
+    Each step takes the candidate maximising
+    ``lambda_ * relevance - (1 - lambda_) * max similarity to the picks so far``;
+    the running maximum is updated with one row of the similarity matrix per
+    pick, so the whole selection is O(k * n) after one (n, n) matrix product.
+    """
+    relevance = np.asarray(relevance, dtype=np.float32)
+    n = len(relevance)
+    if n == 0:
+        return []
+    similarity = vectors @ vectors.T
+    closest = np.zeros(n, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    picked = []
+    for _ in range(min(k, n)):
+        scores = lambda_ * relevance - (1 - lambda_) * closest
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        picked.append(best)
+        available[best] = False
+        closest = similarity[best] if len(picked) == 1 else np.maximum(closest, similarity[best])
+    return picked
+
+
+def group_adjacent(hits):
+    """Group (score, entry) hits into runs of consecutive chunks of the same document, best run first"""
+    by_id = {entry["id"]: (score, entry) for score, entry in hits}
+    groups, seen = [], set()
+    for score, entry in hits:
+        if entry["id"] in seen:
+            continue
+        start = end = entry["id"]
+        while start - 1 in by_id and by_id[start - 1][1]["file_path"] == entry["file_path"]:
+            start -= 1
+        while end + 1 in by_id and by_id[end + 1][1]["file_path"] == entry["file_path"]:
+            end += 1
+        run = [by_id[vid] for vid in range(start, end + 1)]
+        seen.update(range(start, end + 1))
+        groups.append(run)
+    return groups
+
+
+def diversify(hits, chunks, k, lambda_=MMR_LAMBDA):
+    """Merge adjacent chunks into passages and pick k diverse ones by MMR.
+
+    ``hits`` are over-fetched (score, entry) pairs, best first, and
+    ``chunks`` is the chunk store that holds their full-precision vectors
+    and text. A passage scores as its best chunk and is embedded as the
+    normalised sum of its chunk vectors; its text is read once from the
+    stored document, so the overlap between chunks is not repeated.
+    """
+    if not hits:
+        return []
+    groups = group_adjacent(hits)
+    vectors = chunks.find_vectors([entry["id"] for _, entry in hits])
+    dim = len(next(iter(vectors.values()))) if vectors else 1
+    matrix = np.zeros((len(groups), dim), dtype=np.float32)
+    for row, run in enumerate(groups):
+        for _, entry in run:
+            if entry["id"] in vectors:
+                matrix[row] += vectors[entry["id"]]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.where(norms == 0, 1.0, norms)
+
+    # Min-max scaling puts fused ranks and similarities on the same footing as cosine similarity
+    scores = np.array([max(score for score, _ in run) for run in groups], dtype=np.float32)
+    spread = scores.max() - scores.min()
+    relevance = (scores - scores.min()) / spread if spread > 0 else np.ones_like(scores)
+
+    passages = []
+    for row in mmr(relevance, matrix, k, lambda_):
+        run = groups[row]
+        entry = dict(run[0][1])
+        if len(run) > 1:
+            entry["chunk"] = chunks.passage([e["id"] for _, e in run])
+            entry["chunk_ids"] = [e["chunk_id"] for _, e in run]
+            similarities = [e.get("similarity") for _, e in run if e.get("similarity") is not None]
+            if "similarity" in entry:
+                entry["similarity"] = max(similarities) if similarities else None
+        passages.append((float(scores[row]), entry))
+    return passages
@@ -0,0 +1,102 @@
+import os
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+
+def _normalize_path(path):
+    path = str(path).replace("\\", "/").rstrip("/")
+    return path.lower() if os.name == "nt" else path
+
+
+def parse_date(value):
+    """Seconds since the epoch for an ISO date/datetime string (or a number), None if empty"""
+    if value in (None, ""):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(str(value).strip()).timestamp()
+
+
+class DocumentFilters:
+    """Bitmaps over vector IDs for scoping a search to some of the indexed documents.
+
+    Every document owns a contiguous vector ID range, so a bitmap is built by
+    filling the ranges of the matching documents. Extensions get a prebuilt
+    bitmap each; path prefixes, document names and modification dates are
+    matched against the document registry, which is far smaller than the
+    vector index. ``select()`` ANDs the bitmaps of the given filters.
+
+    Only live documents own a range, so a selection never contains
+    tombstoned vectors.
+    """
+
+    def __init__(self, documents, size):
+        self.size = size
+        self.documents = [(path, doc) for path, doc in documents.items() if doc["ids"][1] > doc["ids"][0]]
+        self.paths = [_normalize_path(path) for path, _ in self.documents]
+        self.by_extension = {}
+        for path, doc in self.documents:
+            bitmap = self.by_extension.setdefault(Path(path).suffix.lower().lstrip("."), np.zeros(size, dtype=bool))
+            bitmap[doc["ids"][0]:doc["ids"][1]] = True
+        self.mtimes = np.array([self._mtime(path, doc) for path, doc in self.documents], dtype=np.float64)
+
+    @staticmethod
+    def _mtime(path, doc):
+        # Registries written before modification times were recorded fall back to the file itself
+        if doc.get("mtime") is not None:
+            return doc["mtime"]
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return np.nan
+
+    def _documents_bitmap(self, matches):
+        bitmap = np.zeros(self.size, dtype=bool)
+        for i in matches:
+            start, end = self.documents[i][1]["ids"]
+            bitmap[start:end] = True
+        return bitmap
+
+    def select(self, extensions=None, path_prefix=None, document=None, modified_after=None, modified_before=None):
+        """Bitmap of the vector IDs that pass every given filter, or None without filters.
+
+        ``extensions`` is a list or comma-separated string (``"pdf,docx"``),
+        ``path_prefix`` a directory (either slash style), ``document`` a file
+        name or full path, and the dates ISO strings or epoch seconds.
+        """
+        if isinstance(extensions, str):
+            extensions = [ext for ext in extensions.split(",") if ext.strip()]
+        after, before = parse_date(modified_after), parse_date(modified_before)
+        selection = None
+
+        def narrow(bitmap):
+            return bitmap if selection is None else selection & bitmap
+
+        if extensions:
+            bitmap = np.zeros(self.size, dtype=bool)
+            for ext in extensions:
+                found = self.by_extension.get(ext.strip().lower().lstrip("."))
+                if found is not None:
+                    bitmap |= found
+            selection = narrow(bitmap)
+        if path_prefix:
+            prefix = _normalize_path(path_prefix)
+            selection = narrow(self._documents_bitmap(
+                i for i, path in enumerate(self.paths) if path == prefix or path.startswith(prefix + "/")
+            ))
+        if document:
+            wanted = _normalize_path(document)
+            selection = narrow(self._documents_bitmap(
+                i for i, (path, doc) in enumerate(self.documents)
+                if self.paths[i] == wanted or doc["doc"] == document
+            ))
+        if after is not None or before is not None:
+            in_range = ~np.isnan(self.mtimes)
+            if after is not None:
+                in_range &= self.mtimes >= after
+            if before is not None:
+                in_range &= self.mtimes < before
+            selection = narrow(self._documents_bitmap(np.flatnonzero(in_range)))
+        return selection
@@ -0,0 +1,148 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+
+# Configuration
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "100000"))
+# Full caches are trimmed to this fraction of their bound so eviction doesn't run on every insert
+LRU_TRIM_TO = 0.9
+
+
+def text_key(text):
+    """Content address of a chunk"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def trim_lru(conn, table, total, limit, size_column=None):
+    """Delete the least recently used rows of a SQLite cache table once total passes limit.
+
+    ``total`` counts rows, or sums ``size_column`` when one is given; the
+    table needs a ``last_used`` column. Returns the new total.
+    """
+    if total <= limit:
+        return total
+    target = int(limit * LRU_TRIM_TO)
+    if size_column is None:
+        excess = total - target
+        conn.execute(f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} ORDER BY last_used LIMIT ?)",
+                     (excess,))
+        return total - excess
+    evict = []
+    for rowid, size in conn.execute(f"SELECT rowid, {size_column} FROM {table} ORDER BY last_used"):
+        if total <= target:
+            break
+        evict.append((rowid,))
+        total -= size
+    conn.executemany(f"DELETE FROM {table} WHERE rowid = ?", evict)
+    return total
+
+
+class EmbeddingCache:
+    """Persistent (model, chunk hash) -> vector store with least-recently-used eviction"""
+
+    def __init__(self, path, max_entries=EMBED_CACHE_MAX_ENTRIES):
+        self.path = str(path)
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, key TEXT NOT NULL, vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL, PRIMARY KEY (model, key))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self.conn.commit()
+        self.count = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, model, keys):
+        """Return {key: vector} for the keys that are cached"""
+        found = {}
+        now = time.time()
+        with self.lock:
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                marks = ",".join("?" * len(part))
+                rows = self.conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE model = ? AND key IN ({marks})",
+                    [model, *part]
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+            if found:
+                self.conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND key = ?",
+                    [(now, model, key) for key in found]
+                )
+                self.conn.commit()
+        return found
+
+    def put_many(self, model, items):
+        """Store {key: vector} and evict the least recently used rows past the size bound"""
+        now = time.time()
+        with self.lock:
+            before = self.conn.total_changes
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, key, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(model, key, np.asarray(vec, dtype=np.float32).tobytes(), now) for key, vec in items.items()]
+            )
+            self.count += self.conn.total_changes - before
+            self.count = trim_lru(self.conn, "embeddings", self.count, self.max_entries)
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class CachedEmbedder:
+    """Wraps an EmbeddingClient so only unseen chunk texts reach the embedding server.
+
+    Identical texts inside one call are embedded once, and vectors are looked up
+    by (model, sha256(text)) in the persistent cache before any request is made.
+    """
+
+    def __init__(self, embedder, cache):
+        self.embedder = embedder
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @property
+    def batch_size(self):
+        return self.embedder.batch_size
+
+    @property
+    def model(self):
+        return self.embedder.model
+
+    def embed(self, texts, progress=None):
+        texts = list(texts)
+        keys = [text_key(t) for t in texts]
+        unique = dict(zip(keys, texts))
+
+        vectors = self.cache.get_many(self.model, list(unique))
+        missing = [key for key in unique if key not in vectors]
+        if missing:
+            fresh = self.embedder.embed([unique[key] for key in missing], progress=progress)
+            new_items = dict(zip(missing, fresh))
+            self.cache.put_many(self.model, new_items)
+            vectors.update(new_items)
+        elif progress:
+            progress(len(texts), len(texts))
+
+        with self.lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        if not texts:
+            return self.embedder.embed([])
+        return np.ascontiguousarray(np.stack([vectors[key] for key in keys]), dtype=np.float32)
+
+    def embed_one(self, text):
+        return self.embed([text])[0]
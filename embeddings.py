@@ -0,0 +1,169 @@
+import os
+import numpy as np
+import requests
+
+from query_cache import TTLCache, normalize_query, QUERY_EMBED_CACHE_SIZE, QUERY_EMBED_CACHE_TTL
+
+# Configuration
+EMBED_URL = os.getenv("EMBED_URL", "http://localhost:11434/api/embed")
+EMBED_MODEL = os.getenv("EMBED_MODEL", "nomic-embed-text")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+EMBED_TIMEOUT = 120
+
+
+def _batch_url(url):
+    """Map a legacy /api/embeddings URL onto the multi-input /api/embed endpoint"""
+    if url.rstrip("/").endswith("/api/embeddings"):
+        return url.rstrip("/")[:-len("/api/embeddings")] + "/api/embed"
+    return url
+
+
+def _legacy_url(url):
+    """Map a /api/embed URL onto the single-prompt /api/embeddings endpoint"""
+    if url.rstrip("/").endswith("/api/embed"):
+        return url.rstrip("/") + "dings"
+    return url
+
+
+def normalize_rows(matrix):
+    """L2-normalise each row in place and return a contiguous float32 matrix"""
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+
+# Query vectors shared by every client in the process, keyed by (model, normalized text)
+query_embeddings = TTLCache(QUERY_EMBED_CACHE_SIZE, QUERY_EMBED_CACHE_TTL)
+
+
+def upgrade_legacy_index(index):
+    """Normalise vectors of a flat index written by the old single-prompt client.
+
+    /api/embed returns unit-length vectors while /api/embeddings did not, so an
+    index built before the batched client has to be rescaled once to keep L2
+    distances comparable with new query vectors.
+    """
+    if index is None or index.ntotal == 0 or not hasattr(index, "reconstruct_n"):
+        return index
+    vectors = index.reconstruct_n(0, index.ntotal)
+    if np.allclose(np.linalg.norm(vectors[:16], axis=1), 1.0, atol=1e-3):
+        return index
+    index.reset()
+    index.add(normalize_rows(vectors))
+    return index
+
+
+class EmbeddingClient:
+    """Embeds text through the Ollama server in multi-input batches.
+
+    Every call returns a contiguous (n, dim) float32 matrix of unit-length rows
+    that can be passed straight to ``index.add`` or ``index.search``.
+    """
+
+    def __init__(self, url=EMBED_URL, model=EMBED_MODEL, batch_size=EMBED_BATCH_SIZE, timeout=EMBED_TIMEOUT):
+        self.url = _batch_url(url)
+        self.legacy_url = _legacy_url(url)
+        self.model = model
+        self.batch_size = max(1, int(batch_size))
+        self.timeout = timeout
+        self.dim = None
+        self.session = requests.Session()
+        self._batch_supported = True
+
+    def embed(self, texts, progress=None):
+        """Embed a sequence of texts, calling progress(done, total) after each batch"""
+        texts = list(texts)
+        total = len(texts)
+        if total == 0:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+
+        out = None
+        for start in range(0, total, self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            vectors = self._post_batch(batch)
+            if out is None:
+                out = np.empty((total, vectors.shape[1]), dtype=np.float32)
+            out[start:start + len(batch)] = vectors
+            if progress:
+                progress(start + len(batch), total)
+
+        self.dim = out.shape[1]
+        return normalize_rows(out)
+
+    def embed_one(self, text):
+        """Embed a single text and return a 1-D float32 vector"""
+        return self.embed([text])[0]
+
+    def embed_query(self, text):
+        """Embed a search query, reusing the vector of a recent query with the same normalized text.
+
+        The returned vector is shared with the cache and read-only.
+        """
+        key = (self.model, normalize_query(text))
+        vector = query_embeddings.get(key)
+        if vector is None:
+            vector = self.embed_one(text)
+            vector.setflags(write=False)
+            query_embeddings.put(key, vector)
+        return vector
+
+    def embed_queries(self, texts):
+        """``embed_query`` for several queries; the uncached ones are embedded in one batched request"""
+        texts = list(texts)
+        keys = [(self.model, normalize_query(text)) for text in texts]
+        vectors = [query_embeddings.get(key) for key in keys]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            embedded = self.embed([texts[i] for i in missing])
+            for i, vector in zip(missing, embedded):
+                vector.setflags(write=False)
+                query_embeddings.put(keys[i], vector)
+                vectors[i] = vector
+        return np.stack(vectors) if vectors else np.empty((0, self.dim or 0), dtype=np.float32)
+
+    def _post_batch(self, batch):
+        if self._batch_supported:
+            response = self.session.post(
+                self.url,
+                json={"model": self.model, "input": batch},
+                timeout=self.timeout
+            )
+            if response.status_code != 404:
+                response.raise_for_status()
+                return np.asarray(response.json()["embeddings"], dtype=np.float32)
+            # Older Ollama builds only expose the single-prompt endpoint
+            self._batch_supported = False
+
+        rows = []
+        for text in batch:
+            response = self.session.post(
+                self.legacy_url,
+                json={"model": self.model, "prompt": text},
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+            rows.append(response.json()["embedding"])
+        return np.asarray(rows, dtype=np.float32)
+
+
+_default_client = None
+
+
+def get_client():
+    """Return the process-wide embedding client"""
+    global _default_client
+    if _default_client is None:
+        _default_client = EmbeddingClient()
+    return _default_client
+
+
+def get_embedding(text):
+    """Embed a query with the shared client, through the query embedding cache"""
+    return get_client().embed_query(text)
+
+
+def get_embeddings(texts):
+    """Embed several queries with the shared client in one request, through the query embedding cache"""
+    return get_client().embed_queries(texts)
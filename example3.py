@@ -2,101 +2,151 @@ from mcp.server.fastmcp import FastMCP, Image
 from mcp.server.fastmcp.prompts import base
 from mcp.types import TextContent
 from mcp import types
-from PIL import Image as PILImage
 import math
 import sys
 import os
-import json
-import faiss
-import numpy as np
+import threading
 from pathlib import Path
-import requests
-from markitdown import MarkItDown
-import time
+from anyio import to_thread
 from models import AddInput, AddOutput, SqrtInput, SqrtOutput, StringsToIntsInput, StringsToIntsOutput, ExpSumInput, ExpSumOutput
-from PIL import Image as PILImage
-from tqdm import tqdm
-import hashlib
+from background_indexer import BackgroundIndexer
+# faiss, numpy, PIL, requests and the ingestion stack are imported by the tools that use them,
+# so the server answers initialize without loading them (see benchmark_startup.py)
 
 
 mcp = FastMCP("Calculator")
 
-EMBED_URL = "http://localhost:11434/api/embeddings"
-EMBED_MODEL = "nomic-embed-text"
-CHUNK_SIZE = 256
-CHUNK_OVERLAP = 40
 ROOT = Path(__file__).parent.resolve()
-print("ROOT:", ROOT)
-def get_embedding(text: str) -> np.ndarray:
-    response = requests.post(EMBED_URL, json={"model": EMBED_MODEL, "prompt": text})
-    response.raise_for_status()
-    return np.array(response.json()["embedding"], dtype=np.float32)
-
-def chunk_text(text, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
-    words = text.split()
-    for i in range(0, len(words), size - overlap):
-        yield " ".join(words[i:i+size])
+_search_index = None
+_search_index_lock = threading.Lock()
 
 def mcp_log(level: str, message: str) -> None:
     """Log a message to stderr to avoid interfering with JSON communication"""
     sys.stderr.write(f"{level}: {message}\n")
     sys.stderr.flush()
 
+mcp_log("INFO", f"ROOT: {ROOT}")
+
+def get_search_index():
+    """The resident SearchIndex, created on the first search; it swaps in new generations as ingestion commits them"""
+    global _search_index
+    with _search_index_lock:
+        if _search_index is None:
+            from search_index import SearchIndex
+            _search_index = SearchIndex(ROOT / "faiss_index")
+    return _search_index
+
+# Ingestion runs in its own low-priority process and publishes generations that search_index picks up
+indexer = BackgroundIndexer(log=mcp_log)
+INDEX_PENDING = "Documents are still being indexed; try again shortly."
+
 @mcp.tool()
-def search_documents(query: str) -> list[str]:
-    """Search for relevant content from uploaded documents."""
-    ensure_faiss_ready()
+async def search_documents(query: str, extensions: str = "", path_prefix: str = "", document: str = "",
+                           modified_after: str = "", modified_before: str = "",
+                           diversify: bool = True, nprobe: int = 0, ef_search: int = 0) -> list[str]:
+    """Search for relevant content from uploaded documents. Optional filters scope the search: extensions (comma-separated, e.g. "pdf,docx"), path_prefix (a folder), document (file name or path), modified_after / modified_before (ISO dates). diversify merges adjacent chunks into passages and drops near-duplicate results. Optional nprobe (IVF) and ef_search (HNSW) raise recall at the cost of speed; 0 uses the defaults."""
+    # The embedding request and index work run on a worker thread, so other tool calls aren't held up
+    return await to_thread.run_sync(_search_documents, query, extensions, path_prefix, document,
+                                    modified_after, modified_before, diversify, nprobe, ef_search)
+
+def _search_documents(query, extensions, path_prefix, document, modified_after, modified_before,
+                      diversify, nprobe, ef_search):
+    if not ensure_faiss_ready():
+        return [INDEX_PENDING]
     mcp_log("SEARCH", f"Query: {query}")
+    filters = search_filters(extensions, path_prefix, document, modified_after, modified_before)
+    from embeddings import get_embedding
+    from diversify import SEARCH_DIVERSIFY
     try:
-        index = faiss.read_index(str(ROOT / "faiss_index" / "index.bin"))
-        metadata = json.loads((ROOT / "faiss_index" / "metadata.json").read_text())
-        query_vec = get_embedding(query).reshape(1, -1)
-        D, I = index.search(query_vec, k=5)
         results = []
-        for idx in I[0]:
-            data = metadata[idx]
+        # Keyword (BM25) and vector hits fused, so exact identifiers are found too
+        for _, data in get_search_index().hybrid_search(query, get_embedding, k=5, nprobe=nprobe or None,
+                                                        ef_search=ef_search or None, filters=filters,
+                                                        diversify=diversify and SEARCH_DIVERSIFY):
             results.append(f"{data['chunk']}\n[Source: {data['doc']}, Chunk ID: {data['chunk_id']},path: {data['file_path']}]")
         return results
     except Exception as e:
         return [f"ERROR: Failed to search: {str(e)}"]
 
+@mcp.tool()
+async def search_documents_batch(queries: list[str], k: int = 5, extensions: str = "", path_prefix: str = "",
+                                 document: str = "", modified_after: str = "", modified_before: str = "",
+                                 diversify: bool = True, nprobe: int = 0, ef_search: int = 0) -> list[dict]:
+    """Search uploaded documents for several queries in one call, e.g. the parts of a multi-part question. Returns, per query, the ranked results with their score (higher is better) and vector similarity. Takes the same optional filters as search_documents."""
+    return await to_thread.run_sync(_search_documents_batch, queries, k, extensions, path_prefix, document,
+                                    modified_after, modified_before, diversify, nprobe, ef_search)
+
+def _search_documents_batch(queries, k, extensions, path_prefix, document, modified_after, modified_before,
+                            diversify, nprobe, ef_search):
+    if not ensure_faiss_ready():
+        return [{"query": query, "error": INDEX_PENDING} for query in queries]
+    mcp_log("SEARCH", f"Batch of {len(queries)} queries: {queries}")
+    filters = search_filters(extensions, path_prefix, document, modified_after, modified_before)
+    from embeddings import get_embeddings
+    from diversify import SEARCH_DIVERSIFY
+    try:
+        batches = get_search_index().hybrid_search_batch(queries, get_embeddings, k=k, nprobe=nprobe or None,
+                                                         ef_search=ef_search or None, filters=filters,
+                                                         diversify=diversify and SEARCH_DIVERSIFY)
+    except Exception as e:
+        return [{"query": query, "error": f"Failed to search: {str(e)}"} for query in queries]
+    return [{
+        "query": query,
+        "results": [{
+            "rank": rank,
+            "score": round(score, 4),
+            "similarity": None if data.get("similarity", score) is None else round(data.get("similarity", score), 4),
+            "chunk": data["chunk"],
+            "source": data["doc"],
+            "chunk_id": data["chunk_id"],
+            "chunk_ids": data.get("chunk_ids", [data["chunk_id"]]),
+            "path": data["file_path"],
+        } for rank, (score, data) in enumerate(hits, start=1)],
+    } for query, hits in zip(queries, batches)]
+
+def search_filters(extensions="", path_prefix="", document="", modified_after="", modified_before=""):
+    """Keyword arguments for SearchIndex filters, leaving out the empty ones"""
+    return {name: value for name, value in (
+        ("extensions", extensions), ("path_prefix", path_prefix), ("document", document),
+        ("modified_after", modified_after), ("modified_before", modified_before)) if value}
+
 @mcp.tool()
 def add(input: AddInput) -> AddOutput:
-    print("CALLED: add(AddInput) -> AddOutput")
+    mcp_log("CALLED", "add(AddInput) -> AddOutput")
     return AddOutput(result=input.a + input.b)
 
 @mcp.tool()
 def sqrt(input: SqrtInput) -> SqrtOutput:
     """Square root of a number"""
-    print("CALLED: sqrt(SqrtInput) -> SqrtOutput")
+    mcp_log("CALLED", "sqrt(SqrtInput) -> SqrtOutput")
     return SqrtOutput(result=input.a ** 0.5)
 
 # subtraction tool
 @mcp.tool()
 def subtract(a: int, b: int) -> int:
     """Subtract two numbers"""
-    print("CALLED: subtract(a: int, b: int) -> int:")
+    mcp_log("CALLED", "subtract(a: int, b: int) -> int:")
     return int(a - b)
 
 # multiplication tool
 @mcp.tool()
 def multiply(a: int, b: int) -> int:
     """Multiply two numbers"""
-    print("CALLED: multiply(a: int, b: int) -> int:")
+    mcp_log("CALLED", "multiply(a: int, b: int) -> int:")
     return int(a * b)
 
 #  division tool
 @mcp.tool() 
 def divide(a: int, b: int) -> float:
     """Divide two numbers"""
-    print("CALLED: divide(a: int, b: int) -> float:")
+    mcp_log("CALLED", "divide(a: int, b: int) -> float:")
     return float(a / b)
 
 # power tool
 @mcp.tool()
 def power(a: int, b: int) -> int:
     """Power of two numbers"""
-    print("CALLED: power(a: int, b: int) -> int:")
+    mcp_log("CALLED", "power(a: int, b: int) -> int:")
     return int(a ** b)
 
 
@@ -104,62 +154,63 @@ def power(a: int, b: int) -> int:
 @mcp.tool()
 def cbrt(a: int) -> float:
     """Cube root of a number"""
-    print("CALLED: cbrt(a: int) -> float:")
+    mcp_log("CALLED", "cbrt(a: int) -> float:")
     return float(a ** (1/3))
 
 # factorial tool
 @mcp.tool()
 def factorial(a: int) -> int:
     """factorial of a number"""
-    print("CALLED: factorial(a: int) -> int:")
+    mcp_log("CALLED", "factorial(a: int) -> int:")
     return int(math.factorial(a))
 
 # log tool
 @mcp.tool()
 def log(a: int) -> float:
     """log of a number"""
-    print("CALLED: log(a: int) -> float:")
+    mcp_log("CALLED", "log(a: int) -> float:")
     return float(math.log(a))
 
 # remainder tool
 @mcp.tool()
 def remainder(a: int, b: int) -> int:
     """remainder of two numbers divison"""
-    print("CALLED: remainder(a: int, b: int) -> int:")
+    mcp_log("CALLED", "remainder(a: int, b: int) -> int:")
     return int(a % b)
 
 # sin tool
 @mcp.tool()
 def sin(a: int) -> float:
     """sin of a number"""
-    print("CALLED: sin(a: int) -> float:")
+    mcp_log("CALLED", "sin(a: int) -> float:")
     return float(math.sin(a))
 
 # cos tool
 @mcp.tool()
 def cos(a: int) -> float:
     """cos of a number"""
-    print("CALLED: cos(a: int) -> float:")
+    mcp_log("CALLED", "cos(a: int) -> float:")
     return float(math.cos(a))
 
 # tan tool
 @mcp.tool()
 def tan(a: int) -> float:
     """tan of a number"""
-    print("CALLED: tan(a: int) -> float:")
+    mcp_log("CALLED", "tan(a: int) -> float:")
     return float(math.tan(a))
 
 # mine tool
 @mcp.tool()
 def mine(a: int, b: int) -> int:
     """special mining tool"""
-    print("CALLED: mine(a: int, b: int) -> int:")
+    mcp_log("CALLED", "mine(a: int, b: int) -> int:")
     return int(a - b - b)
 
 @mcp.tool()
 def create_thumbnail(image_path: str) -> Image:
     """Create a thumbnail from an image"""
-    print("CALLED: create_thumbnail(image_path: str) -> Image:")
+    mcp_log("CALLED", "create_thumbnail(image_path: str) -> Image:")
+    from PIL import Image as PILImage
     img = PILImage.open(image_path)
     img.thumbnail((100, 100))
     return Image(data=img.tobytes(), format="png")
@@ -167,21 +218,21 @@ def create_thumbnail(image_path: str) -> Image:
 @mcp.tool()
 def strings_to_chars_to_int(input: StringsToIntsInput) -> StringsToIntsOutput:
     """Return the ASCII values of the characters in a word"""
-    print("CALLED: strings_to_chars_to_int(StringsToIntsInput) -> StringsToIntsOutput")
+    mcp_log("CALLED", "strings_to_chars_to_int(StringsToIntsInput) -> StringsToIntsOutput")
     ascii_values = [ord(char) for char in input.string]
     return StringsToIntsOutput(ascii_values=ascii_values)
 
 @mcp.tool()
 def int_list_to_exponential_sum(input: ExpSumInput) -> ExpSumOutput:
     """Return sum of exponentials of numbers in a list"""
-    print("CALLED: int_list_to_exponential_sum(ExpSumInput) -> ExpSumOutput")
+    mcp_log("CALLED", "int_list_to_exponential_sum(ExpSumInput) -> ExpSumOutput")
     result = sum(math.exp(i) for i in input.int_list)
     return ExpSumOutput(result=result)
 
 @mcp.tool()
 def fibonacci_numbers(n: int) -> list:
     """Return the first n Fibonacci Numbers"""
-    print("CALLED: fibonacci_numbers(n: int) -> list:")
+    mcp_log("CALLED", "fibonacci_numbers(n: int) -> list:")
     if n <= 0:
         return []
     fib_sequence = [0, 1]
@@ -195,7 +246,7 @@ def fibonacci_numbers(n: int) -> list:
 @mcp.resource("greeting://{name}")
 def get_greeting(name: str) -> str:
     """Get a personalized greeting"""
-    print("CALLED: get_greeting(name: str) -> str:")
+    mcp_log("CALLED", "get_greeting(name: str) -> str:")
     return f"Hello, {name}!"
 
 
@@ -203,7 +254,7 @@ def get_greeting(name: str) -> str:
 @mcp.prompt()
 def review_code(code: str) -> str:
     return f"Please review this code:\n\n{code}"
-    print("CALLED: review_code(code: str) -> str:")
+    mcp_log("CALLED", "review_code(code: str) -> str:")
 
 
 @mcp.prompt()
@@ -216,140 +267,32 @@ def debug_error(error: str) -> list[base.Message]:
 
 def process_documents():
     """Process documents and create FAISS index"""
-    mcp_log("INFO", "Indexing documents with MarkItDown...")
-    ROOT = Path(__file__).parent.resolve()
-    DOC_PATH = ROOT / "documents"
-    INDEX_CACHE = ROOT / "faiss_index"
-    INDEX_CACHE.mkdir(exist_ok=True)
-    INDEX_FILE = INDEX_CACHE / "index.bin"
-    METADATA_FILE = INDEX_CACHE / "metadata.json"
-    CACHE_FILE = INDEX_CACHE / "doc_index_cache.json"
-    VISITED_FILE = ROOT / "visited_files.json"
-
-    def file_hash(path):
-        return hashlib.md5(Path(path).read_bytes()).hexdigest()
-
-    CACHE_META = json.loads(CACHE_FILE.read_text()) if CACHE_FILE.exists() else {}
-    metadata = json.loads(METADATA_FILE.read_text()) if METADATA_FILE.exists() else []
-    index = faiss.read_index(str(INDEX_FILE)) if INDEX_FILE.exists() else None
-    visited_data = json.loads(VISITED_FILE.read_text()) if VISITED_FILE.exists() else []
-    all_embeddings = []
-    converter = MarkItDown()
-
-    # for file in DOC_PATH.glob("*.*"):
-    #     fhash = file_hash(file)
-    #     if file.name in CACHE_META and CACHE_META[file.name] == fhash:
-    #         mcp_log("SKIP", f"Skipping unchanged file: {file.name}")
-    #         continue
-
-    #     mcp_log("PROC", f"Processing: {file.name}")
-    #     try:
-    #         result = converter.convert(str(file))
-    #         markdown = result.text_content
-    #         chunks = list(chunk_text(markdown))
-    #         embeddings_for_file = []
-    #         new_metadata = []
-    #         for i, chunk in enumerate(tqdm(chunks, desc=f"Embedding {file.name}")):
-    #             embedding = get_embedding(chunk)
-    #             embeddings_for_file.append(embedding)
-    #             new_metadata.append({"doc": file.name, "chunk": chunk, "chunk_id": f"{file.stem}_{i}"})
-    #         if embeddings_for_file:
-    #             if index is None:
-    #                 dim = len(embeddings_for_file[0])
-    #                 index = faiss.IndexFlatL2(dim)
-    #             index.add(np.stack(embeddings_for_file))
-    #             metadata.extend(new_metadata)
-    #         CACHE_META[file.name] = fhash
-    #     except Exception as e:
-    #         mcp_log("ERROR", f"Failed to process {file.name}: {e}")
-
-    # CACHE_FILE.write_text(json.dumps(CACHE_META, indent=2))
-    # METADATA_FILE.write_text(json.dumps(metadata, indent=2))
-    # if index and index.ntotal > 0:
-    #     faiss.write_index(index, str(INDEX_FILE))
-    #     mcp_log("SUCCESS", "Saved FAISS index and metadata")
-    # else:
-    #     mcp_log("WARN", "No new documents or updates to process.")
-    
-    for entry in visited_data:
-        file_path = Path(entry['file_path'])
-        if not file_path.exists():
-            mcp_log("MISS", f"File not found: {file_path}")
-            continue
-
-        fhash = file_hash(file_path)
-        if entry['file_name'] in CACHE_META and CACHE_META[entry['file_name']] == fhash:
-            mcp_log("SKIP", f"Skipping unchanged file: {entry['file_name']}")
-            continue
-
-        mcp_log("PROC", f"Processing: {entry['file_name']}")
-        try:
-            result = converter.convert(str(file_path))
-            markdown = result.text_content
-            chunks = list(chunk_text(markdown))
-            embeddings_for_file = []
-            new_metadata = []
-            for i, chunk in enumerate(tqdm(chunks, desc=f"Embedding {entry['file_name']}")):
-                embedding = get_embedding(chunk)
-                embeddings_for_file.append(embedding)
-                new_metadata.append({
-                    "doc": entry['file_name'],
-                    "chunk": chunk,
-                    "chunk_id": f"{file_path.stem}_{i}",
-                    "file_path": str(file_path)
-                })
-            if embeddings_for_file:
-                if index is None:
-                    dim = len(embeddings_for_file[0])
-                    index = faiss.IndexFlatL2(dim)
-                index.add(np.stack(embeddings_for_file))
-                metadata.extend(new_metadata)
-            CACHE_META[entry['file_name']] = fhash
-        except Exception as e:
-            mcp_log("ERROR", f"Failed to process {entry['file_name']}: {e}")
-
-    CACHE_FILE.write_text(json.dumps(CACHE_META, indent=2))
-    METADATA_FILE.write_text(json.dumps(metadata, indent=2))
-    if index and index.ntotal > 0:
-        faiss.write_index(index, str(INDEX_FILE))
-        mcp_log("SUCCESS", "Saved FAISS index and metadata")
-    else:
-        mcp_log("WARN", "No new documents or updates to process.")
+    import ingest
+    return ingest.process_documents(log=mcp_log, root=ROOT)
 
 def ensure_faiss_ready():
-    from pathlib import Path
-    index_path = ROOT / "faiss_index" / "index.bin"
-    meta_path = ROOT / "faiss_index" / "metadata.json"
-    if not (index_path.exists() and meta_path.exists()):
-        mcp_log("INFO", "Index not found — running process_documents()...")
-        process_documents()
-    else:
-        mcp_log("INFO", "Index already exists. Skipping regeneration.")
+    """True once an index generation has been committed; never builds one inside a tool call"""
+    from shards import index_exists
+    if index_exists(ROOT / "faiss_index"):
+        return True
+    mcp_log("INFO", "Index not found yet — waiting for the background indexer")
+    indexer.start()
+    return False
 
 
 if __name__ == "__main__":
-    print("STARTING THE SERVER AT AMAZING LOCATION")
+    mcp_log("INFO", "STARTING THE SERVER AT AMAZING LOCATION")
 
     
     
     if len(sys.argv) > 1 and sys.argv[1] == "dev":
         mcp.run() # Run without transport for dev server
     else:
-        # Start the server in a separate thread
-        import threading
-        server_thread = threading.Thread(target=lambda: mcp.run(transport="stdio"))
-        server_thread.daemon = True
-        server_thread.start()
-        
-        # Wait a moment for the server to start
-        time.sleep(2)
-        
-        # Process documents after server is running
-        process_documents()
-        
-        # Keep the main thread alive
+        # Serve right away from the last committed generation; indexing catches up in the background
+        indexer.start()
         try:
-            while True:
-                time.sleep(1)
+            mcp.run(transport="stdio")
         except KeyboardInterrupt:
-            print("\nShutting down...")
+            mcp_log("INFO", "Shutting down...")
+        finally:
+            indexer.stop()
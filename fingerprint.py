@@ -0,0 +1,112 @@
+import os
+import json
+import hashlib
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+# Try to import optional dependencies
+try:
+    import xxhash
+    HAS_XXHASH = True
+except ImportError:
+    HAS_XXHASH = False
+
+# Configuration
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "8"))
+HASH_BLOCK_SIZE = 1 << 20
+HASH_ALGORITHM = "xxh3_128" if HAS_XXHASH else "blake2b"
+
+
+def _new_hasher():
+    if HAS_XXHASH:
+        return xxhash.xxh3_128()
+    return hashlib.blake2b(digest_size=16)
+
+
+def hash_file(path):
+    """Stream a file through the fast digest; returns '<algorithm>:<hex>'"""
+    hasher = _new_hasher()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            hasher.update(block)
+    return f"{HASH_ALGORITHM}:{hasher.hexdigest()}"
+
+
+def md5_file(path):
+    """Streamed MD5, only used to recognise hashes recorded by older versions"""
+    hasher = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def is_legacy_digest(digest):
+    return bool(digest) and ":" not in digest
+
+
+def stat_signature(st):
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+
+class FingerprintManifest:
+    """Remembers (size, mtime_ns, inode, content hash) per path.
+
+    A file is only read again when its stat signature changes, so scanning an
+    unchanged corpus costs one stat() per file instead of reading every byte.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.files = {}
+
+    @classmethod
+    def load(cls, path):
+        manifest = cls(path)
+        if manifest.path.exists():
+            try:
+                data = json.loads(manifest.path.read_text(encoding="utf-8"))
+                # Digests from another algorithm can't be compared, so start over
+                if data.get("algorithm") == HASH_ALGORITHM:
+                    manifest.files = data.get("files", {})
+            except (ValueError, OSError):
+                pass
+        return manifest
+
+    def save(self):
+        tmp = Path(str(self.path) + ".tmp")
+        tmp.write_text(json.dumps({"algorithm": HASH_ALGORITHM, "files": self.files}), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    def scan(self, paths, workers=HASH_WORKERS):
+        """Return {path: digest}, or None for paths that no longer exist"""
+        results, to_hash = {}, {}
+        for path in paths:
+            key = str(path)
+            try:
+                signature = stat_signature(os.stat(key))
+            except OSError:
+                results[key] = None
+                self.files.pop(key, None)
+                continue
+            known = self.files.get(key)
+            if known and known["stat"] == signature:
+                results[key] = known["hash"]
+            else:
+                to_hash[key] = signature
+
+        if to_hash:
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+                digests = pool.map(self._safe_hash, to_hash)
+                for (key, signature), digest in zip(to_hash.items(), digests):
+                    results[key] = digest
+                    if digest is not None:
+                        self.files[key] = {"stat": signature, "hash": digest}
+        return results
+
+    @staticmethod
+    def _safe_hash(path):
+        try:
+            return hash_file(path)
+        except OSError:
+            return None
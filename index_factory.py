@@ -0,0 +1,192 @@
+import os
+import math
+
+import faiss
+import numpy as np
+
+# Configuration
+INDEX_TYPE = os.getenv("INDEX_TYPE", "auto")  # auto, flat, ivf_flat, ivf_pq or hnsw
+INDEX_ENCODING = os.getenv("INDEX_ENCODING", "float")  # float, fp16, sq8 or pq
+INDEX_AUTO_IVF_MIN = int(os.getenv("INDEX_AUTO_IVF_MIN", "50000"))
+INDEX_AUTO_PQ_MIN = int(os.getenv("INDEX_AUTO_PQ_MIN", "1000000"))
+INDEX_RETRAIN_GROWTH = float(os.getenv("INDEX_RETRAIN_GROWTH", "2.0"))
+INDEX_NPROBE = int(os.getenv("INDEX_NPROBE", "16"))
+INDEX_EF_SEARCH = int(os.getenv("INDEX_EF_SEARCH", "64"))
+INDEX_RERANK = int(os.getenv("INDEX_RERANK", "4"))
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+ENCODINGS = ("float", "fp16", "sq8", "pq")
+METRIC = faiss.METRIC_INNER_PRODUCT
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+PQ_BITS = 8
+# k-means wants at least 39 points per centroid; sample up to 64 when training
+MIN_POINTS_PER_CENTROID = 39
+TRAIN_POINTS_PER_CENTROID = 64
+SQ_TRAIN_SIZE = 65536
+
+
+def nlist_for(n):
+    """Number of IVF lists for a corpus of n vectors (about 4 * sqrt(n))"""
+    return int(min(65536, max(16, 4 * math.sqrt(max(n, 1)))))
+
+
+def pq_subquantizers(dim):
+    """Largest sub-quantizer count of at most dim / 8 that divides dim"""
+    for m in range(max(1, dim // 8), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def effective_encoding(kind, encoding):
+    """IVF-PQ always stores PQ codes; HNSW can't score PQ codes by inner product, so it uses SQ8"""
+    if kind == "ivf_pq":
+        return "pq"
+    if kind == "hnsw" and encoding == "pq":
+        return "sq8"
+    return encoding
+
+
+def min_train_size(kind, encoding, n):
+    """Fewest vectors that can train an index of this kind and encoding"""
+    centroids = 0
+    if kind in ("ivf_flat", "ivf_pq"):
+        centroids = nlist_for(n)
+    if effective_encoding(kind, encoding) == "pq":
+        centroids = max(centroids, 1 << PQ_BITS)
+    if centroids:
+        return MIN_POINTS_PER_CENTROID * centroids
+    return 1 if effective_encoding(kind, encoding) == "sq8" else 0
+
+
+def train_size(kind, encoding, n):
+    """How many stored vectors to sample for training an index over n vectors"""
+    centroids = 0
+    if kind in ("ivf_flat", "ivf_pq"):
+        centroids = nlist_for(n)
+    if effective_encoding(kind, encoding) == "pq":
+        centroids = max(centroids, 1 << PQ_BITS)
+    if centroids:
+        return min(n, TRAIN_POINTS_PER_CENTROID * centroids)
+    return min(n, SQ_TRAIN_SIZE) if effective_encoding(kind, encoding) == "sq8" else 0
+
+
+def choose_index(n, configured=None, encoding=None):
+    """(index type, encoding) for a corpus of n live vectors.
+
+    ``auto`` keeps exact flat search for small corpora and switches to IVF-Flat
+    and then IVF-PQ as the corpus grows. Types and encodings that need
+    training fall back to flat float vectors until there are enough vectors.
+    """
+    configured = configured or INDEX_TYPE
+    encoding = encoding or INDEX_ENCODING
+    if configured not in INDEX_TYPES + ("auto",):
+        raise ValueError(f"Unknown INDEX_TYPE '{configured}', expected auto or one of {', '.join(INDEX_TYPES)}")
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Unknown INDEX_ENCODING '{encoding}', expected one of {', '.join(ENCODINGS)}")
+    kind = configured
+    if configured == "auto":
+        if n >= INDEX_AUTO_PQ_MIN:
+            kind = "ivf_pq"
+        elif n >= INDEX_AUTO_IVF_MIN:
+            kind = "ivf_flat"
+        else:
+            kind = "flat"
+    if kind == "ivf_flat" and encoding == "pq":
+        # IVF lists holding PQ codes are an IVF-PQ index, which is what index_kind reports for it
+        kind = "ivf_pq"
+    if n < min_train_size(kind, encoding, n):
+        kind = "flat"
+    encoding = effective_encoding(kind, encoding)
+    if n < min_train_size(kind, encoding, n):
+        encoding = "float"
+    return kind, encoding
+
+
+def factory_string(kind, encoding, dim, n):
+    encoding = effective_encoding(kind, encoding)
+    codes = {"float": "Flat", "fp16": "SQfp16", "sq8": "SQ8", "pq": f"PQ{pq_subquantizers(dim)}x{PQ_BITS}"}[encoding]
+    if kind == "flat":
+        return f"IDMap2,{codes}"
+    if kind == "hnsw":
+        return f"IDMap2,HNSW{HNSW_M}" if encoding == "float" else f"IDMap2,HNSW{HNSW_M}_{codes}"
+    if kind in ("ivf_flat", "ivf_pq"):
+        return f"IDMap2,IVF{nlist_for(n)},{codes}"
+    raise ValueError(f"Unknown index type '{kind}'")
+
+
+def new_index(kind, encoding, dim, n=0, train_vectors=None):
+    """Build an empty ID-mapped inner-product index, trained on train_vectors if it needs it"""
+    index = faiss.index_factory(dim, factory_string(kind, encoding, dim, n), METRIC)
+    if kind == "hnsw":
+        faiss.downcast_index(index.index).hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    if not index.is_trained:
+        if train_vectors is None or len(train_vectors) == 0:
+            raise ValueError(f"A {kind}/{encoding} index needs training vectors")
+        index.train(np.ascontiguousarray(train_vectors, dtype=np.float32))
+    return index
+
+
+def _inner(index):
+    return faiss.downcast_index(index.index if hasattr(index, "id_map") else index)
+
+
+def index_kind(index):
+    """Which of INDEX_TYPES an ID-mapped index is"""
+    inner = _inner(index)
+    if isinstance(inner, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(inner, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def index_encoding(index):
+    """Which of ENCODINGS an ID-mapped index stores its vectors as"""
+    inner = _inner(index)
+    if isinstance(inner, faiss.IndexHNSW):
+        inner = faiss.downcast_index(inner.storage)
+    if isinstance(inner, (faiss.IndexPQ, faiss.IndexIVFPQ, faiss.IndexHNSWPQ)):
+        return "pq"
+    if isinstance(inner, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return "fp16" if inner.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    return "float"
+
+
+def is_lossy(index):
+    """True when the index scores compressed codes, so hits should be re-ranked"""
+    return index_encoding(index) != "float"
+
+
+def similarities(index, distances):
+    """Convert raw FAISS distances to inner-product similarity (higher is closer).
+
+    Indexes from before inner-product scoring use L2 over unit vectors, where
+    ``ip = 1 - l2 / 2``.
+    """
+    if index.metric_type == faiss.METRIC_L2:
+        return 1.0 - distances / 2.0
+    return distances
+
+
+def search_parameters(index, fetch, nprobe=None, ef_search=None, selector=None):
+    """Per-call search parameters; None for flat search over every vector.
+
+    ``selector`` (a FAISS IDSelector over vector IDs) restricts the search to
+    those IDs while it runs, so no candidates are spent on filtered-out ones.
+    """
+    kind = index_kind(index)
+    if kind in ("ivf_flat", "ivf_pq"):
+        params = faiss.SearchParametersIVF(nprobe=int(nprobe or INDEX_NPROBE))
+    elif kind == "hnsw":
+        # HNSW can't return more results than its candidate list holds
+        params = faiss.SearchParametersHNSW(efSearch=max(int(ef_search or INDEX_EF_SEARCH), fetch))
+    elif selector is not None:
+        params = faiss.SearchParameters()
+    else:
+        return None
+    if selector is not None:
+        params.sel = selector
+    return params
@@ -0,0 +1,136 @@
+"""Recall and size of index types/encodings against exact search, on the stored vectors.
+
+    python index_report.py --queries 200 --k 10
+    python index_report.py --configs flat:float,flat:sq8,ivf_flat:fp16,ivf_pq:pq
+
+Each configuration is built in memory from the full-precision vectors in the
+chunk store; the committed index is not touched. A sharded index is reported
+one shard at a time.
+"""
+import sys
+import copy
+import time
+import argparse
+import threading
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+import index_factory
+from shards import open_store, ShardSet
+
+# Configuration
+DEFAULT_CONFIGS = "flat:float,flat:fp16,flat:sq8,flat:pq"
+GROUND_TRUTH_BATCH = 65536
+
+
+def live_ids(store):
+    ids = faiss.vector_to_array(store.index.id_map)
+    dead = np.fromiter(store.tombstones, dtype=np.int64, count=len(store.tombstones))
+    return ids[~np.isin(ids, dead)]
+
+
+def sample_queries(store, ids, count, noise, seed=0):
+    """Unit vectors near randomly picked stored chunks, standing in for user queries"""
+    rng = np.random.default_rng(seed)
+    picked = np.sort(rng.choice(ids, min(count, len(ids)), replace=False))
+    queries = store.chunks.get_vectors(picked)
+    queries = queries + rng.standard_normal(queries.shape).astype(np.float32) * noise / np.sqrt(queries.shape[1])
+    return np.ascontiguousarray(queries / np.linalg.norm(queries, axis=1, keepdims=True), dtype=np.float32)
+
+
+def exact_neighbours(store, ids, queries, k):
+    """Exact top-k IDs by inner product, streaming the stored vectors in batches"""
+    best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    best_ids = np.full((len(queries), k), -1, dtype=np.int64)
+    for start in range(0, len(ids), GROUND_TRUTH_BATCH):
+        batch = ids[start:start + GROUND_TRUTH_BATCH]
+        scores = np.hstack([best_scores, queries @ store.chunks.get_vectors(batch).T])
+        candidates = np.hstack([best_ids, np.broadcast_to(batch, (len(queries), len(batch)))])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, top, axis=1)
+        best_ids = np.take_along_axis(candidates, top, axis=1)
+    return best_ids
+
+
+def recall(found, truth):
+    return float(np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)]))
+
+
+def evaluate(store, ids, kind, encoding, queries, truth, k, nprobe=None, ef_search=None):
+    """Build one configuration and measure it with and without re-ranking"""
+    start = time.perf_counter()
+    index = store.build_index(ids, kind, encoding, store.index.d)
+    build_seconds = time.perf_counter() - start
+    size = len(faiss.serialize_index(index))
+
+    params = index_factory.search_parameters(index, k, nprobe=nprobe, ef_search=ef_search)
+    _, raw = index.search(queries, k, params=params)
+
+    trial = copy.copy(store)
+    trial.index, trial.tombstones, trial.lock = index, set(), threading.RLock()
+    start = time.perf_counter()
+    results = [trial.search(query.reshape(1, -1), k=k, nprobe=nprobe, ef_search=ef_search)[0] for query in queries]
+    per_query = (time.perf_counter() - start) / len(queries)
+    reranked = [[entry["id"] for _, entry in hits] for hits in results]
+
+    return {
+        "config": f"{index_factory.index_kind(index)}:{index_factory.index_encoding(index)}",
+        "bytes_per_vector": size / max(len(ids), 1),
+        "index_mb": size / 1e6,
+        "recall": recall(raw, truth),
+        "recall_reranked": recall(reranked, truth) if index_factory.is_lossy(index) else None,
+        "ms_per_query": per_query * 1000,
+        "build_seconds": build_seconds,
+    }
+
+
+def report(store, args):
+    """Print one row per configuration in args.configs for a single vector store"""
+    ids = live_ids(store)
+    k = min(args.k, len(ids))
+    queries = sample_queries(store, ids, args.queries, args.noise)
+    truth = exact_neighbours(store, ids, queries, k)
+    print(f"{len(ids)} vectors of dimension {store.index.d}, {len(queries)} queries, recall@{k} "
+          f"vs exact search (re-rank depth {index_factory.INDEX_RERANK}x)")
+    print(f"{'config':<16}{'bytes/vec':>10}{'index MB':>10}{'recall':>9}{'reranked':>10}{'ms/query':>10}{'build s':>9}")
+    for config in args.configs.split(","):
+        kind, _, encoding = config.strip().partition(":")
+        try:
+            row = evaluate(store, ids, kind, encoding or "float", queries, truth, k,
+                           nprobe=args.nprobe, ef_search=args.ef_search)
+        except Exception as e:
+            print(f"{config:<16}failed: {e}")
+            continue
+        reranked = "-" if row["recall_reranked"] is None else f"{row['recall_reranked']:.3f}"
+        print(f"{row['config']:<16}{row['bytes_per_vector']:>10.0f}{row['index_mb']:>10.2f}{row['recall']:>9.3f}"
+              f"{reranked:>10}{row['ms_per_query']:>10.2f}{row['build_seconds']:>9.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare index encodings against exact inner-product search")
+    parser.add_argument("--index-dir", default=str(Path(__file__).parent.resolve() / "faiss_index"))
+    parser.add_argument("--configs", default=DEFAULT_CONFIGS, help="comma-separated type:encoding pairs")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--noise", type=float, default=0.5, help="query distance from the sampled chunk")
+    parser.add_argument("--nprobe", type=int, default=None)
+    parser.add_argument("--ef-search", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    store = open_store(args.index_dir, readonly=True)
+    stores = sorted(store.stores.items()) if isinstance(store, ShardSet) else [(None, store)]
+    stores = [(name, shard) for name, shard in stores if shard.index is not None and shard.ntotal > 0]
+    if not stores:
+        sys.exit(f"No index in {args.index_dir}")
+    for number, (name, shard) in enumerate(stores):
+        if name is not None:
+            if number:
+                print()
+            print(f"Shard {name}")
+        report(shard, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,571 @@
+import os
+import sys
+import json
+import time
+import re
+import queue
+import threading
+from collections import deque
+from pathlib import Path
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from embeddings import get_client
+from embedding_cache import EmbeddingCache, CachedEmbedder
+from conversion_cache import ConversionCache
+from vector_store import VectorStore
+from shards import open_store
+from fingerprint import FingerprintManifest, is_legacy_digest, md5_file
+
+# Configuration
+ROOT = Path(__file__).parent.resolve()
+CHUNK_SIZE = 256
+CHUNK_OVERLAP = 40
+CONVERT_WORKERS = int(os.getenv("INGEST_CONVERT_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+EMBED_WORKERS = int(os.getenv("INGEST_EMBED_WORKERS", "4"))
+QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "16"))
+CHECKPOINT_FILES = int(os.getenv("INGEST_CHECKPOINT_FILES", "25"))
+CHECKPOINT_SECONDS = float(os.getenv("INGEST_CHECKPOINT_SECONDS", "120"))
+WRITER_LOCK_FILE = "WRITER.lock"
+
+_STOP = object()
+
+
+def default_log(level, message):
+    """Log to stderr so the MCP stdio channel stays clean"""
+    sys.stderr.write(f"{level}: {message}\n")
+    sys.stderr.flush()
+
+
+_WORD_RE = re.compile(rb"\S+")
+# Blank lines end a block, and a Markdown heading always starts a new one
+_BLOCK_BREAK_RE = re.compile(rb"\n[ \t\r]*\n|\n(?=#{1,6}\s)")
+
+
+def _blocks(data):
+    """Yield (start, end, words) of the paragraphs and headings of data"""
+    pos = 0
+    for match in _BLOCK_BREAK_RE.finditer(data):
+        words = sum(1 for _ in _WORD_RE.finditer(data, pos, match.start()))
+        if words:
+            yield pos, match.start(), words
+        pos = match.end()
+    words = sum(1 for _ in _WORD_RE.finditer(data, pos))
+    if words:
+        yield pos, len(data), words
+
+
+def _word_windows(data, start, end, size, overlap):
+    """Split one oversized block into windows of size words sharing overlap words"""
+    window, emitted = deque(), False
+    for match in _WORD_RE.finditer(data, start, end):
+        window.append(match.span())
+        if len(window) == size:
+            yield window[0][0], window[-1][1]
+            emitted = True
+            for _ in range(size - overlap):
+                window.popleft()
+    if window and (not emitted or len(window) > overlap):
+        yield window[0][0], window[-1][1]
+
+
+def chunk_spans(data, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """Yield (start, end) byte offsets of chunks of the UTF-8 markdown in data.
+
+    Paragraphs are packed into chunks of up to ``size`` words, a heading always
+    starts a new chunk, and only paragraphs longer than ``size`` are cut
+    mid-text. A short final paragraph (at most ``overlap`` words) is repeated
+    at the start of the next chunk of the same section. The text is scanned
+    with regex iterators, so no word list or chunk copies are ever built.
+    """
+    current, last = None, None  # [start, end, words] of the open chunk, (start, words) of its last block
+    for start, end, words in _blocks(data):
+        heading = data.startswith(b"#", start)
+        if current and (heading or current[2] + words > size):
+            yield current[0], current[1]
+            if not heading and last[0] != current[0] and last[1] <= overlap and last[1] + words <= size:
+                current = [last[0], current[1], last[1]]
+            else:
+                current = None
+        if words > size:
+            yield from _word_windows(data, start, end, size, overlap)
+            current, last = None, None
+            continue
+        if current:
+            current[1], current[2] = end, current[2] + words
+        else:
+            current = [start, end, words]
+        last = (start, words)
+    if current:
+        yield current[0], current[1]
+
+
+_converter = None
+
+
+def convert_file(path):
+    """Convert a document to markdown text; runs inside the conversion pool"""
+    global _converter
+    if _converter is None:
+        from markitdown import MarkItDown
+        _converter = MarkItDown()
+    return _converter.convert(str(path)).text_content
+
+
+class IngestStats:
+    """Counters collected while a pipeline run is in progress"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.files_done = 0
+        self.files_failed = 0
+        self.chunks = 0
+        self.bytes_in = 0
+        self.convert_seconds = 0.0
+        self.embed_seconds = 0.0
+        self.embed_calls = 0
+        self.compaction = None
+        self.skipped = False
+        self.lock = threading.Lock()
+
+    def add_embed(self, seconds):
+        with self.lock:
+            self.embed_seconds += seconds
+            self.embed_calls += 1
+
+    def summary(self):
+        wall = max(time.perf_counter() - self.started, 1e-9)
+        return (
+            f"{self.files_done} file(s), {self.chunks} chunk(s) in {wall:.1f}s | "
+            f"{self.files_done / wall:.2f} files/s, {self.chunks / wall:.1f} chunks/s, "
+            f"{self.bytes_in / wall / 1e6:.2f} MB/s | "
+            f"convert busy {self.convert_seconds:.1f}s, embed busy {self.embed_seconds:.1f}s "
+            f"over {self.embed_calls} request(s) | {self.files_failed} failed"
+        )
+
+
+class WriterLock:
+    """Inter-process lock on ``WRITER.lock`` in an index directory; one writer at a time.
+
+    It is an OS file lock, so it is also released when the holding process
+    dies. ``acquire()`` never waits: it returns False while another process
+    (or another run in this one) holds the lock.
+    """
+
+    def __init__(self, index_dir):
+        self.path = Path(index_dir) / WRITER_LOCK_FILE
+        self.file = None
+
+    def acquire(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        handle = open(self.path, "a+")
+        try:
+            if os.name == "nt":
+                import msvcrt
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        self.file = handle
+        return True
+
+    def release(self):
+        handle, self.file = self.file, None
+        if handle is None:
+            return
+        try:
+            if os.name == "nt":
+                import msvcrt
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+        finally:
+            handle.close()
+
+
+def _timed_convert(path):
+    # Encoded in the worker so only one compact copy of the text crosses over
+    start = time.perf_counter()
+    data = convert_file(path).encode("utf-8")
+    return data, time.perf_counter() - start
+
+
+def run_pipeline(jobs, on_file_done, embedder=None, log=default_log,
+                 convert_workers=CONVERT_WORKERS, embed_workers=EMBED_WORKERS,
+                 queue_size=QUEUE_SIZE, stats=None, convert_cache=None):
+    """Convert, chunk and embed jobs in overlapping stages.
+
+    Each job is a dict with at least ``path`` and ``name``. Conversion runs in a
+    process pool (or threads when ``convert_workers`` is 0), chunks are streamed
+    into bounded embedding batches, and embedding runs on ``embed_workers``
+    threads. ``on_file_done(job, text, spans, vectors)`` gets the converted
+    UTF-8 text and the byte offsets of its chunks; it is always called from
+    the calling thread, so it can mutate the index without locking.
+
+    With a ``convert_cache``, jobs whose content ``hash`` was converted before
+    skip the conversion pool and fresh conversions are added to the cache.
+
+    If a conversion worker dies, the pool is replaced and each file that was
+    in flight is converted once more in a process of its own, so only the
+    file that crashed the worker is reported as failed and the run finishes.
+    """
+    embedder = embedder or get_client()
+    stats = stats or IngestStats()
+    converted_q = queue.Queue()  # bounded by the in_flight semaphore
+    embed_q = queue.Queue(maxsize=queue_size)
+    result_q = queue.Queue()
+    in_flight = threading.BoundedSemaphore(queue_size)
+
+    def new_pool():
+        if convert_workers > 0:
+            return ProcessPoolExecutor(max_workers=convert_workers)
+        return ThreadPoolExecutor(max_workers=1)
+
+    pools = [new_pool()]
+    pool_lock = threading.Lock()
+
+    def submit(job, isolated=False):
+        # The callback hands the conversion, or its error, to the chunker
+        try:
+            with pool_lock:
+                if isolated:
+                    # A retry after a crash; on its own a crash again only takes this file down
+                    pools.append(ProcessPoolExecutor(max_workers=1))
+                    future = pools[-1].submit(_timed_convert, job["path"])
+                    pools[-1].shutdown(wait=False)
+                else:
+                    try:
+                        future = pools[0].submit(_timed_convert, job["path"])
+                    except BrokenProcessPool:
+                        # A worker died; later files go to a fresh pool
+                        pools[0].shutdown(wait=False)
+                        pools[0] = new_pool()
+                        future = pools[0].submit(_timed_convert, job["path"])
+        except Exception as e:
+            future = Future()
+            future.set_exception(e)
+        future.add_done_callback(lambda f, job=job: converted_q.put((job, f)))
+
+    def feed():
+        # Stage 1: submit conversions, never more than queue_size at once
+        try:
+            for job in jobs:
+                in_flight.acquire()
+                try:
+                    cached = convert_cache.get(job["hash"]) if convert_cache and job.get("hash") else None
+                except Exception:
+                    cached = None
+                if cached is not None:
+                    future = Future()
+                    future.set_result((cached, 0.0))
+                    job["converted_from_cache"] = True
+                    future.add_done_callback(lambda f, job=job: converted_q.put((job, f)))
+                else:
+                    submit(job)
+        finally:
+            # Every permit is back once the chunker has taken the last conversion
+            for _ in range(queue_size):
+                in_flight.acquire()
+            converted_q.put(_STOP)
+
+    def chunker():
+        # Stage 2: stream chunks of each converted file into embedding batches
+        while True:
+            item = converted_q.get()
+            if item is _STOP:
+                break
+            job, future = item
+            try:
+                data, seconds = future.result()
+                stats.convert_seconds += seconds
+            except BrokenProcessPool as e:
+                if not job.get("resubmitted"):
+                    # Killed along with the worker that crashed; convert it again, keeping its permit
+                    job["resubmitted"] = True
+                    submit(job, isolated=True)
+                    continue
+                in_flight.release()
+                result_q.put(("error", job, e))
+                continue
+            except Exception as e:
+                in_flight.release()
+                result_q.put(("error", job, e))
+                continue
+            in_flight.release()
+            if convert_cache and job.get("hash") and not job.get("converted_from_cache"):
+                try:
+                    convert_cache.put(job["hash"], data)
+                except Exception as e:
+                    log("WARN", f"Could not cache conversion of {job['name']}: {e}")
+            # Only one batch of chunk strings per queue slot exists at a time
+            batch, batch_no = [], 0
+            for span in chunk_spans(data):
+                batch.append(span)
+                if len(batch) >= embedder.batch_size:
+                    embed_q.put((job, batch_no, batch, [data[s:e].decode("utf-8") for s, e in batch]))
+                    batch, batch_no = [], batch_no + 1
+            if batch:
+                embed_q.put((job, batch_no, batch, [data[s:e].decode("utf-8") for s, e in batch]))
+                batch_no += 1
+            result_q.put(("chunked", job, (batch_no, data)))
+        for _ in range(embed_workers):
+            embed_q.put(_STOP)
+
+    def embed_worker():
+        # Stage 3: embedding requests run concurrently
+        while True:
+            item = embed_q.get()
+            if item is _STOP:
+                result_q.put(("worker_done", None, None))
+                break
+            job, batch_no, spans, texts = item
+            try:
+                start = time.perf_counter()
+                vectors = embedder.embed(texts)
+                stats.add_embed(time.perf_counter() - start)
+                result_q.put(("batch", job, (batch_no, spans, vectors)))
+            except Exception as e:
+                result_q.put(("error", job, e))
+
+    embed_workers = max(1, embed_workers)
+    threads = [threading.Thread(target=feed, daemon=True), threading.Thread(target=chunker, daemon=True)]
+    threads += [threading.Thread(target=embed_worker, daemon=True) for _ in range(embed_workers)]
+    for t in threads:
+        t.start()
+
+    # Stage 4: reassemble batches per file and hand complete files to the writer
+    batches, expected, texts, failed = {}, {}, {}, set()
+    workers_left = embed_workers
+    try:
+        while workers_left:
+            kind, job, payload = result_q.get()
+            if kind == "worker_done":
+                workers_left -= 1
+                continue
+            key = id(job)
+            if key in failed:
+                continue
+            if kind == "error":
+                failed.add(key)
+                batches.pop(key, None)
+                expected.pop(key, None)
+                texts.pop(key, None)
+                stats.files_failed += 1
+                log("ERROR", f"Failed to process {job['name']}: {payload}")
+                continue
+            if kind == "chunked":
+                expected[key], texts[key] = payload
+            else:
+                batches.setdefault(key, []).append(payload)
+            if key in expected and len(batches.get(key, [])) == expected[key]:
+                parts = sorted(batches.pop(key, []), key=lambda p: p[0])
+                expected.pop(key)
+                spans = [span for _, batch, _ in parts for span in batch]
+                vectors = [v for _, _, v in parts]
+                try:
+                    on_file_done(job, texts.pop(key), spans, vectors)
+                    stats.files_done += 1
+                    stats.chunks += len(spans)
+                    stats.bytes_in += job.get("size", 0)
+                except Exception as e:
+                    stats.files_failed += 1
+                    log("ERROR", f"Failed to index {job['name']}: {e}")
+    finally:
+        for pool in pools:
+            pool.shutdown(wait=True, cancel_futures=True)
+    return stats
+
+
+def process_documents(log=default_log, root=ROOT, convert_workers=CONVERT_WORKERS,
+                      embed_workers=EMBED_WORKERS, embedder=None, use_cache=True,
+                      checkpoint_files=CHECKPOINT_FILES, checkpoint_seconds=CHECKPOINT_SECONDS,
+                      force=False):
+    """Process documents listed in visited_files.json and update the FAISS index.
+
+    ``force`` re-chunks and re-embeds unchanged files too, e.g. after changing
+    the chunker; their converted text comes from the conversion cache.
+    A checkpoint is committed every ``checkpoint_files`` files or
+    ``checkpoint_seconds`` seconds (0 turns either off), and a run that
+    changes nothing commits no new generation.
+
+    The run holds the index's ``WriterLock``, and a compaction it starts keeps
+    holding it until it finishes. While another writer (the background
+    indexer or the monitor tab) holds it, the run is skipped and the
+    returned stats have ``skipped`` set.
+    """
+    lock = WriterLock(Path(root) / "faiss_index")
+    if not lock.acquire():
+        log("SKIP", "Another process is updating the index; skipping this run")
+        stats = IngestStats()
+        stats.skipped = True
+        return stats
+    try:
+        stats = _process_documents(log, root, convert_workers, embed_workers, embedder, use_cache,
+                                   checkpoint_files, checkpoint_seconds, force)
+    except BaseException:
+        lock.release()
+        raise
+    if stats.compaction is None:
+        lock.release()
+    else:
+        compaction = stats.compaction
+        threading.Thread(target=lambda: (compaction.join(), lock.release()), daemon=True).start()
+    return stats
+
+
+def _process_documents(log, root, convert_workers, embed_workers, embedder, use_cache,
+                       checkpoint_files, checkpoint_seconds, force):
+    import numpy as np
+
+    log("INFO", "Indexing documents with MarkItDown...")
+    INDEX_CACHE = Path(root) / "faiss_index"
+    INDEX_CACHE.mkdir(exist_ok=True)
+    VISITED_FILE = Path(root) / "visited_files.json"
+    EMBED_CACHE_FILE = INDEX_CACHE / "embedding_cache.sqlite"
+    CONVERT_CACHE_FILE = INDEX_CACHE / "conversion_cache.sqlite"
+    MANIFEST_FILE = INDEX_CACHE / "file_manifest.json"
+
+    store, visited_data = VectorStore(INDEX_CACHE), []
+    try:
+        store = open_store(INDEX_CACHE)
+        if VISITED_FILE.exists():
+            visited_data = json.loads(VISITED_FILE.read_text(encoding='utf-8'))
+    except Exception as e:
+        log("WARN", f"Error loading data files: {e}")
+
+    if store.run_state and not store.run_state.get("complete", True):
+        log("INFO", f"Resuming from checkpoint generation {store.generation} "
+                    f"({store.run_state.get('files_done', 0)}/{store.run_state.get('files_total', 0)} files were done)")
+
+    # Only files whose size, mtime or inode changed are read and hashed again
+    manifest = FingerprintManifest.load(MANIFEST_FILE)
+    digests = manifest.scan([entry['file_path'] for entry in visited_data])
+
+    jobs, removed = [], 0
+    for entry in visited_data:
+        file_path = Path(entry['file_path'])
+        fhash = digests.get(str(file_path))
+        if fhash is None:
+            log("MISS", f"File not found: {file_path}")
+            removed += store.remove_document(file_path)
+            continue
+        stored = store.document_hash(file_path)
+        if stored != fhash and is_legacy_digest(stored) and md5_file(file_path) == stored:
+            # Indexed before the manifest existed; record the new digest without re-indexing
+            store.update_document(file_path, hash=fhash)
+            stored = fhash
+        if stored == fhash and not force:
+            # Registries from before date filters have no modification time yet
+            if store.document(file_path).get("mtime") is None:
+                store.update_document(file_path, mtime=manifest.files[str(file_path)]["stat"][1] / 1e9)
+            log("SKIP", f"Skipping unchanged file: {entry['file_name']}")
+            continue
+        jobs.append({
+            "name": entry['file_name'],
+            "path": str(file_path),
+            "hash": fhash,
+            "size": manifest.files[str(file_path)]["stat"][0],
+            "mtime": manifest.files[str(file_path)]["stat"][1] / 1e9,
+        })
+
+    try:
+        manifest.save()
+    except OSError as e:
+        log("WARN", f"Could not save file manifest: {e}")
+
+    if removed:
+        log("INFO", f"Removed {removed} vector(s) of deleted files from the index")
+    if not jobs:
+        log("INFO", "No new files to process.")
+    else:
+        log("INFO", f"Found {len(jobs)} file(s) to process")
+
+    progress = {"done": 0, "last_checkpoint": time.monotonic()}
+
+    def checkpoint(complete):
+        store.save(run_state={
+            "complete": complete,
+            "files_done": progress["done"],
+            "files_total": len(jobs),
+        })
+        progress["last_checkpoint"] = time.monotonic()
+
+    def on_file_done(job, text, spans, vectors):
+        # Replaces the previous version of the file instead of appending to it
+        matrix = np.vstack(vectors) if vectors else np.empty((0, 0), dtype=np.float32)
+        store.add_document(job["path"], job["name"], job["hash"], text, spans, matrix, mtime=job.get("mtime"))
+        progress["done"] += 1
+        log("DONE", f"Completed: {job['name']} - {len(spans)} chunks indexed")
+
+        # Periodic commits keep finished work if the run dies later on
+        if ((checkpoint_files and progress["done"] % checkpoint_files == 0)
+                or (checkpoint_seconds and time.monotonic() - progress["last_checkpoint"] >= checkpoint_seconds)):
+            try:
+                checkpoint(complete=False)
+                log("CHECKPOINT", f"Committed generation {store.generation} "
+                                  f"({progress['done']}/{len(jobs)} files)")
+            except Exception as e:
+                log("WARN", f"Checkpoint failed: {e}")
+
+    # Unchanged chunks of edited files and repeated boilerplate come from the cache
+    embedder = embedder or get_client()
+    cache = convert_cache = None
+    if use_cache and jobs:
+        cache = EmbeddingCache(EMBED_CACHE_FILE)
+        embedder = CachedEmbedder(embedder, cache)
+        convert_cache = ConversionCache(CONVERT_CACHE_FILE)
+
+    try:
+        stats = run_pipeline(jobs, on_file_done, embedder=embedder, log=log,
+                             convert_workers=convert_workers, embed_workers=embed_workers,
+                             convert_cache=convert_cache)
+    except BaseException:
+        # Stopped or crashed: commit what finished so the next run resumes from here
+        if progress["done"]:
+            try:
+                checkpoint(complete=False)
+            except Exception as e:
+                log("WARN", f"Checkpoint failed: {e}")
+        raise
+    finally:
+        if cache is not None:
+            cache.close()
+            convert_cache.close()
+
+    try:
+        if store.ntotal == 0:
+            log("WARN", "No new documents or updates to process.")
+        elif not store.dirty and (store.run_state or {}).get("complete", True):
+            # Readers keep their loaded generation and result caches
+            log("INFO", f"Index unchanged; generation {store.generation} stays current")
+        else:
+            checkpoint(complete=True)
+            log("SUCCESS", "Saved FAISS index and metadata")
+    except Exception as e:
+        log("ERROR", f"Error saving data: {e}")
+
+    # Dropping dead vectors and retraining for a grown corpus happen off the critical path
+    stats.compaction = store.start_compaction(log=log)
+
+    if jobs:
+        log("STATS", stats.summary())
+        if cache is not None:
+            log("STATS", f"Embedding cache: {embedder.hits} chunk(s) reused, {embedder.misses} embedded")
+            log("STATS", f"Conversion cache: {convert_cache.hits} file(s) reused, {convert_cache.misses} converted")
+    return stats
+
+
+def wait_for_compaction(stats):
+    """Block until a compaction started by process_documents has finished"""
+    if stats is not None and stats.compaction is not None:
+        stats.compaction.join()
+
+
+if __name__ == "__main__":
+    wait_for_compaction(process_documents(force="--reindex" in sys.argv[1:]))
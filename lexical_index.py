@@ -0,0 +1,273 @@
+import os
+import re
+import math
+import time
+import sqlite3
+import threading
+from itertools import chain
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+# Configuration
+LEXICAL_INDEX_FILE = "lexical.sqlite"
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+MAX_QUERY_TERMS = 32
+_TOKEN_RE = re.compile(r"\w+(?:[-./:#]\w+)*")
+_SPLIT_RE = re.compile(r"[-./:#_]")
+_WIDTHS = {1: np.uint8, 2: np.uint16, 4: np.uint32, 8: np.uint64}
+
+
+def tokenize(text):
+    """Lower-cased word tokens; compound identifiers (``POL-2023-01``) also yield their parts"""
+    tokens = []
+    for match in _TOKEN_RE.finditer(text.lower()):
+        token = match.group()
+        tokens.append(token)
+        parts = [part for part in _SPLIT_RE.split(token) if part]
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+def _pack(values, delta=False):
+    """Encode non-negative ints in the narrowest fixed width, optionally as gaps (one header byte)"""
+    values = np.asarray(values, dtype=np.int64)
+    if delta:
+        values = np.diff(values, prepend=0)
+    top = int(values.max()) if len(values) else 0
+    width = next(w for w in (1, 2, 4, 8) if top < 1 << (8 * w))
+    return bytes([width]) + values.astype(_WIDTHS[width]).tobytes()
+
+
+def _unpack(blob, delta=False):
+    values = np.frombuffer(blob, dtype=_WIDTHS[blob[0]], offset=1).astype(np.int64)
+    return np.cumsum(values) if delta else values
+
+
+class LexicalIndex:
+    """BM25 inverted index over chunk text, keyed by the same vector IDs as the FAISS index.
+
+    Documents added during ingestion are collected in memory and written as
+    one immutable segment per ``commit()``. A segment stores its sorted
+    vector IDs and token counts once; each term's postings in it are the
+    gap-encoded positions into that list plus term frequencies, packed in
+    the narrowest integer width that fits. Small segments are merged as new
+    ones arrive, so a corpus stays at a logarithmic number of segments, and
+    ``merge(drop)`` rewrites everything into one segment during compaction.
+
+    Deleted chunks are not removed from postings right away; searches skip
+    the vector store's tombstones instead.
+    """
+
+    def __init__(self, path, readonly=False):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.pending_ids = []
+        self.pending_lengths = []
+        self.pending_postings = {}
+        self.segments = {}
+        self.totals = (0, 0)
+        if readonly:
+            self.conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self.conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            # Readers cache segments by id, so a merged segment must never reuse the id of one it replaced
+            schema = self.conn.execute("SELECT sql FROM sqlite_master WHERE name = 'segments'").fetchone()
+            reused_ids = schema is not None and "AUTOINCREMENT" not in schema[0].upper()
+            if reused_ids:
+                self.conn.execute("ALTER TABLE segments RENAME TO segments_old")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS segments (id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " ids BLOB NOT NULL, lengths BLOB NOT NULL)"
+            )
+            if reused_ids:
+                self.conn.execute("INSERT INTO segments (id, ids, lengths) SELECT id, ids, lengths FROM segments_old")
+                self.conn.execute("DROP TABLE segments_old")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS postings (term TEXT NOT NULL, segment INTEGER NOT NULL,"
+                " docs BLOB NOT NULL, freqs BLOB NOT NULL, PRIMARY KEY (term, segment)) WITHOUT ROWID"
+            )
+            self.conn.commit()
+
+    @classmethod
+    def open(cls, index_dir, readonly=False):
+        """Open the lexical index that lives next to the vector index in index_dir"""
+        return cls(Path(index_dir) / LEXICAL_INDEX_FILE, readonly=readonly)
+
+    @staticmethod
+    def exists(index_dir):
+        return (Path(index_dir) / LEXICAL_INDEX_FILE).exists()
+
+    def add(self, ids, texts):
+        """Queue chunk texts under their vector IDs (which must keep increasing) for the next segment"""
+        with self.lock:
+            for vid, text in zip(ids, texts):
+                counts = Counter(tokenize(text))
+                position = len(self.pending_ids)
+                self.pending_ids.append(int(vid))
+                self.pending_lengths.append(sum(counts.values()))
+                for term, tf in counts.items():
+                    docs, freqs = self.pending_postings.setdefault(term, ([], []))
+                    docs.append(position)
+                    freqs.append(tf)
+
+    def commit(self):
+        """Write queued chunks as a new segment, merge small segments and commit"""
+        with self.lock:
+            if self.pending_ids:
+                cursor = self.conn.execute(
+                    "INSERT INTO segments (ids, lengths) VALUES (?, ?)",
+                    (_pack(self.pending_ids, delta=True), _pack(self.pending_lengths))
+                )
+                self.conn.executemany(
+                    "INSERT INTO postings (term, segment, docs, freqs) VALUES (?, ?, ?, ?)",
+                    [(term, cursor.lastrowid, _pack(docs, delta=True), _pack(freqs))
+                     for term, (docs, freqs) in self.pending_postings.items()]
+                )
+                self.pending_ids, self.pending_lengths, self.pending_postings = [], [], {}
+                # Merge while the previous segment is no larger than the newest, like a binary counter
+                sizes = self._segment_sizes()
+                tail = 1
+                while tail < len(sizes) and sizes[-tail - 1][1] <= sum(size for _, size in sizes[-tail:]):
+                    tail += 1
+                if tail > 1:
+                    self._merge([segment for segment, _ in sizes[-tail:]])
+            self.conn.commit()
+
+    def _segment_sizes(self):
+        return [(segment, (len(ids) - 1) // ids[0])
+                for segment, ids in self.conn.execute("SELECT id, ids FROM segments ORDER BY id")]
+
+    def merge(self, drop=()):
+        """Rewrite every segment into one, leaving out the vector IDs in drop (committed with the next commit())"""
+        with self.lock:
+            segments = [segment for segment, _ in self._segment_sizes()]
+            if len(segments) > 1 or (segments and drop):
+                self._merge(segments, drop)
+
+    def clear(self):
+        """Drop every segment and queued chunk, e.g. before indexing all chunks again (committed with the next commit())"""
+        with self.lock:
+            self.pending_ids, self.pending_lengths, self.pending_postings = [], [], {}
+            self.conn.execute("DELETE FROM postings")
+            self.conn.execute("DELETE FROM segments")
+
+    def _merge(self, segments, drop=()):
+        placeholders = ",".join("?" * len(segments))
+        rows = self.conn.execute(
+            f"SELECT id, ids, lengths FROM segments WHERE id IN ({placeholders}) ORDER BY id", segments
+        ).fetchall()
+        ids = [_unpack(row[1], delta=True) for row in rows]
+        offsets = dict(zip((row[0] for row in rows), np.cumsum([0] + [len(part) for part in ids[:-1]])))
+        ids = np.concatenate(ids)
+        lengths = np.concatenate([_unpack(row[2]) for row in rows])
+        keep = ~np.isin(ids, np.fromiter(drop, dtype=np.int64, count=len(drop)))
+        remap = np.cumsum(keep) - 1
+
+        merged = []
+        term, docs, freqs = None, [], []
+        cursor = self.conn.execute(
+            f"SELECT term, segment, docs, freqs FROM postings WHERE segment IN ({placeholders}) ORDER BY term, segment",
+            segments
+        )
+        for row in chain(cursor, [(None, None, None, None)]):
+            if row[0] != term and docs:
+                docs, freqs = np.concatenate(docs), np.concatenate(freqs)
+                mask = keep[docs]
+                if mask.any():
+                    merged.append((term, _pack(remap[docs[mask]], delta=True), _pack(freqs[mask])))
+                docs, freqs = [], []
+            term = row[0]
+            if term is not None:
+                docs.append(_unpack(row[2], delta=True) + offsets[row[1]])
+                freqs.append(_unpack(row[3]))
+
+        self.conn.execute(f"DELETE FROM postings WHERE segment IN ({placeholders})", segments)
+        self.conn.execute(f"DELETE FROM segments WHERE id IN ({placeholders})", segments)
+        if keep.any():
+            segment = self.conn.execute(
+                "INSERT INTO segments (ids, lengths) VALUES (?, ?)",
+                (_pack(ids[keep], delta=True), _pack(lengths[keep]))
+            ).lastrowid
+            self.conn.executemany(
+                "INSERT INTO postings (term, segment, docs, freqs) VALUES (?, ?, ?, ?)",
+                [(term, segment, docs, freqs) for term, docs, freqs in merged]
+            )
+
+    def _refresh_segments(self):
+        # Segments are immutable, so only new ones have to be read; merged-away ones are dropped
+        current = [row[0] for row in self.conn.execute("SELECT id FROM segments")]
+        missing = [segment for segment in current if segment not in self.segments]
+        if not missing and len(current) == len(self.segments):
+            return
+        segments = {segment: self.segments[segment] for segment in current if segment in self.segments}
+        for segment in missing:
+            row = self.conn.execute("SELECT ids, lengths FROM segments WHERE id = ?", (segment,)).fetchone()
+            segments[segment] = (_unpack(row[0], delta=True), _unpack(row[1]))
+        self.segments = segments
+        self.totals = (sum(len(ids) for ids, _ in segments.values()),
+                       sum(int(lengths.sum()) for _, lengths in segments.values()))
+
+    def search(self, query, k=10, exclude=(), deadline=None, allowed=None):
+        """Top k (BM25 score, vector ID) pairs for query, skipping IDs in exclude.
+
+        ``allowed`` is an optional boolean array over vector IDs; postings
+        outside it are dropped before scores are summed.
+
+        Terms are scored rarest first; once ``deadline`` (a ``time.monotonic()``
+        value) has passed, the remaining, most common terms are skipped.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+        with self.lock:
+            self._refresh_segments()
+            count, total_length = self.totals
+            if not terms or not count:
+                return []
+            average_length = total_length / count
+            postings = []
+            for term in terms:
+                rows = self.conn.execute("SELECT segment, docs, freqs FROM postings WHERE term = ?", (term,)).fetchall()
+                rows = [row for row in rows if row[0] in self.segments]
+                df = sum((len(row[1]) - 1) // row[1][0] for row in rows)
+                if df:
+                    postings.append((math.log(1 + (count - df + 0.5) / (df + 0.5)), rows))
+            postings.sort(key=lambda item: -item[0])
+
+            hits, scores = [], []
+            for i, (idf, rows) in enumerate(postings):
+                if i and deadline is not None and time.monotonic() > deadline:
+                    break
+                for segment, docs, freqs in rows:
+                    ids, lengths = self.segments[segment]
+                    docs = _unpack(docs, delta=True)
+                    tf = _unpack(freqs).astype(np.float32)
+                    if allowed is not None:
+                        vids = ids[docs]
+                        inside = vids < len(allowed)
+                        inside[inside] = allowed[vids[inside]]
+                        docs, tf = docs[inside], tf[inside]
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[docs] / average_length)
+                    hits.append(ids[docs])
+                    scores.append(idf * tf * (BM25_K1 + 1) / (tf + norm))
+        if not hits:
+            return []
+
+        hits, inverse = np.unique(np.concatenate(hits), return_inverse=True)
+        totals = np.bincount(inverse, weights=np.concatenate(scores))
+        results = []
+        for i in np.argsort(-totals, kind="stable"):
+            if int(hits[i]) in exclude:
+                continue
+            results.append((float(totals[i]), int(hits[i])))
+            if len(results) == k:
+                break
+        return results
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,133 @@
+import os
+import time
+import random
+import asyncio
+import threading
+import weakref
+
+import httpx
+from dotenv import load_dotenv
+from google import genai
+from google.genai import errors, types
+
+load_dotenv()
+
+# Configuration
+LLM_MODEL = os.getenv("LLM_MODEL", "gemini-2.0-flash")
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "")  # e.g. a local stand-in server in tests; empty uses Google's endpoint
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))  # seconds per attempt
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "3"))  # extra attempts after the first
+LLM_BACKOFF = float(os.getenv("LLM_BACKOFF", "0.5"))  # seconds before the first retry, doubled after each
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+LLM_RATE = float(os.getenv("LLM_RATE", "4"))  # requests per second across the process, 0 disables the limit
+LLM_BURST = int(os.getenv("LLM_BURST", "4"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "10"))
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Allows ``rate`` requests per second with bursts of up to ``burst``.
+
+    Thread-safe and not tied to an event loop, so one bucket paces every
+    agent session in the process. A ``rate`` of 0 never waits.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token and return the seconds to wait before using it"""
+        if self.rate <= 0:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def retryable(error):
+    """Timeouts, dropped connections, rate limiting and server errors are worth another attempt"""
+    if isinstance(error, (asyncio.TimeoutError, httpx.TransportError)):
+        return True
+    return isinstance(error, errors.APIError) and error.code in RETRY_STATUS
+
+
+def backoff_delay(attempt, base=LLM_BACKOFF, cap=LLM_BACKOFF_MAX):
+    """Exponential backoff with jitter: somewhere between half and all of base * 2**attempt"""
+    delay = min(cap, base * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+# Shared by every client so concurrent sessions stay under the provider's limits together
+rate_limiter = TokenBucket(LLM_RATE, LLM_BURST)
+
+
+class LLMClient:
+    """Async text generation through the Gemini API.
+
+    One ``genai.Client`` (and its pooled HTTP connections) is reused for
+    every call. Each attempt waits for the shared rate limiter and is cut
+    off after ``timeout`` seconds; failures in ``retryable`` are retried up
+    to ``retries`` times with jittered exponential backoff. ``base_url``
+    points the client at another server speaking the same API.
+    """
+
+    def __init__(self, model=LLM_MODEL, base_url=LLM_BASE_URL, api_key=None, timeout=LLM_TIMEOUT,
+                 retries=LLM_RETRIES, limiter=rate_limiter, log=None):
+        self.model = model
+        self.timeout = timeout
+        self.retries = max(0, retries)
+        self.limiter = limiter
+        self.log = log
+        options = {"timeout": int(timeout * 1000)}
+        if base_url:
+            options["base_url"] = base_url
+        if "async_client_args" in types.HttpOptions.model_fields:
+            options["async_client_args"] = {"limits": httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                                                                   max_keepalive_connections=LLM_MAX_CONNECTIONS)}
+        self.client = genai.Client(api_key=api_key or os.getenv("GEMINI_API_KEY"),
+                                   http_options=types.HttpOptions(**options))
+
+    async def generate(self, prompt, model=None):
+        """Response text for prompt; raises the last error once retries are used up"""
+        for attempt in range(self.retries + 1):
+            await self.limiter.acquire()
+            try:
+                response = await asyncio.wait_for(
+                    self.client.aio.models.generate_content(model=model or self.model, contents=prompt),
+                    self.timeout)
+                return response.text or ""
+            except Exception as e:
+                if attempt == self.retries or not retryable(e):
+                    raise
+                delay = backoff_delay(attempt)
+                if self.log:
+                    self.log("llm", f"⚠️ Attempt {attempt + 1} failed ({type(e).__name__}: {e}); "
+                                    f"retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+
+# The SDK's async connections belong to the loop that opened them, so each loop gets its own client
+_clients = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+
+def get_client(log=None):
+    """The shared LLMClient for the running event loop"""
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        client = _clients.get(loop)
+        if client is None:
+            client = _clients[loop] = LLMClient(log=log)
+        return client
@@ -2,7 +2,7 @@
 
 import numpy as np
 import faiss
-import requests
+from embeddings import EmbeddingClient
 from typing import List, Optional, Literal
 from pydantic import BaseModel
 from datetime import datetime
@@ -22,17 +22,13 @@ class MemoryManager:
     def __init__(self, embedding_model_url="http://localhost:11434/api/embeddings", model_name="nomic-embed-text"):
         self.embedding_model_url = embedding_model_url
         self.model_name = model_name
+        self.embedder = EmbeddingClient(url=embedding_model_url, model=model_name)
         self.index = None
         self.data: List[MemoryItem] = []
         self.embeddings: List[np.ndarray] = []
 
     def _get_embedding(self, text: str) -> np.ndarray:
-        response = requests.post(
-            self.embedding_model_url,
-            json={"model": self.model_name, "prompt": text}
-        )
-        response.raise_for_status()
-        return np.array(response.json()["embedding"], dtype=np.float32)
+        return self.embedder.embed_one(text)
 
     def add(self, item: MemoryItem):
         emb = self._get_embedding(item.text)
@@ -55,7 +51,8 @@ class MemoryManager:
         if not self.index or len(self.data) == 0:
             return []
 
-        query_vec = self._get_embedding(query).reshape(1, -1)
+        # The same user input is retrieved at every step of a session; reuse its vector
+        query_vec = self.embedder.embed_query(query).reshape(1, -1)
         D, I = self.index.search(query_vec, top_k * 2)  # Overfetch to allow filtering
 
         results = []
@@ -83,5 +80,12 @@ class MemoryManager:
         return results
 
     def bulk_add(self, items: List[MemoryItem]):
-        for item in items:
-            self.add(item)
+        if not items:
+            return
+        embs = self.embedder.embed([item.text for item in items])
+        self.embeddings.extend(embs)
+        self.data.extend(items)
+
+        if self.index is None:
+            self.index = faiss.IndexFlatL2(embs.shape[1])
+        self.index.add(embs)
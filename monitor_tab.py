@@ -5,7 +5,6 @@ import json
 import threading
 import queue
 from pathlib import Path
-import hashlib
 import tkinter as tk
 from tkinter import ttk, scrolledtext, font
 from datetime import datetime
@@ -21,8 +20,7 @@ except ImportError:
 try:
     import faiss
     import numpy as np
-    from tqdm import tqdm
-    import requests
+    import ingest
     HAS_PROCESSING = True
 except ImportError:
     HAS_PROCESSING = False
@@ -31,10 +29,8 @@ except ImportError:
 ROOT_DIR = Path(__file__).parent.resolve()
 OUTPUT_FILE = ROOT_DIR / 'visited_files.json'
 SUPPORTED_EXTENSIONS = {'.pdf', '.xlsx', '.xls', '.docx', '.doc', '.md', '.txt', '.pptx', '.ppt', '.csv'}
-EMBED_URL = "http://localhost:11434/api/embeddings"
-EMBED_MODEL = "nomic-embed-text"
-CHUNK_SIZE = 256
-CHUNK_OVERLAP = 40
+CONVERT_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+EMBED_WORKERS = 4
 
 # Global flags and variables
 monitor_running = False
@@ -155,33 +151,27 @@ def stop_monitoring():
 
 # ============== Document Processing Functions ==============
 
-class TqdmToLogger:
-    """Custom tqdm output handler to capture progress bar output"""
-    def __init__(self):
-        self.output = ""
-        
-    def write(self, s):
-        self.output = s.strip()
-        log_process(s)
-        
-    def flush(self):
-        pass
-
-def get_embedding(text):
-    """Get embeddings for text chunks"""
-    response = requests.post(EMBED_URL, json={"model": EMBED_MODEL, "prompt": text})
-    response.raise_for_status()
-    return np.array(response.json()["embedding"], dtype=np.float32)
-
-def chunk_text(text, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
-    """Split text into chunks with overlap"""
-    words = text.split()
-    for i in range(0, len(words), size - overlap):
-        yield " ".join(words[i:i+size])
-
-def file_hash(path):
-    """Calculate file hash to detect changes"""
-    return hashlib.md5(Path(path).read_bytes()).hexdigest()
+# Icons used for pipeline log levels in the processing pane
+LEVEL_ICONS = {
+    "INFO": "📊",
+    "SKIP": "⏭️",
+    "MISS": "❌",
+    "ERROR": "❌",
+    "WARN": "⚠️",
+    "DONE": "✅",
+    "SUCCESS": "🎉",
+    "CHECKPOINT": "💾",
+    "STATS": "🔢",
+}
+
+def log_pipeline(level, message):
+    """Forward ingestion pipeline messages to the processing log"""
+    icon = LEVEL_ICONS.get(level, "•")
+    if level in ("DONE", "SUCCESS"):
+        timestamp = datetime.now().strftime("%H:%M:%S")
+        log_process(f"[{timestamp}] {icon} {message}")
+    else:
+        log_process(f"{icon} {message}")
 
 def process_documents():
     """Process documents and create FAISS index"""
@@ -189,145 +179,29 @@ def process_documents():
     
     timestamp = datetime.now().strftime("%H:%M:%S")
     log_process(f"[{timestamp}] 🔄 Starting document processing...")
-    log_process(f"📊 Indexing documents...")
     
     try:
-        # Set paths directly as in process.py
-        ROOT_DIR = Path(__file__).parent.resolve()
-        DOC_PATH = ROOT_DIR / "documents"
-        INDEX_CACHE = ROOT_DIR / "faiss_index"
-        INDEX_CACHE.mkdir(exist_ok=True)
-        INDEX_FILE = INDEX_CACHE / "index.bin"
-        METADATA_FILE = INDEX_CACHE / "metadata.json"
-        CACHE_FILE = INDEX_CACHE / "doc_index_cache.json"
-        VISITED_FILE = ROOT_DIR / "visited_files.json"
-
         # Check if we have the required packages for document conversion
         try:
-            from markitdown import MarkItDown
-            converter = MarkItDown()
+            import markitdown
         except ImportError:
             log_process("⚠️ MarkItDown package not found. Document processing will be limited.")
             processing_running = False  # Make sure to set this to False before returning
             return
         
-        # Load data from files - simplified error handling
-        CACHE_META = {}
-        metadata = []
-        index = None
-        visited_data = []
-        
-        try:
-            if CACHE_FILE.exists():
-                with open(CACHE_FILE, 'r', encoding='utf-8') as f:
-                    CACHE_META = json.load(f)
-            
-            if METADATA_FILE.exists():
-                with open(METADATA_FILE, 'r', encoding='utf-8') as f:
-                    metadata = json.load(f)
-            
-            if INDEX_FILE.exists():
-                index = faiss.read_index(str(INDEX_FILE))
-            
-            if VISITED_FILE.exists():
-                with open(VISITED_FILE, 'r', encoding='utf-8') as f:
-                    visited_data = json.load(f)
-        except Exception as e:
-            log_process(f"⚠️ Error loading data files: {e}")
-            # Continue with empty data structures rather than failing
-        
-        # Count files that need processing
-        files_to_process = 0
-        for entry in visited_data:
-            file_path = Path(entry['file_path'])
-            if not file_path.exists():
-                continue
-            try:
-                fhash = file_hash(file_path)
-                if entry['file_name'] in CACHE_META and CACHE_META[entry['file_name']] == fhash:
-                    continue
-                files_to_process += 1
-            except Exception as e:
-                log_process(f"⚠️ Error checking file hash for {file_path}: {e}")
-        
-        if files_to_process == 0:
-            log_process("ℹ️ No new files to process.")
-        else:
-            log_process(f"📝 Found {files_to_process} file(s) to process")
-        
-        # Process each file from visited_files.json
-        processed_file_count = 0
-        for entry in visited_data:
-            file_path = Path(entry['file_path'])
-            if not file_path.exists():
-                log_process(f"❌ File not found: {file_path}")
-                continue
-
-            try:
-                fhash = file_hash(file_path)
-                if entry['file_name'] in CACHE_META and CACHE_META[entry['file_name']] == fhash:
-                    log_process(f"⏭️ Skipping unchanged file: {entry['file_name']}")
-                    continue
-
-                processed_file_count += 1
-                processed_count += 1
-                log_process(f"⚙️ Processing: {entry['file_name']} ({processed_file_count}/{files_to_process})")
-                
-                result = converter.convert(str(file_path))
-                markdown = result.text_content
-                chunks = list(chunk_text(markdown))
-                embeddings_for_file = []
-                new_metadata = []
-                
-                # Custom progress handler for tqdm
-                tqdm_handler = TqdmToLogger()
-                
-                for i, chunk in enumerate(tqdm(chunks, desc=f"Embedding {entry['file_name']}", 
-                                            file=tqdm_handler, position=0, leave=True)):
-                    embedding = get_embedding(chunk)
-                    embeddings_for_file.append(embedding)
-                    new_metadata.append({
-                        "doc": entry['file_name'],
-                        "chunk": chunk,
-                        "chunk_id": f"{file_path.stem}_{i}",
-                        "file_path": str(file_path)
-                    })
-                    # Update the progress
-                    progress_pct = round(((i+1) / len(chunks)) * 100)
-                    log_process(f"▶️ Progress: {i+1}/{len(chunks)} chunks embedded ({progress_pct}%)", update_only=True)
-                    
-                if embeddings_for_file:
-                    if index is None:
-                        dim = len(embeddings_for_file[0])
-                        index = faiss.IndexFlatL2(dim)
-                    index.add(np.stack(embeddings_for_file))
-                    metadata.extend(new_metadata)
-                CACHE_META[entry['file_name']] = fhash
-                timestamp = datetime.now().strftime("%H:%M:%S")
-                log_process(f"[{timestamp}] ✅ Completed: {entry['file_name']} - {len(chunks)} chunks indexed")
-            except Exception as e:
-                log_process(f"❌ Failed to process {entry['file_name']}: {e}")
-
-        # Save all data - directly write to files
-        try:
-            with open(CACHE_FILE, 'w', encoding='utf-8') as f:
-                json.dump(CACHE_META, f, indent=2)
-                
-            with open(METADATA_FILE, 'w', encoding='utf-8') as f:
-                json.dump(metadata, f, indent=2)
-                
-            if index and index.ntotal > 0:
-                faiss.write_index(index, str(INDEX_FILE))
-                timestamp = datetime.now().strftime("%H:%M:%S")
-                log_process(f"[{timestamp}] 🎉 Processing complete: Saved FAISS index and metadata")
-            else:
-                log_process("⚠️ No new documents were processed.")
-        except Exception as e:
-            log_process(f"❌ Error saving data: {e}")
+        # Conversion, chunking and embedding run as overlapping stages
+        stats = ingest.process_documents(
+            log=log_pipeline,
+            root=ROOT_DIR,
+            convert_workers=CONVERT_WORKERS,
+            embed_workers=EMBED_WORKERS
+        )
+        processed_count += stats.files_done
         
-        # Reset the file changes flag
+        # Reset the file changes flag, unless the background indexer held the index and the run was skipped
         global file_changes_detected
-        file_changes_detected = False
+        if not stats.skipped:
+            file_changes_detected = False
         
     except Exception as e:
         log_process(f"❌ Critical processing error: {e}")
@@ -1,8 +1,6 @@
 from pydantic import BaseModel
 from typing import Optional, List
-import os
-from dotenv import load_dotenv
-from google import genai
+from llm_client import get_client
 import re
 
 # Optional: import log from agent if shared, else define locally
@@ -14,19 +12,15 @@ except ImportError:
         now = datetime.datetime.now().strftime("%H:%M:%S")
         print(f"[{now}] [{stage}] {msg}")
 
-load_dotenv()
-
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
-
 
 class PerceptionResult(BaseModel):
     user_input: str
-    intent: Optional[str]
+    intent: Optional[str] = None
     entities: List[str] = []
     tool_hint: Optional[str] = None
 
 
-def extract_perception(user_input: str) -> PerceptionResult:
+async def extract_perception(user_input: str) -> PerceptionResult:
     """Extracts intent, entities, and tool hints using LLM"""
 
     prompt = f"""
@@ -43,11 +37,7 @@ Output only the dictionary on a single line. Do NOT wrap it in ```json or other
     """
 
     try:
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=prompt
-        )
-        raw = response.text.strip()
+        raw = (await get_client(log=log).generate(prompt)).strip()
         log("perception", f"LLM output: {raw}")
 
         # Strip Markdown backticks if present
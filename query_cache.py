@@ -0,0 +1,61 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+
+# Configuration
+QUERY_EMBED_CACHE_SIZE = int(os.getenv("QUERY_EMBED_CACHE_SIZE", "1024"))
+QUERY_EMBED_CACHE_TTL = float(os.getenv("QUERY_EMBED_CACHE_TTL", "3600"))
+SEARCH_RESULT_CACHE_SIZE = int(os.getenv("SEARCH_RESULT_CACHE_SIZE", "256"))
+SEARCH_RESULT_CACHE_TTL = float(os.getenv("SEARCH_RESULT_CACHE_TTL", "600"))
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(text):
+    """Case- and whitespace-insensitive form of a query, used as a cache key"""
+    return _SPACE_RE.sub(" ", str(text)).strip().casefold()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire ``ttl`` seconds after being stored.
+
+    A ``maxsize`` or ``ttl`` of 0 disables the cache.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Cached value for key, or None when missing or expired"""
+        with self.lock:
+            item = self.entries.get(key)
+            if item is not None and time.monotonic() - item[0] < self.ttl:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
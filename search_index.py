@@ -0,0 +1,197 @@
+import os
+import time
+import hashlib
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from vector_store import CURRENT_FILE, LEGACY_FILES
+from shards import open_store, index_exists, SHARDS_FILE
+from diversify import diversify as diversify_hits, SEARCH_DIVERSIFY, MMR_FETCH
+from query_cache import TTLCache, normalize_query, SEARCH_RESULT_CACHE_SIZE, SEARCH_RESULT_CACHE_TTL
+
+# Configuration
+SEARCH_INDEX_MMAP = os.getenv("SEARCH_INDEX_MMAP", "0") == "1"
+SEARCH_RELOAD_SECONDS = float(os.getenv("SEARCH_RELOAD_SECONDS", "1.0"))
+SEARCH_HYBRID = os.getenv("SEARCH_HYBRID", "1") == "1"
+SEARCH_LEXICAL_BUDGET_MS = float(os.getenv("SEARCH_LEXICAL_BUDGET_MS", "150"))
+HYBRID_DEPTH = int(os.getenv("HYBRID_DEPTH", "4"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Fuse ranked ID lists into (score, id) pairs, best first; each list adds 1 / (k + rank)"""
+    scores = {}
+    for ranking in rankings:
+        for rank, vid in enumerate(ranking, start=1):
+            scores[vid] = scores.get(vid, 0.0) + 1.0 / (k + rank)
+    return sorted(((score, vid) for vid, score in scores.items()), key=lambda item: -item[0])
+
+
+def _filters_key(filters):
+    return tuple(sorted((name, str(value)) for name, value in (filters or {}).items()))
+
+
+class SearchIndex:
+    """Keeps the committed index generation resident for repeated searches.
+
+    The store is loaded once (optionally memory-mapped) and reused for every
+    query. At most every ``reload_seconds`` a search stats ``CURRENT.json``
+    (or ``SHARDS.json``); when ingestion has committed a newer generation it
+    is loaded on a background thread, reusing the shards that did not
+    change, and swapped in by replacing a single reference. Until then
+    searches keep using the previous generation, so only the very first
+    load is ever waited for.
+
+    Results are cached per generation and query vector (plus k, filters and
+    search parameters), so repeated searches skip the index entirely; the
+    cache is emptied whenever a new generation is swapped in.
+    """
+
+    def __init__(self, index_dir, mmap=SEARCH_INDEX_MMAP, reload_seconds=SEARCH_RELOAD_SECONDS, hybrid=SEARCH_HYBRID):
+        self.index_dir = Path(index_dir)
+        self.mmap = mmap
+        self.reload_seconds = reload_seconds
+        self.hybrid = hybrid
+        self.store = None
+        self.signature = None
+        self.checked_at = 0.0
+        self.reload_lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="lexical")
+        self.results = TTLCache(SEARCH_RESULT_CACHE_SIZE, SEARCH_RESULT_CACHE_TTL)
+
+    def _signature(self):
+        # os.replace() gives CURRENT.json and SHARDS.json a new inode and mtime on every commit
+        signature = []
+        for name in (SHARDS_FILE, CURRENT_FILE, LEGACY_FILES["index"]):
+            try:
+                st = os.stat(self.index_dir / name)
+                signature.append((name, st.st_ino, st.st_mtime_ns, st.st_size))
+            except OSError:
+                continue
+        return tuple(signature) or None
+
+    def current(self, force=False):
+        """Return the resident store, loading a newer committed generation if there is one"""
+        now = time.monotonic()
+        if not force and self.store is not None and now - self.checked_at < self.reload_seconds:
+            return self.store
+        self.checked_at = now
+        signature = self._signature()
+        if signature == self.signature and self.store is not None:
+            return self.store
+        if signature is None or not index_exists(self.index_dir):
+            return self.store
+
+        # Only the first load waits; later ones run on the side and are skipped while another one runs
+        if self.store is None:
+            with self.reload_lock:
+                if self.store is None:
+                    self._load(signature)
+            return self.store
+        if self.reload_lock.acquire(blocking=False):
+            threading.Thread(target=self._reload, args=(signature,), daemon=True, name="index-reload").start()
+        return self.store
+
+    def _load(self, signature):
+        store = open_store(self.index_dir, mmap=self.mmap, readonly=True, previous=self.store)
+        self.store, self.signature = store, signature
+        self.results.clear()
+
+    def _reload(self, signature):
+        # Runs with reload_lock held, which it releases
+        try:
+            if signature != self.signature:
+                self._load(signature)
+        except Exception:
+            pass  # e.g. the generation was superseded mid-load; keep serving the old one
+        finally:
+            self.reload_lock.release()
+
+    @property
+    def generation(self):
+        store = self.current()
+        return store.generation if store is not None else None
+
+    def search(self, query_vectors, k=5, nprobe=None, ef_search=None, filters=None):
+        """Return, per query row, up to k (similarity, entry) pairs from the newest generation"""
+        store = self.current()
+        if store is None:
+            return [[] for _ in range(len(query_vectors))]
+        query_vectors = np.ascontiguousarray(query_vectors, dtype=np.float32)
+        key = self._result_key(store, query_vectors, None, k, nprobe, ef_search, filters)
+        results = self.results.get(key)
+        if results is None:
+            selection = store.select(**filters) if filters else None
+            results = store.search(query_vectors, k=k, nprobe=nprobe, ef_search=ef_search, selection=selection)
+            self.results.put(key, results)
+        return [list(hits) for hits in results]
+
+    @staticmethod
+    def _result_key(store, query_vectors, query, k, nprobe, ef_search, filters, diversify=False):
+        digest = hashlib.blake2b(query_vectors.tobytes(), digest_size=16).digest()
+        return store.generation, digest, query, k, nprobe, ef_search, _filters_key(filters), diversify
+
+    def hybrid_search(self, query, embed, k=5, nprobe=None, ef_search=None, filters=None, diversify=None):
+        """Return up to k (fused score, entry) pairs for a text query.
+
+        The query is embedded first so cached results are returned before any
+        filter or keyword work; on a miss the BM25 keyword search runs on a
+        worker thread while the vector index is searched, and both ranked
+        lists (``HYBRID_DEPTH`` times k deep) are merged with reciprocal rank
+        fusion. The keyword side
+        stops adding terms after ``SEARCH_LEXICAL_BUDGET_MS``. With hybrid
+        search disabled this is a plain vector search. ``filters`` are the
+        keyword arguments of ``VectorStore.select`` and scope both searches.
+        Fused entries carry the vector ``similarity`` (None for keyword-only hits).
+
+        With ``diversify`` (default ``SEARCH_DIVERSIFY``) ``MMR_FETCH`` times k
+        candidates are fetched, adjacent chunks of a document are merged into
+        one passage and k diverse passages are picked by maximal marginal
+        relevance (see ``diversify.diversify``).
+        """
+        def embed_many(queries):
+            return np.stack([np.asarray(embed(text), dtype=np.float32) for text in queries])
+        return self.hybrid_search_batch([query], embed_many, k=k, nprobe=nprobe, ef_search=ef_search,
+                                        filters=filters, diversify=diversify)[0]
+
+    def hybrid_search_batch(self, queries, embed_many, k=5, nprobe=None, ef_search=None, filters=None, diversify=None):
+        """``hybrid_search`` for several queries: one ``embed_many(queries)`` call and one multi-row index search"""
+        store = self.current()
+        if store is None or not queries:
+            return [[] for _ in queries]
+        diversify = SEARCH_DIVERSIFY if diversify is None else diversify
+        vectors = np.ascontiguousarray(np.asarray(embed_many(queries), dtype=np.float32).reshape(len(queries), -1))
+        keys = [self._result_key(store, vectors[i:i + 1], normalize_query(query) if self.hybrid else None,
+                                 k, nprobe, ef_search, filters, diversify) for i, query in enumerate(queries)]
+        results = [self.results.get(key) for key in keys]
+        pending = [i for i, hits in enumerate(results) if hits is None]
+        if not pending:
+            return [list(hits) for hits in results]
+
+        # Only the queries that missed the cache pay for filters and the keyword search
+        selection = store.select(**filters) if filters else None
+        if selection is not None and not selection.any():
+            return [[] if hits is None else list(hits) for hits in results]
+        fetch = k * max(1, MMR_FETCH) if diversify else k
+        depth = max(fetch, k * max(1, HYBRID_DEPTH)) if self.hybrid else fetch
+        deadline = time.monotonic() + SEARCH_LEXICAL_BUDGET_MS / 1000
+        lexical = {i: self.pool.submit(store.search_lexical, queries[i], depth, deadline, selection)
+                   for i in pending} if self.hybrid else {}
+        dense = store.search(vectors[pending], k=depth, nprobe=nprobe, ef_search=ef_search, selection=selection)
+        for i, hits in zip(pending, dense):
+            if self.hybrid:
+                hits = self._fuse(store, hits, lexical[i].result(), fetch)
+            results[i] = diversify_hits(hits, store.chunks, k) if diversify else hits
+            self.results.put(keys[i], results[i])
+        return [list(hits) for hits in results]
+
+    @staticmethod
+    def _fuse(store, dense, keyword, k):
+        fused = reciprocal_rank_fusion([[entry["id"] for _, entry in dense], [vid for _, vid in keyword]])[:k]
+        similarity = {entry["id"]: score for score, entry in dense}
+        entries = {entry["id"]: entry for _, entry in dense}
+        entries.update(store.chunks.get_many([vid for _, vid in fused if vid not in entries], live_only=False))
+        return [(score, dict(entries[vid], similarity=similarity.get(vid))) for score, vid in fused if vid in entries]
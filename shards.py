@@ -0,0 +1,402 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from chunk_store import ChunkStore, CHUNK_STORE_FILE
+from lexical_index import LEXICAL_INDEX_FILE
+from vector_store import (VectorStore, read_current, _write_text, CURRENT_FILE, LEGACY_FILES, _GENERATION_RE,
+                          COMPACT_THRESHOLD)
+import vector_store
+
+# Configuration
+INDEX_SHARD_BY = os.getenv("INDEX_SHARD_BY", "none")  # none, root or size
+INDEX_SHARD_DEPTH = int(os.getenv("INDEX_SHARD_DEPTH", "2"))
+INDEX_SHARD_MAX_VECTORS = int(os.getenv("INDEX_SHARD_MAX_VECTORS", "500000"))
+SHARD_SEARCH_WORKERS = int(os.getenv("SHARD_SEARCH_WORKERS", str(min(8, os.cpu_count() or 1))))
+SHARDS_FILE = "SHARDS.json"
+SHARD_DIR = "shards"
+# Vector IDs seen outside a shard carry the shard number in their top bits
+SHARD_ID_BITS = 40
+_LOCAL_MASK = (1 << SHARD_ID_BITS) - 1
+
+
+def global_id(no, vid):
+    return (no << SHARD_ID_BITS) | int(vid)
+
+
+def split_id(gid):
+    """(shard number, vector ID inside the shard) of a global ID"""
+    return int(gid) >> SHARD_ID_BITS, int(gid) & _LOCAL_MASK
+
+
+def source_root(path, depth=INDEX_SHARD_DEPTH):
+    """The directory ``depth`` levels below the drive or filesystem root that path lives under"""
+    parts = re.split(r"[\\/]+", str(path))
+    return "/".join(parts[:min(depth + 1, len(parts) - 1)]) or "/"
+
+
+def read_manifest(index_dir):
+    manifest = Path(index_dir) / SHARDS_FILE
+    if not manifest.exists():
+        return None
+    return json.loads(manifest.read_text(encoding="utf-8"))
+
+
+def is_sharded(index_dir):
+    """True once readers should use the shards; an unfinished migration keeps serving the single index"""
+    manifest = read_manifest(index_dir)
+    if manifest is None:
+        return False
+    run = manifest.get("run") or {}
+    return run.get("complete", True) or not vector_store.index_exists(index_dir)
+
+
+def index_exists(index_dir):
+    return is_sharded(index_dir) or vector_store.index_exists(index_dir)
+
+
+def open_store(index_dir, mmap=False, readonly=False, previous=None):
+    """Load the single-index ``VectorStore`` or the ``ShardSet`` in index_dir.
+
+    Writers switch to shards when ``INDEX_SHARD_BY`` asks for them; the
+    single index is then re-ingested into shards (from the conversion and
+    embedding caches) and removed once that run completes. A directory that
+    already has shards stays sharded.
+    """
+    if (Path(index_dir) / SHARDS_FILE).exists() and (not readonly or is_sharded(index_dir)):
+        return ShardSet.load(index_dir, mmap=mmap, readonly=readonly, previous=previous)
+    if not readonly and INDEX_SHARD_BY != "none":
+        return ShardSet.load(index_dir)
+    return VectorStore.load(index_dir, mmap=mmap, readonly=readonly)
+
+
+def open_chunks(index_dir):
+    """Read-only chunk lookups for index_dir, across shards if it is sharded; None without an index"""
+    if is_sharded(index_dir):
+        manifest = read_manifest(index_dir)
+        return ShardedChunks({
+            info["no"]: ChunkStore.open(Path(index_dir) / SHARD_DIR / name, readonly=True)
+            for name, info in manifest["shards"].items()
+            if ChunkStore.exists(Path(index_dir) / SHARD_DIR / name)
+        })
+    if not ChunkStore.exists(index_dir):
+        return None
+    return ChunkStore.open(index_dir, readonly=True)
+
+
+class ShardedChunks:
+    """Chunk store lookups by global vector ID, routed to the shard that owns each ID"""
+
+    def __init__(self, stores):
+        self.stores = stores
+
+    def _split(self, ids):
+        groups = {}
+        for gid in ids:
+            no, vid = split_id(gid)
+            if no in self.stores:
+                groups.setdefault(no, []).append(vid)
+        return groups
+
+    def get_many(self, ids, live_only=True):
+        found = {}
+        for no, local in self._split(ids).items():
+            for vid, entry in self.stores[no].get_many(local, live_only=live_only).items():
+                found[global_id(no, vid)] = dict(entry, id=global_id(no, vid))
+        return found
+
+    def get(self, gid):
+        return self.get_many([gid]).get(int(gid))
+
+    def find_vectors(self, ids):
+        found = {}
+        for no, local in self._split(ids).items():
+            for vid, vector in self.stores[no].find_vectors(local).items():
+                found[global_id(no, vid)] = vector
+        return found
+
+    def passage(self, ids):
+        (no, local), = self._split(ids).items()
+        return self.stores[no].passage(local)
+
+    def by_chunk_id(self, chunk_id):
+        for no, store in self.stores.items():
+            entry = store.by_chunk_id(chunk_id)
+            if entry:
+                return dict(entry, id=global_id(no, entry["id"]))
+        return None
+
+    def documents(self):
+        for store in self.stores.values():
+            yield from store.documents()
+
+    def count(self):
+        return sum(store.count() for store in self.stores.values())
+
+    def close(self):
+        for store in self.stores.values():
+            store.close()
+
+
+class ShardSelection(dict):
+    """Per-shard bitmaps of a filtered search, keyed by shard number; shards without matches are left out"""
+
+    def any(self):
+        return bool(self)
+
+
+class ShardSet:
+    """Vector stores split into shards that are committed and loaded independently.
+
+    ``INDEX_SHARD_BY=root`` gives every source root (the directory
+    ``INDEX_SHARD_DEPTH`` levels below the drive) its own shard, ``size``
+    fills shards up to ``INDEX_SHARD_MAX_VECTORS`` vectors. Each shard is a
+    complete ``VectorStore`` under ``shards/<name>/`` with its own chunk
+    store, keyword index and generations, so ingestion only rewrites the
+    shards whose documents changed and a reader only reloads those.
+    ``SHARDS.json`` lists the shards and is rewritten after every save.
+
+    Searches fan out over the shards on a thread pool (FAISS releases the
+    GIL while searching) and merge the per-shard top k. Vector IDs returned
+    by a shard set are global: the shard number sits above the shard's own
+    ID (see ``global_id``), and ``chunks`` resolves them across shards.
+    """
+
+    def __init__(self, index_dir):
+        self.index_dir = Path(index_dir)
+        self.generation = 0
+        self.run_state = None
+        self.shard_by = INDEX_SHARD_BY if INDEX_SHARD_BY != "none" else "root"
+        self.shards = {}
+        self.stores = {}
+        self.owner = {}
+        self.dirty = set()
+        self.lock = threading.RLock()
+        self.pool = None
+        self.chunks = ShardedChunks({})
+        self._compaction = None
+
+    @classmethod
+    def load(cls, index_dir, mmap=False, readonly=False, previous=None):
+        """Open every shard; with ``previous`` (an older ShardSet) unchanged shards are reused, not reloaded"""
+        shards = cls(index_dir)
+        shards.index_dir.mkdir(parents=True, exist_ok=True)
+        manifest = read_manifest(index_dir) or {}
+        shards.generation = manifest.get("generation", 0)
+        shards.run_state = manifest.get("run")
+        shards.shard_by = manifest.get("shard_by", shards.shard_by)
+        shards.shards = manifest.get("shards", {})
+        reusable = previous.stores if isinstance(previous, ShardSet) and readonly else {}
+        for name in shards.shards:
+            shard_dir = shards.index_dir / SHARD_DIR / name
+            current = read_current(shard_dir)
+            old = reusable.get(name)
+            if old is not None and current and current["generation"] == old.generation:
+                shards.stores[name] = old
+            else:
+                shards.stores[name] = VectorStore.load(shard_dir, mmap=mmap, readonly=readonly)
+        shards._index_owners()
+        if not readonly:
+            # Shards upgraded from an older layout on load are written by the next save
+            shards.dirty = {name for name, store in shards.stores.items() if store.dirty}
+        return shards
+
+    def _index_owners(self):
+        self.owner = {path: name for name, store in self.stores.items() for path in store.documents}
+        self.chunks = ShardedChunks({self.shards[name]["no"]: store.chunks for name, store in self.stores.items()})
+
+    @property
+    def documents(self):
+        """All shards' registry entries by path, merged on every access (``document(path)`` looks up one)"""
+        return {path: doc for store in self.stores.values() for path, doc in store.documents.items()}
+
+    @property
+    def ntotal(self):
+        return sum(store.ntotal for store in self.stores.values())
+
+    def document(self, path):
+        """Registry entry of a document, looked up in the shard that owns it"""
+        name = self.owner.get(str(path))
+        return self.stores[name].document(path) if name else None
+
+    def document_hash(self, path):
+        doc = self.document(path)
+        return doc["hash"] if doc else None
+
+    def update_document(self, path, **fields):
+        with self.lock:
+            name = self.owner[str(path)]
+            self.stores[name].update_document(path, **fields)
+            self.dirty.add(name)
+
+    def _assign(self, path):
+        if self.shard_by == "size":
+            sizes = {name: store.ntotal - len(store.tombstones) for name, store in self.stores.items()}
+            open_shards = [name for name in self.shards if sizes.get(name, 0) < INDEX_SHARD_MAX_VECTORS]
+            if open_shards:
+                return open_shards[-1]
+            return self._create(f"shard-{len(self.shards):04d}", None)
+        root = source_root(path)
+        for name, info in self.shards.items():
+            if info.get("root") == root:
+                return name
+        label = re.sub(r"[^A-Za-z0-9_.-]+", "_", root.rstrip("/").split("/")[-1] or "root")[:40]
+        return self._create(f"{label}-{hashlib.blake2b(root.encode('utf-8'), digest_size=4).hexdigest()}", root)
+
+    def _create(self, name, root):
+        no = max((info["no"] for info in self.shards.values()), default=-1) + 1
+        self.shards[name] = {"no": no, "root": root}
+        self.stores[name] = VectorStore.load(self.index_dir / SHARD_DIR / name)
+        self._index_owners()
+        return name
+
+    def add_document(self, path, name, fhash, text, spans, vectors, mtime=None):
+        with self.lock:
+            shard = self.owner.get(str(path)) or self._assign(path)
+            self.stores[shard].add_document(path, name, fhash, text, spans, vectors, mtime=mtime)
+            self.owner[str(path)] = shard
+            self.dirty.add(shard)
+
+    def remove_document(self, path):
+        with self.lock:
+            shard = self.owner.pop(str(path), None)
+            if shard is None:
+                return 0
+            self.dirty.add(shard)
+            return self.stores[shard].remove_document(path)
+
+    def save(self, run_state=None):
+        """Save the shards changed since the last save, then commit a new SHARDS.json.
+
+        Like ``VectorStore.save`` this raises RuntimeError when another
+        writer has committed since this shard set was loaded.
+        """
+        with self.lock:
+            for name in sorted(self.dirty):
+                self.stores[name].save()
+            self.dirty.clear()
+            self._commit(run_state)
+            if not run_state or run_state.get("complete", True):
+                self._remove_single_index()
+
+    def _commit(self, run_state):
+        # Numbered from the manifest on disk, never from a counter a newer commit may have passed
+        committed = (read_manifest(self.index_dir) or {}).get("generation", 0)
+        if committed != self.generation:
+            raise RuntimeError(f"{self.index_dir} moved on to shard generation {committed} after this set "
+                               f"loaded generation {self.generation}; not overwriting it")
+        self.generation = committed + 1
+        self.run_state = run_state
+        self._write_manifest()
+
+    def _write_manifest(self):
+        shards = {name: dict(info, generation=self.stores[name].generation, ntotal=self.stores[name].ntotal)
+                  for name, info in self.shards.items()}
+        _write_text(self.index_dir / SHARDS_FILE, json.dumps({
+            "version": 1,
+            "generation": self.generation,
+            "shard_by": self.shard_by,
+            "shards": shards,
+            "committed_at": time.time(),
+            "run": self.run_state,
+        }, indent=2))
+
+    def _remove_single_index(self):
+        # Left over from before sharding; everything in it has been re-ingested into shards
+        for path in self.index_dir.iterdir():
+            if (path.name in (CURRENT_FILE, *LEGACY_FILES.values()) or _GENERATION_RE.match(path.name)
+                    or path.name.startswith((CHUNK_STORE_FILE, LEXICAL_INDEX_FILE))):
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+    def start_compaction(self, threshold=COMPACT_THRESHOLD, log=None):
+        """Rebuild, one after another on a background thread, the shards that need it"""
+        if self._compaction and self._compaction.is_alive():
+            return None
+        due = [name for name, store in self.stores.items()
+               if store.dead_ratio >= threshold or store.needs_rebuild()]
+        if not due:
+            return None
+
+        def run():
+            for name in due:
+                store = self.stores[name]
+                try:
+                    removed = store.rebuild()
+                    if log:
+                        log("INFO", f"Rebuilt {store.index_type} index of shard {name} over {store.ntotal} "
+                                    f"vector(s), removed {removed} dead vector(s)")
+                except Exception as e:
+                    if log:
+                        log("ERROR", f"Index rebuild of shard {name} failed: {e}")
+            with self.lock:
+                try:
+                    self._commit(self.run_state)
+                except Exception as e:
+                    if log:
+                        log("ERROR", f"Shard manifest update after rebuild failed: {e}")
+
+        self._compaction = threading.Thread(target=run, daemon=True)
+        self._compaction.start()
+        return self._compaction
+
+    def _fan_out(self, call, targets):
+        if len(targets) == 1:
+            return [call(*targets[0])]
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(max_workers=SHARD_SEARCH_WORKERS, thread_name_prefix="shard")
+        return list(self.pool.map(lambda target: call(*target), targets))
+
+    def _targets(self, selection):
+        targets = []
+        for name, store in self.stores.items():
+            no = self.shards[name]["no"]
+            if selection is None:
+                targets.append((no, store, None))
+            elif no in selection:
+                targets.append((no, store, selection[no]))
+        return targets
+
+    def select(self, **filters):
+        """Per-shard bitmaps of the vector IDs matching filters, None without any"""
+        selection = ShardSelection()
+        for name, store in self.stores.items():
+            bitmap = store.select(**filters)
+            if bitmap is None:
+                return None
+            if bitmap.any():
+                selection[self.shards[name]["no"]] = bitmap
+        return selection
+
+    def search(self, query_vectors, k=5, nprobe=None, ef_search=None, selection=None):
+        """``VectorStore.search`` over every shard, merged into one top k per query row"""
+        targets = self._targets(selection)
+        if not targets:
+            return [[] for _ in range(len(query_vectors))]
+        runs = self._fan_out(
+            lambda no, store, bitmap: (no, store.search(query_vectors, k=k, nprobe=nprobe, ef_search=ef_search,
+                                                        selection=bitmap)),
+            targets
+        )
+        merged = []
+        for row in range(len(query_vectors)):
+            hits = [(score, dict(entry, id=global_id(no, entry["id"]))) for no, results in runs for score, entry in results[row]]
+            merged.append(sorted(hits, key=lambda hit: -hit[0])[:k])
+        return merged
+
+    def search_lexical(self, query, k=5, deadline=None, selection=None):
+        """``VectorStore.search_lexical`` over every shard; BM25 statistics are per shard"""
+        targets = self._targets(selection)
+        runs = self._fan_out(
+            lambda no, store, bitmap: (no, store.search_lexical(query, k=k, deadline=deadline, selection=bitmap)),
+            targets
+        )
+        hits = [(score, global_id(no, vid)) for no, results in runs for score, vid in results]
+        return sorted(hits, key=lambda hit: -hit[0])[:k]
@@ -0,0 +1,533 @@
+import os
+import re
+import math
+import json
+import time
+import threading
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+from embeddings import upgrade_legacy_index
+from chunk_store import ChunkStore
+from lexical_index import LexicalIndex
+from document_filters import DocumentFilters
+from index_factory import (choose_index, index_kind, index_encoding, is_lossy, new_index, search_parameters,
+                           similarities, train_size, INDEX_NPROBE, INDEX_RERANK, INDEX_RETRAIN_GROWTH, METRIC)
+
+# Configuration
+COMPACT_THRESHOLD = float(os.getenv("INDEX_COMPACT_THRESHOLD", "0.2"))
+STORE_VERSION = 5
+REBUILD_BATCH = 65536
+# Filtered searches over at most this many vectors score them exactly instead of searching the index
+FILTER_EXACT_MAX = int(os.getenv("FILTER_EXACT_MAX", "4096"))
+CURRENT_FILE = "CURRENT.json"
+LEGACY_FILES = {"index": "index.bin", "metadata": "metadata.json", "cache": "doc_index_cache.json"}
+_GENERATION_RE = re.compile(r"^(?:index|metadata|doc_index_cache)\.(\d+)\.(?:bin|json)$")
+
+
+def _fsync(path):
+    with open(path, "rb+") as f:
+        os.fsync(f.fileno())
+
+
+def _write_text(path, text):
+    """Write through a flushed temp file so readers never see a half-written file"""
+    tmp = Path(str(path) + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def generation_files(generation):
+    """File names that make up one committed generation"""
+    return {
+        "index": f"index.{generation}.bin",
+        "cache": f"doc_index_cache.{generation}.json",
+    }
+
+
+def read_current(index_dir):
+    """Return the CURRENT.json manifest of index_dir, or None for legacy/empty dirs"""
+    current = Path(index_dir) / CURRENT_FILE
+    if not current.exists():
+        return None
+    return json.loads(current.read_text(encoding="utf-8"))
+
+
+def committed_paths(index_dir):
+    """Paths of the index and document registry of the committed generation"""
+    current = read_current(index_dir)
+    files = current["files"] if current else LEGACY_FILES
+    return {key: Path(index_dir) / name for key, name in files.items()}
+
+
+def index_exists(index_dir):
+    return committed_paths(index_dir)["index"].exists()
+
+
+def read_index(path, mmap=False):
+    """Read a FAISS index, optionally memory-mapped instead of loaded into RAM"""
+    if mmap:
+        try:
+            return faiss.read_index(str(path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            pass  # index type without mmap support
+    return faiss.read_index(str(path))
+
+
+class VectorStore:
+    """ID-mapped FAISS index plus a chunk store and per-document ID ranges.
+
+    Every chunk gets a stable int64 ID. Each document owns the contiguous range
+    of IDs it was indexed with, so re-indexing or deleting a file only has to
+    tombstone that range. Tombstoned vectors are skipped at search time and
+    physically dropped by ``rebuild()`` once they pass ``COMPACT_THRESHOLD``.
+
+    The FAISS index type comes from ``index_factory``: exact flat search for
+    small corpora, IVF or HNSW for larger ones. ``rebuild()`` trains a new
+    index from the full-precision vectors in the chunk store whenever the
+    wanted type changes or the corpus outgrows the size it was trained at.
+
+    Chunk entries live in ``chunks.sqlite`` (see ``ChunkStore``), keyed by
+    vector ID and appended as documents are added, with chunk text stored as
+    offsets into one copy of each converted document. The same text is indexed
+    for BM25 keyword search in ``lexical.sqlite`` (see ``LexicalIndex``) under
+    the same vector IDs. Each ``save()`` commits the
+    pending chunk rows and lexical postings, writes a new generation, ``index.<N>.bin``
+    (IndexIDMap2) and ``doc_index_cache.<N>.json`` (documents, ID ranges,
+    tombstones, next free ID), and then atomically switches ``CURRENT.json``
+    to it. Readers only follow ``CURRENT.json``, so the files they see always
+    agree, even if a run dies halfway through a save.
+    """
+
+    def __init__(self, index_dir):
+        self.index_dir = Path(index_dir)
+        self.generation = 0
+        self.run_state = None
+        self.index = None
+        self.chunks = None
+        self.lexical = None
+        self.documents = {}
+        self.tombstones = set()
+        self.next_id = 0
+        self.trained_ntotal = 0
+        # Set by every change a commit has to persist, cleared by save()
+        self.dirty = False
+        self.lock = threading.RLock()
+        self._compaction = None
+        self._filters = None
+
+    @classmethod
+    def load(cls, index_dir, mmap=False, readonly=False):
+        """Open the store in index_dir, upgrading files written by older versions.
+
+        ``mmap`` maps the index file instead of reading it into memory and
+        ``readonly`` opens the chunk store for searching only; both are meant
+        for readers such as the MCP server, never for ingestion. A reader
+        never writes: it upgrades an older layout into in-memory stores, and
+        the next writer commit makes the upgrade permanent.
+        """
+        store = cls(index_dir)
+        store.index_dir.mkdir(parents=True, exist_ok=True)
+        current = read_current(store.index_dir)
+        if current:
+            store.generation = current["generation"]
+            store.run_state = current.get("run")
+        paths = committed_paths(store.index_dir)
+        cache = json.loads(paths["cache"].read_text(encoding="utf-8")) if paths["cache"].exists() else {}
+        index = read_index(paths["index"], mmap=mmap) if paths["index"].exists() else None
+        upgrade = cache.get("version") != STORE_VERSION
+        in_memory = readonly and (upgrade or not LexicalIndex.exists(store.index_dir))
+        chunks_writable = not readonly
+        if in_memory:
+            # Rows the files on disk lack are rebuilt in memory, for this reader only
+            if cache.get("version") in (3, 4, STORE_VERSION) and ChunkStore.exists(store.index_dir):
+                store.chunks = ChunkStore.open(store.index_dir, readonly=True)
+            else:
+                store.chunks, chunks_writable = ChunkStore(":memory:"), True
+            store.lexical = LexicalIndex(":memory:")
+        else:
+            store.chunks = ChunkStore.open(store.index_dir, readonly=readonly)
+            store.lexical = LexicalIndex.open(store.index_dir, readonly=readonly)
+
+        if cache.get("version") in (2, 3, 4, STORE_VERSION):
+            store.index = index
+            store.documents = cache.get("documents", {})
+            store.tombstones = set(cache.get("tombstones", []))
+            store.next_id = cache.get("next_id", 0)
+            store.trained_ntotal = cache.get("trained_ntotal", 0)
+            if cache["version"] == 2:
+                # Generations before the chunk store kept every entry in metadata.<N>.json
+                entries = json.loads(paths["metadata"].read_text(encoding="utf-8"))
+                store.chunks.append(entries)
+        else:
+            entries = json.loads(paths["metadata"].read_text(encoding="utf-8")) if paths["metadata"].exists() else []
+            store._upgrade_legacy(index, entries, cache)
+        # Upgraded in memory; the next commit writes the current layout
+        store.dirty = store.index is not None and upgrade
+        if cache.get("version") not in (4, STORE_VERSION) and store.index is not None and chunks_writable:
+            store._backfill_vectors()
+        if in_memory or (upgrade and store.index is not None):
+            store._backfill_lexical()
+        if not readonly:
+            # Keyword postings wait for save(), so they only become visible with the generation that needs them
+            store.chunks.commit()
+        elif in_memory:
+            store.chunks.commit()
+            store.lexical.commit()
+        return store
+
+    def _backfill_vectors(self):
+        # Stores from before version 4 only had their vectors in the (flat) index
+        ids = faiss.vector_to_array(self.index.id_map)
+        for start in range(0, len(ids), REBUILD_BATCH):
+            count = min(REBUILD_BATCH, len(ids) - start)
+            self.chunks.put_vectors(ids[start:start + count], self.index.index.reconstruct_n(start, count))
+
+    def _backfill_lexical(self):
+        # Stores from before version 5 had no keyword index; it is rebuilt from scratch, so
+        # postings left behind by an upgrade that never committed are not indexed twice
+        self.lexical.clear()
+        if self.index is None:
+            return
+        ids = faiss.vector_to_array(self.index.id_map)
+        for start in range(0, len(ids), REBUILD_BATCH):
+            batch = [int(vid) for vid in ids[start:start + REBUILD_BATCH] if vid not in self.tombstones]
+            entries = self.chunks.get_many(batch)
+            found = sorted(entries)
+            self.lexical.add(found, [entries[vid]["chunk"] for vid in found])
+
+    def _upgrade_legacy(self, index, entries, name_hashes):
+        # Old layout: IndexFlatL2 rows in metadata order, doc_index_cache keyed by file name
+        if index is not None and not hasattr(index, "id_map"):
+            index = upgrade_legacy_index(index)
+            mapped = faiss.IndexIDMap2(faiss.IndexFlatL2(index.d))
+            if index.ntotal:
+                mapped.add_with_ids(index.reconstruct_n(0, index.ntotal), np.arange(index.ntotal, dtype=np.int64))
+            index = mapped
+        self.index = index
+        entries = [dict(entry, id=i, file_path=entry.get("file_path", entry["doc"])) for i, entry in enumerate(entries)]
+        self.chunks.append(entries)
+        for i, entry in enumerate(entries):
+            path = entry["file_path"]
+            doc = self.documents.get(path)
+            if doc and doc["ids"][1] == i:
+                doc["ids"][1] = i + 1
+                continue
+            if doc:
+                # Older runs appended changed files again; the earlier copy is stale
+                self.chunks.mark_dead(*doc["ids"])
+                self.tombstones.update(range(*doc["ids"]))
+            self.documents[path] = {
+                "doc": entry["doc"],
+                "hash": name_hashes.get(entry["doc"]),
+                "ids": [i, i + 1],
+            }
+        self.next_id = len(entries)
+
+    def document(self, path):
+        """Registry entry of a document, or None"""
+        return self.documents.get(str(path))
+
+    def document_hash(self, path):
+        doc = self.document(path)
+        return doc["hash"] if doc else None
+
+    def update_document(self, path, **fields):
+        """Change fields of a document's registry entry (hash, mtime) without re-indexing it"""
+        with self.lock:
+            self.documents[str(path)].update(fields)
+            self.dirty = True
+            self._filters = None
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal if self.index is not None else 0
+
+    @property
+    def dead_ratio(self):
+        return len(self.tombstones) / self.ntotal if self.ntotal else 0.0
+
+    @property
+    def index_type(self):
+        return index_kind(self.index) if self.index is not None else None
+
+    @property
+    def encoding(self):
+        return index_encoding(self.index) if self.index is not None else None
+
+    @property
+    def filters(self):
+        """Per-attribute bitmaps of the current documents, rebuilt after they change"""
+        with self.lock:
+            if self._filters is None or self._filters.size != self.next_id:
+                self._filters = DocumentFilters(self.documents, self.next_id)
+            return self._filters
+
+    def select(self, **filters):
+        """Bitmap of the vector IDs matching filters (see ``DocumentFilters.select``), None without any"""
+        return self.filters.select(**filters)
+
+    def needs_rebuild(self):
+        """True when the corpus size or settings call for another index type, encoding or a retrain"""
+        if self.index is None:
+            return False
+        live = self.ntotal - len(self.tombstones)
+        if choose_index(live) != (self.index_type, self.encoding) or self.index.metric_type != METRIC:
+            return True
+        trained = self.index_type in ("ivf_flat", "ivf_pq") or self.encoding in ("sq8", "pq")
+        return trained and live > self.trained_ntotal * INDEX_RETRAIN_GROWTH
+
+    def add_document(self, path, name, fhash, text, spans, vectors, mtime=None):
+        """Index a document's chunks, replacing any previous version of it.
+
+        ``text`` is the converted document as UTF-8 bytes and ``spans`` the
+        (start, end) byte offsets of the chunks that ``vectors`` embed.
+        ``mtime`` (epoch seconds) is kept for date filters.
+        """
+        path = str(path)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self.lock:
+            self.remove_document(path)
+            start = self.next_id
+            ids = np.arange(start, start + len(spans), dtype=np.int64)
+            if len(spans):
+                stem = Path(path).stem
+                self.chunks.append_document(start, path, name, text, spans,
+                                            [f"{stem}_{i}" for i in range(len(spans))], vectors)
+                if self.index is None:
+                    # Too few vectors to train anything yet; rebuild() switches type later
+                    self.index = new_index(*choose_index(0), vectors.shape[1])
+                self.index.add_with_ids(vectors, ids)
+                self.lexical.add(ids, [text[a:b].decode("utf-8", errors="ignore") for a, b in spans])
+            self.next_id = start + len(spans)
+            self.documents[path] = {"doc": name, "hash": fhash, "ids": [start, self.next_id], "mtime": mtime}
+            self.dirty = True
+            self._filters = None
+
+    def remove_document(self, path):
+        """Tombstone every vector of a document; returns the number removed"""
+        with self.lock:
+            doc = self.documents.pop(str(path), None)
+            if not doc:
+                return 0
+            start, end = doc["ids"]
+            self.chunks.mark_dead(start, end)
+            self.tombstones.update(range(start, end))
+            self.dirty = True
+            self._filters = None
+            return end - start
+
+    def search(self, query_vectors, k=5, nprobe=None, ef_search=None, selection=None):
+        """Return, per query row, up to k live (similarity, entry) pairs, most similar first.
+
+        Similarity is the inner product of the unit-length query and chunk
+        vectors. ``nprobe`` (IVF lists to visit) and ``ef_search`` (HNSW
+        candidate list size) trade speed for recall on approximate indexes;
+        flat ignores them. Indexes holding quantized codes over-fetch
+        ``INDEX_RERANK`` times k candidates and re-rank them against the
+        full-precision vectors in the chunk store.
+
+        ``selection`` (a boolean array over vector IDs, see ``select()``)
+        restricts the search to those IDs: small selections are scored
+        exactly from the stored vectors, larger ones are passed to FAISS as
+        an ID selector so the index skips everything else while searching.
+        """
+        query_vectors = np.ascontiguousarray(query_vectors, dtype=np.float32)
+        with self.lock:
+            if self.index is None or self.index.ntotal == 0:
+                return [[] for _ in range(len(query_vectors))]
+            limit, selector = self.index.ntotal, None
+            if selection is not None:
+                selected = np.flatnonzero(selection)
+                if len(selected) <= FILTER_EXACT_MAX:
+                    return self._search_exact(query_vectors, selected, k)
+                # The bitmap has to outlive the selector, which only points at it
+                bitmap = np.packbits(selection, bitorder="little")
+                selector = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+                limit = min(limit, len(selected))
+                if self.index_type in ("ivf_flat", "ivf_pq"):
+                    # Only a fraction of each list passes the filter; probe more lists to score as many vectors
+                    nprobe = math.ceil((nprobe or INDEX_NPROBE) * self.index.ntotal / len(selected))
+            lossy = is_lossy(self.index)
+            want = k * max(1, INDEX_RERANK) if lossy else k
+            # Fetch enough to cover the expected share of tombstoned hits; the loop below widens the rest
+            dead = 0.0 if selector else self.dead_ratio
+            fetch = min(limit, math.ceil(want / max(1.0 - dead, 0.5)))
+            while True:
+                params = search_parameters(self.index, fetch, nprobe=nprobe, ef_search=ef_search, selector=selector)
+                D, I = self.index.search(query_vectors, fetch, params=params)
+                candidates = [
+                    [(float(score), int(vid)) for score, vid in zip(scores, ids) if vid >= 0 and vid not in self.tombstones]
+                    for scores, ids in zip(similarities(self.index, D), I)
+                ]
+                if lossy:
+                    candidates = self._rerank(query_vectors, candidates, k)
+                else:
+                    candidates = [row[:k] for row in candidates]
+                entries = self.chunks.get_many({vid for row in candidates for _, vid in row}, live_only=False)
+                results = [[(score, entries[vid]) for score, vid in row if vid in entries][:k] for row in candidates]
+                # Tombstones and rows compacted away by a newer generation leave gaps; widen the search
+                if fetch >= limit or all(len(hits) == k for hits in results):
+                    return results
+                fetch = min(limit, fetch * 2)
+
+    def _search_exact(self, query_vectors, ids, k):
+        # Brute force over a few stored vectors beats any index pass over the whole corpus
+        vectors = self.chunks.find_vectors(ids)
+        if not vectors:
+            return [[] for _ in range(len(query_vectors))]
+        found = np.fromiter(vectors, dtype=np.int64, count=len(vectors))
+        scores = query_vectors @ np.stack([vectors[vid] for vid in found]).T
+        top = np.argsort(-scores, axis=1)[:, :k]
+        entries = self.chunks.get_many(set(found[top].ravel().tolist()), live_only=False)
+        return [[(float(scores[row, i]), entries[found[i]]) for i in top[row] if found[i] in entries]
+                for row in range(len(query_vectors))]
+
+    def search_lexical(self, query, k=5, deadline=None, selection=None):
+        """Return up to k live (BM25 score, vector ID) pairs for a keyword query, optionally within selection"""
+        return self.lexical.search(query, k=k, exclude=self.tombstones, deadline=deadline, allowed=selection)
+
+    def _rerank(self, query_vectors, candidates, k):
+        # Exact inner products against the full-precision vectors kept in the chunk store
+        vectors = self.chunks.find_vectors({vid for row in candidates for _, vid in row})
+        reranked = []
+        for query, row in zip(query_vectors, candidates):
+            ids = [vid for _, vid in row if vid in vectors]
+            if not ids:
+                reranked.append([])
+                continue
+            scores = np.stack([vectors[vid] for vid in ids]) @ query
+            reranked.append([(float(scores[i]), ids[i]) for i in np.argsort(-scores)[:k]])
+        return reranked
+
+    def save(self, run_state=None):
+        """Commit the index, chunk rows and document registry as a new generation.
+
+        ``run_state`` is recorded in CURRENT.json so the next run can tell an
+        interrupted ingestion (a checkpoint) from a completed one. Raises
+        RuntimeError, without writing anything, when another store has
+        committed since this one was loaded or last saved: its changes would
+        be lost otherwise.
+        """
+        with self.lock:
+            self.index_dir.mkdir(parents=True, exist_ok=True)
+            current = read_current(self.index_dir)
+            committed = current["generation"] if current else 0
+            if committed != self.generation:
+                raise RuntimeError(f"{self.index_dir} moved on to generation {committed} after this store "
+                                   f"loaded generation {self.generation}; not overwriting it")
+            generation = committed + 1
+            files = generation_files(generation)
+            if self.index is not None:
+                index_path = self.index_dir / files["index"]
+                faiss.write_index(self.index, str(index_path) + ".tmp")
+                _fsync(str(index_path) + ".tmp")
+                os.replace(str(index_path) + ".tmp", index_path)
+            # Chunk rows and postings must be durable before any generation refers to them
+            self.chunks.commit()
+            self.lexical.commit()
+            _write_text(self.index_dir / files["cache"], json.dumps({
+                "version": STORE_VERSION,
+                "next_id": self.next_id,
+                "documents": self.documents,
+                "tombstones": sorted(self.tombstones),
+                "trained_ntotal": self.trained_ntotal,
+            }, indent=2))
+
+            # The commit point: readers switch to the new files all at once
+            _write_text(self.index_dir / CURRENT_FILE, json.dumps({
+                "generation": generation,
+                "files": files,
+                "committed_at": time.time(),
+                "ntotal": self.ntotal,
+                "run": run_state,
+            }, indent=2))
+            self.generation = generation
+            self.run_state = run_state
+            self.dirty = False
+            self._remove_old_generations()
+
+    def _remove_old_generations(self):
+        # Keep the previous generation for readers that are still using it
+        for path in self.index_dir.iterdir():
+            match = _GENERATION_RE.match(path.name)
+            if match and int(match.group(1)) < self.generation - 1:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+    def build_index(self, ids, kind, encoding, dim):
+        """Build a new index of the given type over the stored vectors of ids"""
+        sample = None
+        if train_size(kind, encoding, len(ids)):
+            picked = np.random.default_rng(0).choice(ids, train_size(kind, encoding, len(ids)), replace=False)
+            sample = self.chunks.get_vectors(np.sort(picked))
+        index = new_index(kind, encoding, dim, len(ids), sample)
+        del sample
+        for start in range(0, len(ids), REBUILD_BATCH):
+            batch = ids[start:start + REBUILD_BATCH]
+            index.add_with_ids(self.chunks.get_vectors(batch), batch)
+        return index
+
+    def rebuild(self, kind=None, encoding=None):
+        """Rebuild the index from the stored vectors without tombstoned ones and save it.
+
+        The index type and encoding are picked by ``choose_index`` for the live
+        corpus size unless given, and types that need training are trained on
+        a sample of the stored full-precision vectors. Returns the number of
+        dead vectors dropped.
+        """
+        with self.lock:
+            if self.index is None:
+                return 0
+            dead = set(self.tombstones)
+            snapshot_total = self.index.ntotal
+            ids = faiss.vector_to_array(self.index.id_map).copy()
+            dim = self.index.d
+
+        # The expensive rebuild runs without the lock so searches and ingestion continue
+        live = ids[~np.isin(ids, np.fromiter(dead, dtype=np.int64, count=len(dead)))]
+        chosen = choose_index(len(live))
+        rebuilt = self.build_index(live, kind or chosen[0], encoding or chosen[1], dim)
+        self.lexical.merge(drop=dead)
+
+        with self.lock:
+            # Carry over vectors added while the rebuild was running
+            if self.index.ntotal > snapshot_total:
+                new_ids = faiss.vector_to_array(self.index.id_map)[snapshot_total:].copy()
+                rebuilt.add_with_ids(self.chunks.get_vectors(new_ids), new_ids)
+            self.index = rebuilt
+            self.trained_ntotal = len(live)
+            self.tombstones -= dead
+            self.save()
+            # Only drop the rows once no committed generation can return their IDs
+            self.chunks.delete(dead)
+            self.chunks.commit()
+        return len(ids) - len(live)
+
+    def start_compaction(self, threshold=COMPACT_THRESHOLD, log=None):
+        """Rebuild on a background thread once dead vectors pass the threshold or the index needs retraining"""
+        if self._compaction and self._compaction.is_alive():
+            return None
+        if self.dead_ratio < threshold and not self.needs_rebuild():
+            return None
+
+        def run():
+            try:
+                removed = self.rebuild()
+                if log:
+                    log("INFO", f"Rebuilt {self.index_type} index over {self.ntotal} vector(s), "
+                                f"removed {removed} dead vector(s)")
+            except Exception as e:
+                if log:
+                    log("ERROR", f"Index rebuild failed: {e}")
+
+        self._compaction = threading.Thread(target=run, daemon=True)
+        self._compaction.start()
+        return self._compaction